@@ -6,41 +6,358 @@ import os
 import time
 import json
 import logging
-import arxiv
+import threading
+import re
 import requests
-from typing import Dict, List, Optional, Tuple
-from datetime import datetime
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import Future
+from datetime import datetime, timezone
 
 from utils import (
-    format_arxiv_id, format_folder_name, extract_tar_gz,
-    process_tex_files, clean_version_folder, ensure_dir, clean_temp_files
+    format_arxiv_id, format_folder_name, extract_main_files,
+    ensure_dir, clean_temp_files, get_releasable_size, OversizedSourceError
 )
-from config import ARXIV_API_DELAY, MAX_RETRIES, RETRY_DELAY
+from config import (
+    MAX_RETRIES, RETRY_DELAY, ARXIV_API_URL, ARXIV_EPRINT_URL, ARXIV_SRC_URL,
+    METADATA_BATCH_SIZE, EXTRA_FIGURE_ENVIRONMENTS, MAX_FILE_SIZE
+)
+from rate_limiter import get_rate_limiter, ARXIV_HOST
+from instrumentation import timed, timed_sleep, span
+from run_state import STATUS_METADATA, STATUS_SOURCES, STATUS_FAILED
 
 logger = logging.getLogger(__name__)
 
+GZIP_MAGIC = b'\x1f\x8b'
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+ARXIV_NS = '{http://arxiv.org/schemas/atom}'
+
+VENUE_KEYWORDS = ['conference', 'workshop', 'published', 'accepted', 'journal', 'proceedings']
+
+
+def _parse_atom_date(value: Optional[str]) -> Optional[datetime]:
+    """Parse an Atom timestamp (e.g. "2023-11-24T18:59:59Z") as a UTC datetime"""
+    if not value:
+        return None
+    return datetime.strptime(value.strip(), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+
+def _entry_text(entry: ET.Element, tag: str) -> Optional[str]:
+    element = entry.find(tag)
+    if element is None or element.text is None:
+        return None
+    # Surrounding whitespace is stripped, as the arxiv library (feedparser) does
+    return element.text.strip()
+
+
+class AtomEntryParser:
+    """
+    Push parser for an arXiv API Atom feed
+    
+    Entries are returned as soon as their closing tag arrives and then
+    dropped from the tree, so memory stays flat for large id_list responses.
+    Body chunks can come from a blocking or an asyncio response.
+    """
+    
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=('end',))
+        self.entry_tag = f'{ATOM_NS}entry'
+    
+    def feed(self, chunk: bytes) -> List[Dict]:
+        """Feed one body chunk and return the entries it completed"""
+        self.parser.feed(chunk)
+        return list(self._drain())
+    
+    def close(self) -> List[Dict]:
+        """Finish parsing and return any remaining entries"""
+        self.parser.close()
+        return list(self._drain())
+    
+    def _drain(self) -> Iterator[Dict]:
+        for _, element in self.parser.read_events():
+            if element.tag != self.entry_tag:
+                continue
+            
+            entry_id = _entry_text(element, f'{ATOM_NS}id') or ''
+            pdf_url = None
+            for link in element.findall(f'{ATOM_NS}link'):
+                if link.get('title') == 'pdf':
+                    pdf_url = link.get('href')
+                    break
+            primary = element.find(f'{ARXIV_NS}primary_category')
+            
+            entry = {
+                'entry_id': entry_id,
+                'title': _entry_text(element, f'{ATOM_NS}title') or '',
+                'summary': _entry_text(element, f'{ATOM_NS}summary') or '',
+                'published': _parse_atom_date(_entry_text(element, f'{ATOM_NS}published')),
+                'updated': _parse_atom_date(_entry_text(element, f'{ATOM_NS}updated')),
+                'authors': [(name.text or '').strip() for name in element.iter(f'{ATOM_NS}name')],
+                'categories': [c.get('term') for c in element.findall(f'{ATOM_NS}category')],
+                'primary_category': primary.get('term') if primary is not None else None,
+                'doi': _entry_text(element, f'{ARXIV_NS}doi'),
+                'journal_ref': _entry_text(element, f'{ARXIV_NS}journal_ref'),
+                'comment': _entry_text(element, f'{ARXIV_NS}comment'),
+                'pdf_url': pdf_url
+            }
+            element.clear()
+            yield entry
+
+
+def parse_atom_entries(chunks: Iterable[bytes]) -> Iterator[Dict]:
+    """
+    Incrementally parse an arXiv API Atom feed
+    
+    Args:
+        chunks: Raw response body chunks
+    
+    Yields:
+        One dictionary per <entry> with the raw feed fields
+    """
+    parser = AtomEntryParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def tag_entries(entries: Iterable[Dict]) -> List[Dict]:
+    """Add 'arxiv_id' and 'version' to parsed entries, dropping error entries"""
+    tagged = []
+    for entry in entries:
+        entry['arxiv_id'], entry['version'] = split_entry_id(entry['entry_id'])
+        if entry['arxiv_id'] is not None:
+            tagged.append(entry)
+    return tagged
+
+
+def split_entry_id(entry_id: str) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Split an Atom entry id into arXiv ID and version number
+    
+    Args:
+        entry_id: Entry id (e.g., "http://arxiv.org/abs/2311.14685v2")
+    
+    Returns:
+        Tuple of (arxiv_id, version), or (None, None) for error entries
+    """
+    if '/abs/' not in entry_id:
+        return None, None
+    versioned_id = entry_id.rsplit('/abs/', 1)[1]
+    base_id, sep, version = versioned_id.rpartition('v')
+    if not sep or not version.isdigit():
+        return versioned_id, None
+    return base_id, int(version)
+
+
+def build_metadata(entry: Dict, arxiv_id: str) -> Dict:
+    """
+    Build the metadata.json dictionary from a parsed Atom entry
+    
+    Args:
+        entry: Entry dictionary from parse_atom_entries
+        arxiv_id: arXiv ID without version
+    
+    Returns:
+        Metadata dictionary
+    """
+    comment = entry['comment']
+    # publication_venue can be from journal_ref or comment field
+    publication_venue = entry['journal_ref'] if entry['journal_ref'] else (
+        comment if comment and any(
+            keyword in comment.lower() for keyword in VENUE_KEYWORDS
+        ) else None
+    )
+    
+    return {
+        'title': entry['title'],
+        'authors': entry['authors'],
+        'submission_date': entry['published'].isoformat() if entry['published'] else None,
+        'revised_dates': [],  # Will be populated from all versions
+        'publication_venue': publication_venue,  # Required by Lab 1
+        'abstract': entry['summary'],
+        'categories': entry['categories'],
+        'primary_category': entry['primary_category'],
+        'doi': entry['doi'],
+        'journal_ref': entry['journal_ref'],
+        'arxiv_id': arxiv_id,
+        'pdf_url': entry['pdf_url'],
+        'comment': comment
+    }
+
+
+def collect_latest_entries(entries: List[Dict]) -> Tuple[Dict, Dict, List[str]]:
+    """
+    Index the entries of an unversioned id_list query
+    
+    The unversioned entry describes the latest version: its id gives the
+    version count and <updated> that version's date, <published> is v1.
+    
+    Args:
+        entries: Tagged entries (see tag_entries)
+    
+    Returns:
+        Tuple of (metadata by ID, version number -> date by ID,
+        versioned IDs of intermediate versions whose dates are still missing)
+    """
+    found = {}
+    version_dates = {}
+    intermediate_ids = []
+    for entry in entries:
+        arxiv_id = entry['arxiv_id']
+        latest = entry['version'] or 1
+        found[arxiv_id] = build_metadata(entry, arxiv_id)
+        version_dates[arxiv_id] = {}
+        if latest > 1 and entry['updated']:
+            version_dates[arxiv_id][latest] = entry['updated'].isoformat()
+        intermediate_ids.extend(f"{arxiv_id}v{v}" for v in range(2, latest))
+    return found, version_dates, intermediate_ids
+
+
+def add_version_dates(version_dates: Dict, entries: List[Dict]):
+    """Record the dates from a query on versioned IDs into version_dates"""
+    for entry in entries:
+        if entry['arxiv_id'] in version_dates and entry['version'] and entry['updated']:
+            version_dates[entry['arxiv_id']][entry['version']] = entry['updated'].isoformat()
+
+
+def finalize_window(chunk: List[str], found: Dict, version_dates: Dict) -> Dict[str, Optional[Dict]]:
+    """
+    Fill revised_dates and map every requested ID to its metadata (None if not found)
+    
+    Args:
+        chunk: IDs requested in the window
+        found: Metadata by ID from collect_latest_entries
+        version_dates: Version dates by ID
+    
+    Returns:
+        Dictionary mapping arXiv ID to metadata or None
+    """
+    results = {}
+    for arxiv_id in chunk:
+        metadata = found.get(arxiv_id)
+        if metadata is None:
+            logger.warning(f"Paper {arxiv_id} not found")
+        else:
+            dates = version_dates[arxiv_id]
+            metadata['revised_dates'] = sorted(set(dates[v] for v in sorted(dates)))
+            logger.info(f"Retrieved metadata for {arxiv_id}: {metadata['title']}")
+        results[arxiv_id] = metadata
+    return results
+
+
+def get_latest_version(metadata: Dict) -> int:
+    """
+    Get the latest version number of a paper from its metadata
+    
+    pdf_url comes from the same lookup and always points at the latest
+    version (e.g., ".../pdf/2311.14685v3"); revised_dates holds one date
+    per version after v1 and is used when the link is missing.
+    
+    Args:
+        metadata: Metadata dictionary from get_papers_metadata_batch
+    
+    Returns:
+        Latest version number (1 for single-version papers)
+    """
+    match = re.search(r'v(\d+)$', metadata.get('pdf_url') or '')
+    if match:
+        return int(match.group(1))
+    return 1 + len(metadata.get('revised_dates') or [])
+
+
+class PaperSources:
+    """
+    A paper between ArxivScraper.fetch_paper and finish_paper: sources
+    downloaded, extractions possibly still running in the extraction pool
+    """
+    
+    def __init__(self, arxiv_id: str, paper_dir: str, metadata: Optional[Dict], start_time: float):
+        self.arxiv_id = arxiv_id
+        self.paper_dir = paper_dir
+        self.metadata = metadata
+        self.start_time = start_time
+        self.temp_dir = os.path.join(paper_dir, "temp")
+        self.versions_downloaded = 0
+        # (version_dir, tar_path, Future of the extract_main_files result) not accounted for yet
+        self.extractions: List[Tuple[str, str, Future]] = []
+
 
 class ArxivScraper:
     """Scraper for arXiv papers"""
     
-    def __init__(self, output_dir: str):
+    def __init__(self, output_dir: str, disk_ledger=None, run_state=None, source_cache=None,
+                 dedup=None):
         """
         Initialize arXiv scraper
         
         Args:
             output_dir: Base directory for output
+            disk_ledger: Optional DiskLedger that is told about every byte written or deleted
+            run_state: Optional RunState that records each paper's lifecycle
+            source_cache: Optional SourceCache consulted before any source download
+            dedup: Optional DedupIndex that hardlinks repeated paper.tex / references.bib files
         """
         self.output_dir = output_dir
-        self.client = arxiv.Client()
+        self.disk_ledger = disk_ledger
+        self.run_state = run_state
+        self.source_cache = source_cache
+        self.dedup = dedup
+        # Optional AsyncHttpEngine; when set, all versions of a paper are downloaded concurrently
+        self.engine = None
+        # Optional stage_pipeline.ExtractionPool; when set, archives are extracted in worker processes
+        self.extract_pool = None
+        self.api_url = ARXIV_API_URL
+        self.eprint_url = ARXIV_EPRINT_URL
+        self.src_url = ARXIV_SRC_URL
+        # Pacing is done by the shared arXiv token bucket so that several
+        # worker threads can make requests without exceeding the rate limit
+        self.limiter = get_rate_limiter(ARXIV_HOST)
+        self.stats_lock = threading.Lock()
         self.stats = {
             'papers_attempted': 0,
             'papers_successful': 0,
             'papers_failed': 0,
             'versions_downloaded': 0,
             'total_download_time': 0.0,
-            'total_processing_time': 0.0
+            'total_bytes_downloaded': 0,
+            'downloads_rejected': 0,
+            'sources_oversized': 0,
+            'total_processing_time': 0.0,
+            'metadata_requests': 0
         }
     
+    def _update_stat(self, key: str, value=1):
+        """Thread-safe increment of a counter in self.stats"""
+        with self.stats_lock:
+            self.stats[key] += value
+    
+    def _record_disk(self, delta: int):
+        if self.disk_ledger is not None:
+            self.disk_ledger.add(delta)
+    
+    def _deduplicate(self, version_dir: str, extract_stats: Dict) -> int:
+        """Hardlink the files just written to identical earlier ones; returns bytes saved"""
+        if self.dedup is None:
+            return 0
+        saved = 0
+        if extract_stats['kept_tex']:
+            saved += self.dedup.deduplicate(os.path.join(version_dir, 'paper.tex'))
+        if extract_stats['kept_bib']:
+            saved += self.dedup.deduplicate(os.path.join(version_dir, 'references.bib'))
+        return saved
+    
+    def _mark(self, arxiv_id: str, status: str, reason: Optional[str] = None):
+        if self.run_state is not None:
+            self.run_state.mark(arxiv_id, status, reason)
+    
+    def _fail(self, arxiv_id: str, reason: str) -> bool:
+        """Count a failed paper and record why"""
+        self._update_stat('papers_failed')
+        self._mark(arxiv_id, STATUS_FAILED, reason)
+        return False
+    
     def get_paper_metadata(self, arxiv_id: str) -> Optional[Dict]:
         """
         Get metadata for a paper
@@ -51,251 +368,360 @@ class ArxivScraper:
         Returns:
             Metadata dictionary or None if failed
         """
+        return self.get_papers_metadata_batch([arxiv_id]).get(arxiv_id)
+    
+    @timed('metadata_query')
+    def _query_entries(self, id_list: List[str]) -> Optional[List[Dict]]:
+        """
+        Run one id_list query and parse the feed while it streams in
+        
+        Args:
+            id_list: arXiv IDs, with or without version (at most METADATA_BATCH_SIZE)
+        
+        Returns:
+            Parsed entries with 'arxiv_id' and 'version' added,
+            or None if the request failed after all retries
+        """
+        params = {
+            'id_list': ','.join(id_list),
+            'max_results': len(id_list)
+        }
+        
         for attempt in range(MAX_RETRIES):
             try:
-                search = arxiv.Search(id_list=[arxiv_id])
-                paper = next(self.client.results(search))
-                
-                # Extract metadata
-                # Note: revised_dates will be populated later when downloading all versions
-                # publication_venue can be from journal_ref or comment field
-                publication_venue = paper.journal_ref if paper.journal_ref else (
-                    paper.comment if paper.comment and any(
-                        keyword in paper.comment.lower() 
-                        for keyword in ['conference', 'workshop', 'published', 'accepted', 'journal', 'proceedings']
-                    ) else None
-                )
-                
-                metadata = {
-                    'title': paper.title,
-                    'authors': [author.name for author in paper.authors],
-                    'submission_date': paper.published.isoformat() if paper.published else None,
-                    'revised_dates': [],  # Will be populated from all versions
-                    'publication_venue': publication_venue,  # Required by Lab 1
-                    'abstract': paper.summary,
-                    'categories': paper.categories,
-                    'primary_category': paper.primary_category,
-                    'doi': paper.doi,
-                    'journal_ref': paper.journal_ref,
-                    'arxiv_id': arxiv_id,
-                    'pdf_url': paper.pdf_url,
-                    'comment': paper.comment
-                }
-                
-                logger.info(f"Retrieved metadata for {arxiv_id}: {paper.title}")
-                return metadata
+                self.limiter.acquire()
+                self._update_stat('metadata_requests')
+                with requests.get(self.api_url, params=params, timeout=60, stream=True) as response:
+                    if response.status_code != 200:
+                        raise Exception(f"HTTP {response.status_code}")
+                    
+                    return tag_entries(parse_atom_entries(response.iter_content(chunk_size=65536)))
                 
-            except StopIteration:
-                logger.warning(f"Paper {arxiv_id} not found")
-                return None
             except Exception as e:
-                logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES} failed for {arxiv_id}: {e}")
+                logger.warning(f"Metadata query attempt {attempt + 1}/{MAX_RETRIES} failed "
+                             f"({len(id_list)} IDs, first {id_list[0]}): {e}")
                 if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
+                    timed_sleep(RETRY_DELAY, 'retry_backoff')
         
-        logger.error(f"Failed to get metadata for {arxiv_id} after {MAX_RETRIES} attempts")
         return None
     
-    def download_source(self, arxiv_id: str, version: str, output_dir: str) -> Tuple[bool, Optional[str], Optional[str]]:
+    def get_papers_metadata_batch(self, arxiv_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Get metadata for a window of papers with a few large id_list queries
+        
+        The unversioned entry gives the latest version (see collect_latest_entries).
+        Dates of intermediate versions (only papers with 3+ versions) come from
+        one extra query listing those versioned IDs for the whole window.
+        
+        Args:
+            arxiv_ids: arXiv IDs (e.g., a window from generate_paper_ids)
+        
+        Returns:
+            Dictionary mapping arXiv ID to metadata (with revised_dates filled),
+            or None if the paper does not exist.
+            IDs whose request failed after all retries are left out.
+        """
+        if self.engine is not None:
+            return self.engine.run(self.engine.get_papers_metadata_batch(arxiv_ids))
+        
+        results = {}
+        
+        for i in range(0, len(arxiv_ids), METADATA_BATCH_SIZE):
+            chunk = arxiv_ids[i:i + METADATA_BATCH_SIZE]
+            entries = self._query_entries(chunk)
+            
+            if entries is None:
+                logger.error(f"Failed to get metadata for {len(chunk)} papers starting at {chunk[0]} "
+                           f"after {MAX_RETRIES} attempts")
+                continue
+            
+            found, version_dates, intermediate_ids = collect_latest_entries(entries)
+            
+            for j in range(0, len(intermediate_ids), METADATA_BATCH_SIZE):
+                version_entries = self._query_entries(intermediate_ids[j:j + METADATA_BATCH_SIZE])
+                if version_entries is None:
+                    logger.warning(f"Could not get intermediate version dates for {chunk[0]} - {chunk[-1]}")
+                    continue
+                add_version_dates(version_dates, version_entries)
+            
+            results.update(finalize_window(chunk, found, version_dates))
+        
+        return results
+    
+    def stream_to_file(self, response: requests.Response, path: str, source_url: str) -> Optional[int]:
+        """
+        Stream a response body straight to disk
+        
+        The first bytes are checked before the file is created, so HTML pages
+        and non-gzip bodies are rejected without downloading the rest. Bodies
+        larger than MAX_FILE_SIZE are refused from their Content-Length, or
+        aborted once that many bytes have been streamed.
+        
+        Args:
+            response: Streaming response with status 200
+            path: Destination file
+            source_url: URL (for logging)
+        
+        Returns:
+            Number of bytes written, or None if the body is not a gzip file
+        
+        Raises:
+            OversizedSourceError: If the body is larger than MAX_FILE_SIZE
+        """
+        with response:
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > MAX_FILE_SIZE:
+                raise OversizedSourceError(f"{source_url} is {content_length} bytes (limit {MAX_FILE_SIZE})")
+            
+            chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            
+            # Collect just enough bytes to check the gzip magic number
+            head = b''
+            for chunk in chunks:
+                head += chunk
+                if len(head) >= len(GZIP_MAGIC):
+                    break
+            
+            if not head.startswith(GZIP_MAGIC):
+                self._update_stat('downloads_rejected')
+                if head.lstrip()[:1] == b'<':
+                    logger.debug(f"Skipping {source_url} (HTML body, paper may not have source)")
+                else:
+                    logger.debug(f"Skipping {source_url} (not a gzip file, starts with {head[:8]!r})")
+                return None
+            
+            size = 0
+            try:
+                with open(path, 'wb') as f:
+                    f.write(head)
+                    size += len(head)
+                    for chunk in chunks:
+                        size += len(chunk)
+                        if size > MAX_FILE_SIZE:
+                            raise OversizedSourceError(f"{source_url} is larger than {MAX_FILE_SIZE} bytes")
+                        f.write(chunk)
+            except Exception:
+                # Never leave a truncated archive behind for extraction
+                if os.path.exists(path):
+                    os.remove(path)
+                raise
+            
+            return size
+    
+    def _from_cache(self, versioned_id: str, tar_path: str) -> Optional[bool]:
+        """
+        Serve a version from the source cache
+        
+        Returns:
+            True if the archive was placed at tar_path, False if the version is
+            known to have no source, None if it has to be downloaded
+        """
+        if self.source_cache is None:
+            return None
+        if self.source_cache.is_missing(versioned_id):
+            logger.info(f"Source cache: {versioned_id} has no source files (skipping download)")
+            return False
+        size = self.source_cache.fetch(versioned_id, tar_path)
+        if size is None:
+            return None
+        self._record_disk(size)
+        return True
+    
+    def _record_missing(self, versioned_id: str):
+        """Remember a version without source so later runs do not request it"""
+        if self.source_cache is not None:
+            self.source_cache.store_missing(versioned_id)
+    
+    def _record_download(self, versioned_id: str, source_url: str, tar_path: str,
+                         size: int, start_time: float):
+        """Update download statistics, the disk ledger and the source cache for a finished download"""
+        download_time = time.time() - start_time
+        throughput = size / (1024 * 1024) / max(download_time, 1e-6)
+        self._update_stat('total_download_time', download_time)
+        self._update_stat('total_bytes_downloaded', size)
+        self._record_disk(size)
+        logger.info(f"Downloaded {versioned_id} via {source_url}: "
+                  f"{size / 1024:.1f} KB in {download_time:.2f}s ({throughput:.2f} MB/s)")
+        if self.source_cache is not None:
+            self.source_cache.store(versioned_id, tar_path)
+    
+    def source_urls(self, versioned_id: str) -> List[str]:
+        """Candidate source URLs for a versioned ID, in the order they are tried"""
+        # The correct arXiv source URL format is:
+        # https://arxiv.org/e-print/{versioned_id}
+        # This automatically returns the .tar.gz file
+        return [
+            f"{self.eprint_url}/{versioned_id}",          # Primary URL
+            f"{self.src_url}/{versioned_id}",             # Alternative URL
+        ]
+    
+    @timed('download', label_arg='arxiv_id')
+    def download_source(self, arxiv_id: str, version: str, output_dir: str) -> Tuple[bool, Optional[str]]:
         """
         Download source files for a specific version
         
+        The version is known to exist from the metadata lookup, so the
+        e-print endpoint is requested directly without another API query.
+        
         Args:
             arxiv_id: arXiv ID without version
             version: Version string (e.g., "v1")
             output_dir: Directory to save source
         
         Returns:
-            Tuple of (success, tar_path, updated_date)
+            Tuple of (success, tar_path)
+        
+        Raises:
+            OversizedSourceError: If the source is larger than MAX_FILE_SIZE
         """
         versioned_id = f"{arxiv_id}{version}"
         
+        temp_dir = os.path.join(output_dir, "temp")
+        ensure_dir(temp_dir)
+        
+        tar_filename = f"{versioned_id}.tar.gz"
+        tar_path = os.path.join(temp_dir, tar_filename)
+        
+        cached = self._from_cache(versioned_id, tar_path)
+        if cached is not None:
+            return cached, tar_path if cached else None
+        
+        source_urls = self.source_urls(versioned_id)
+        
         for attempt in range(MAX_RETRIES):
-            try:
-                search = arxiv.Search(id_list=[versioned_id])
-                paper = next(self.client.results(search))
-                
-                # Get updated date for this version
-                updated_date = paper.updated.isoformat() if paper.updated else None
-                
-                # Extract year-month and paper number from arxiv_id for source URL
-                # Format: YYMM.nnnnn -> YYMM/nnnnn
-                parts = arxiv_id.split('.')
-                if len(parts) == 2:
-                    year_month = parts[0]  # e.g., "2208"
-                    paper_num = parts[1]   # e.g., "12396"
-                else:
-                    # Fallback: try to extract from versioned_id
-                    parts = versioned_id.replace('v', '.').split('.')
-                    if len(parts) >= 2:
-                        year_month = parts[0]
-                        paper_num = parts[1]
-                    else:
-                        year_month = arxiv_id[:4]
-                        paper_num = arxiv_id[5:].replace('v', '')
-                
-                # Download source
-                temp_dir = os.path.join(output_dir, "temp")
-                ensure_dir(temp_dir)
-                
-                tar_filename = f"{versioned_id}.tar.gz"
-                tar_path = os.path.join(temp_dir, tar_filename)
-                
-                logger.info(f"Downloading source for {versioned_id}...")
-                start_time = time.time()
-                
-                # Try using arxiv library's download_source() first
-                downloaded = False
+            logger.info(f"Downloading source for {versioned_id}...")
+            start_time = time.time()
+            transient_error = False
+            
+            for source_url in source_urls:
+                logger.debug(f"Attempting direct download from: {source_url}")
                 try:
-                    paper.download_source(dirpath=temp_dir, filename=tar_filename)
-                    downloaded = True
-                    logger.info(f"Downloaded {versioned_id} via arxiv library")
-                except Exception as download_err:
-                    error_str = str(download_err)
-                    logger.debug(f"arxiv library download_source() failed: {download_err}, trying direct download")
-                
-                # If library method failed, try direct download from arXiv e-print endpoint
-                if not downloaded:
-                    # The correct arXiv source URL format is:
-                    # https://arxiv.org/e-print/{versioned_id}
-                    # This automatically returns the .tar.gz file
-                    source_urls = [
-                        f"https://arxiv.org/e-print/{versioned_id}",  # Primary URL
-                        f"https://arxiv.org/src/{versioned_id}",      # Alternative URL
-                    ]
+                    self.limiter.acquire()
+                    response = requests.get(source_url, timeout=60, stream=True, allow_redirects=True)
                     
-                    for source_url in source_urls:
-                        logger.debug(f"Attempting direct download from: {source_url}")
-                        try:
-                            response = requests.get(source_url, timeout=60, stream=True, allow_redirects=True)
-                            
-                            if response.status_code == 200:
-                                # Check if it's actually a tar.gz file
-                                content_type = response.headers.get('Content-Type', '')
-                                
-                                # Check for HTML response (indicates paper has no source)
-                                if 'html' in content_type.lower():
-                                    logger.debug(f"Skipping {source_url} (HTML response, paper may not have source)")
-                                    continue
-                                
-                                # Verify it's a gzip file by checking magic number
-                                content = b''
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    content += chunk
-                                
-                                # Check gzip magic number at the start
-                                if len(content) < 2 or not content.startswith(b'\x1f\x8b'):
-                                    logger.debug(f"Skipping {source_url} (not a gzip file)")
-                                    continue
-                                
-                                # Save file
-                                with open(tar_path, 'wb') as f:
-                                    f.write(content)
-                                
-                                logger.info(f"Downloaded {versioned_id} via direct URL: {source_url}")
-                                downloaded = True
-                                break
-                                
-                            elif response.status_code == 404:
-                                logger.debug(f"404 for {source_url}, trying next URL...")
-                                continue
-                            else:
-                                logger.debug(f"HTTP {response.status_code} for {source_url}, trying next URL...")
-                                continue
-                                
-                        except Exception as url_err:
-                            logger.debug(f"Error downloading from {source_url}: {url_err}, trying next URL...")
+                    if response.status_code == 200:
+                        # Check if it's actually a tar.gz file
+                        content_type = response.headers.get('Content-Type', '')
+                        
+                        # Check for HTML response (indicates paper has no source)
+                        if 'html' in content_type.lower():
+                            response.close()
+                            logger.debug(f"Skipping {source_url} (HTML response, paper may not have source)")
+                            continue
+                        
+                        size = self.stream_to_file(response, tar_path, source_url)
+                        if size is None:
                             continue
+                        
+                        self._record_download(versioned_id, source_url, tar_path, size, start_time)
+                        return True, tar_path
                     
-                    if not downloaded:
-                        logger.warning(f"Paper {versioned_id} does not have source files available (only PDF). "
-                                     f"This paper will be skipped as it requires TeX source files.")
-                        return False, None, None
-                
-                download_time = time.time() - start_time
-                
-                # Verify file was downloaded
-                if not os.path.exists(tar_path) or os.path.getsize(tar_path) == 0:
-                    raise Exception(f"Downloaded file is empty or doesn't exist: {tar_path}")
-                
-                self.stats['total_download_time'] += download_time
-                logger.info(f"Downloaded {versioned_id} in {download_time:.2f}s")
-                
-                time.sleep(ARXIV_API_DELAY)
-                return True, tar_path, updated_date
-                
-            except StopIteration:
-                logger.warning(f"Version {versioned_id} not found")
-                return False, None, None
-            except Exception as e:
-                error_msg = str(e)
-                logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES} failed for {versioned_id}: {error_msg}")
-                
-                # Check if it's a NoneType error - paper may not have source files
-                if "'NoneType' object has no attribute 'replace'" in error_msg or "NoneType" in error_msg:
-                    logger.warning(f"Paper {versioned_id} may not have source files available (only PDF)")
-                    # Don't retry for this specific error
-                    return False, None, None
+                    elif response.status_code == 404:
+                        logger.debug(f"404 for {source_url}, trying next URL...")
+                    else:
+                        logger.debug(f"HTTP {response.status_code} for {source_url}, trying next URL...")
+                        transient_error = True
                 
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
+                except OversizedSourceError:
+                    # Not transient: another URL or attempt would serve the same file
+                    self._update_stat('sources_oversized')
+                    raise
+                except Exception as url_err:
+                    logger.debug(f"Error downloading from {source_url}: {url_err}, trying next URL...")
+                    transient_error = True
+            
+            if not transient_error:
+                logger.warning(f"Paper {versioned_id} does not have source files available (only PDF). "
+                             f"This paper will be skipped as it requires TeX source files.")
+                self._record_missing(versioned_id)
+                return False, None
+            
+            logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES} failed for {versioned_id}")
+            if attempt < MAX_RETRIES - 1:
+                timed_sleep(RETRY_DELAY, 'retry_backoff')
         
         logger.error(f"Failed to download {versioned_id} after {MAX_RETRIES} attempts")
-        return False, None, None
+        return False, None
     
-    def scrape_paper(self, arxiv_id: str, paper_dir: str) -> bool:
+    @timed('scrape_paper', label_arg='arxiv_id')
+    def scrape_paper(self, arxiv_id: str, paper_dir: str, metadata: Optional[Dict] = None,
+                     metadata_fetched: bool = False) -> bool:
         """
         Scrape a single paper with all versions
         
         Args:
             arxiv_id: arXiv ID (e.g., "2208.11941")
             paper_dir: Directory for this paper's data
+            metadata: Metadata prefetched by get_papers_metadata_batch
+            metadata_fetched: True if metadata comes from a batch lookup, so None
+                means the paper does not exist and no request is made here
         
         Returns:
             True if successful, False otherwise
         """
-        self.stats['papers_attempted'] += 1
+        sources = self.fetch_paper(arxiv_id, paper_dir, metadata, metadata_fetched)
+        if sources is None:
+            return False
+        return self.finish_paper(sources)
+    
+    @timed('fetch_paper', label_arg='arxiv_id')
+    def fetch_paper(self, arxiv_id: str, paper_dir: str, metadata: Optional[Dict] = None,
+                    metadata_fetched: bool = False) -> Optional[PaperSources]:
+        """
+        First half of scrape_paper: metadata lookup and source downloads
+        
+        Every downloaded archive is extracted right away, or queued on the
+        extraction pool when one is set, so the next version (and, once this
+        returns, the next paper) downloads while the previous one is extracted.
+        
+        Args:
+            Same as scrape_paper
+        
+        Returns:
+            PaperSources to pass to finish_paper, or None if the paper failed
+        """
+        self._update_stat('papers_attempted')
         logger.info(f"Scraping paper {arxiv_id}...")
         
-        start_time = time.time()
-        temp_dir = os.path.join(paper_dir, "temp")
+        sources = PaperSources(arxiv_id, paper_dir, metadata, time.time())
+        handed_off = False
         
         try:
             # Get metadata
-            metadata = self.get_paper_metadata(arxiv_id)
+            if metadata is None and not metadata_fetched:
+                metadata = self.get_paper_metadata(arxiv_id)
             if not metadata:
-                self.stats['papers_failed'] += 1
-                return False
-            
-            time.sleep(ARXIV_API_DELAY)
+                # A batch lookup that returned nothing means the ID does not exist;
+                # a single lookup may also have failed on the network
+                self._fail(arxiv_id, 'not_found' if metadata_fetched else 'metadata_unavailable')
+                return None
+            sources.metadata = metadata
+            self._mark(arxiv_id, STATUS_METADATA)
             
             # Create directories
             ensure_dir(paper_dir)
             tex_dir = os.path.join(paper_dir, "tex")
             ensure_dir(tex_dir)
             
-            # Try to download versions (start with v1, try up to v10)
-            versions_downloaded = 0
-            revised_dates = []  # Collect all revised dates from versions
+            # Download every version listed by the metadata lookup
+            versions = [f"v{v}" for v in range(1, get_latest_version(metadata) + 1)]
             
-            for v in range(1, 11):
-                version = f"v{v}"
-                success, tar_path, updated_date = self.download_source(arxiv_id, version, paper_dir)
-                
+            if self.engine is not None:
+                downloads = self.engine.run(self.engine.download_versions(arxiv_id, versions, paper_dir))
+            else:
+                # Lazy, so nothing after a missing v1 is downloaded
+                downloads = (self.download_source(arxiv_id, version, paper_dir) for version in versions)
+            
+            for version, (success, tar_path) in zip(versions, downloads):
                 if not success:
-                    if v == 1:
-                        # No v1 means paper doesn't exist
-                        logger.error(f"No v1 found for {arxiv_id}")
-                        self.stats['papers_failed'] += 1
-                        return False
+                    if version == "v1":
+                        # No v1 source means the paper is PDF-only
+                        logger.error(f"No v1 source found for {arxiv_id}")
+                        self._fail(arxiv_id, 'no_source')
+                        return None
                     else:
-                        # No more versions
-                        break
-                
-                # Collect revised date (skip v1 as it's the submission date)
-                if updated_date and v > 1:
-                    if updated_date not in revised_dates:
-                        revised_dates.append(updated_date)
+                        logger.warning(f"Skipping {arxiv_id}{version}: source not available")
+                        continue
                 
                 # Extract source
                 # IMPORTANT: Version folder MUST follow format <yymm-id>v<version>
@@ -303,57 +729,154 @@ class ArxivScraper:
                 folder_name = format_folder_name(arxiv_id)  # "2311-14685"
                 version_folder = f"{folder_name}{version}"   # "2311-14685v1"
                 version_dir = os.path.join(tex_dir, version_folder)
-                ensure_dir(version_dir)
-                
-                if extract_tar_gz(tar_path, version_dir):
-                    # Process TeX files to remove figures
-                    process_stats = process_tex_files(version_dir)
-                    logger.info(f"Processed {process_stats['processed']} TeX files, "
-                              f"removed {process_stats['images_removed']} image files")
-                    
-                    # CLEAN: Keep ONLY paper.tex and references.bib
-                    clean_stats = clean_version_folder(version_dir)
-                    logger.info(f"Cleaned version folder: kept {clean_stats['kept_tex']} .tex, "
-                              f"{clean_stats['kept_bib']} .bib, removed {clean_stats['removed']} other files")
-                    
-                    versions_downloaded += 1
-                    self.stats['versions_downloaded'] += 1
                 
-                # Clean up tar file immediately
-                if os.path.exists(tar_path):
-                    try:
-                        os.remove(tar_path)
-                        logger.debug(f"Removed tar file: {tar_path}")
-                    except Exception as e:
-                        logger.warning(f"Failed to remove tar file {tar_path}: {e}")
+                # Keep ONLY paper.tex (figures removed) and references.bib,
+                # picked straight from the archive stream
+                sources.extractions.append((version_dir, tar_path, self._extract(tar_path, version_dir)))
+                if self.extract_pool is None:
+                    # Already extracted: the archive is deleted before the next download
+                    self._collect_extractions(sources)
             
-            if versions_downloaded == 0:
-                logger.error(f"No versions downloaded for {arxiv_id}")
-                self.stats['papers_failed'] += 1
-                return False
+            handed_off = True
+            return sources
+        
+        except OversizedSourceError as e:
+            # Recorded as a failure of this paper, the worker moves on
+            logger.error(f"Skipping {arxiv_id}: source too large ({e})")
+            self._fail(arxiv_id, 'oversized')
+            return None
+        
+        finally:
+            if not handed_off:
+                self._discard_paper(sources)
+    
+    def finish_paper(self, sources: PaperSources) -> bool:
+        """
+        Second half of scrape_paper: wait for the extractions and save metadata.json
+        
+        Args:
+            sources: Result of fetch_paper
+        
+        Returns:
+            True if successful, False otherwise
+        """
+        arxiv_id = sources.arxiv_id
+        succeeded = False
+        
+        try:
+            if sources.extractions:
+                # Still queued or running in the extraction pool
+                with span('extract_wait', arxiv_id):
+                    self._collect_extractions(sources)
             
-            # Update metadata with all revised dates
-            metadata['revised_dates'] = sorted(revised_dates)
+            if sources.versions_downloaded == 0:
+                logger.error(f"No versions downloaded for {arxiv_id}")
+                return self._fail(arxiv_id, 'extract_failed')
             
-            # Save metadata
-            metadata_path = os.path.join(paper_dir, "metadata.json")
+            # Save metadata (revised_dates were filled by the metadata lookup)
+            metadata_path = os.path.join(sources.paper_dir, "metadata.json")
             with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2, ensure_ascii=False)
+                json.dump(sources.metadata, f, indent=2, ensure_ascii=False)
+            self._record_disk(os.path.getsize(metadata_path))
+            self._mark(arxiv_id, STATUS_SOURCES)
             
-            processing_time = time.time() - start_time
-            self.stats['total_processing_time'] += processing_time
-            self.stats['papers_successful'] += 1
+            processing_time = time.time() - sources.start_time
+            self._update_stat('total_processing_time', processing_time)
+            self._update_stat('papers_successful')
             
-            logger.info(f"Successfully scraped {arxiv_id} ({versions_downloaded} versions) in {processing_time:.2f}s")
+            logger.info(f"Successfully scraped {arxiv_id} ({sources.versions_downloaded} versions) in {processing_time:.2f}s")
+            succeeded = True
             return True
+        
+        except OversizedSourceError as e:
+            logger.error(f"Skipping {arxiv_id}: source too large ({e})")
+            return self._fail(arxiv_id, 'oversized')
             
         finally:
             # Always clean temp directory, even if error occurs
-            if os.path.exists(temp_dir):
-                clean_temp_files(temp_dir)
-                logger.debug(f"Cleaned temp directory: {temp_dir}")
+            if succeeded:
+                self._clean_temp(sources.temp_dir)
+            else:
+                self._discard_paper(sources)
+    
+    def _extract(self, tar_path: str, version_dir: str) -> Future:
+        """Extract one archive on the extraction pool, or in this thread without one"""
+        if self.extract_pool is not None:
+            return self.extract_pool.submit(tar_path, version_dir, EXTRA_FIGURE_ENVIRONMENTS)
+        extraction = Future()
+        try:
+            extraction.set_result(extract_main_files(tar_path, version_dir, EXTRA_FIGURE_ENVIRONMENTS))
+        except Exception as e:
+            extraction.set_exception(e)
+        return extraction
+    
+    def _collect_extractions(self, sources: PaperSources):
+        """
+        Wait for the queued extractions of a paper, account for the versions
+        they wrote and delete their archives
+        
+        Raises:
+            OversizedSourceError: Once every extraction has finished, if one
+                of them was rejected
+        """
+        rejected = None
+        while sources.extractions:
+            version_dir, tar_path, extraction = sources.extractions.pop(0)
+            try:
+                extract_stats = extraction.result()
+            except OversizedSourceError as e:
+                # The other extractions still read from temp: wait for them first
+                rejected = rejected or e
+                continue
+            finally:
+                # Clean up tar file immediately
+                self._remove_archive(tar_path)
+            
+            if extract_stats is not None:
+                self._record_disk(extract_stats['bytes_written'] - self._deduplicate(version_dir, extract_stats))
+                sources.versions_downloaded += 1
+                self._update_stat('versions_downloaded')
+        
+        if rejected is not None:
+            raise rejected
+    
+    def _discard_paper(self, sources: PaperSources):
+        """
+        Clean up after a failed paper: wait for its extractions still queued or
+        running (they read from temp and write to tex/), then remove the partial
+        tex/ folder and the temp folder
+        """
+        while sources.extractions:
+            try:
+                self._collect_extractions(sources)
+            except Exception as e:
+                logger.debug(f"Discarded extraction of {sources.arxiv_id}: {e}")
+        
+        tex_dir = os.path.join(sources.paper_dir, "tex")
+        if os.path.exists(tex_dir):
+            self._record_disk(-get_releasable_size(tex_dir))
+            clean_temp_files(tex_dir)
+        self._clean_temp(sources.temp_dir)
+    
+    def _remove_archive(self, tar_path: str):
+        if os.path.exists(tar_path):
+            try:
+                tar_size = os.path.getsize(tar_path)
+                os.remove(tar_path)
+                self._record_disk(-tar_size)
+                logger.debug(f"Removed tar file: {tar_path}")
+            except Exception as e:
+                logger.warning(f"Failed to remove tar file {tar_path}: {e}")
+    
+    def _clean_temp(self, temp_dir: str):
+        if os.path.exists(temp_dir):
+            # Archives left here (error, or concurrent downloads after a missing v1)
+            self._record_disk(-get_releasable_size(temp_dir))
+            clean_temp_files(temp_dir)
+            logger.debug(f"Cleaned temp directory: {temp_dir}")
     
     def get_stats(self) -> Dict:
         """Get scraping statistics"""
-        return self.stats.copy()
+        with self.stats_lock:
+            return self.stats.copy()
 
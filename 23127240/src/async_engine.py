@@ -0,0 +1,412 @@
+"""
+Asyncio HTTP engine for arXiv and Semantic Scholar requests
+"""
+
+import os
+import time
+import asyncio
+import threading
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from config import (
+    MAX_RETRIES, RETRY_DELAY, METADATA_BATCH_SIZE, SEMANTIC_SCHOLAR_FIELDS,
+    ASYNC_MAX_CONNECTIONS, ASYNC_CONNECTIONS_PER_HOST, MAX_FILE_SIZE
+)
+from arxiv_scraper import (
+    AtomEntryParser, tag_entries, collect_latest_entries, add_version_dates,
+    finalize_window, GZIP_MAGIC, DOWNLOAD_CHUNK_SIZE
+)
+from rate_limiter import parse_retry_after
+from reference_scraper_optimized import THROTTLED
+from utils import ensure_dir, OversizedSourceError
+from instrumentation import timed, timed_async_sleep
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(sock_connect=60, sock_read=60)
+
+
+class AsyncHttpEngine:
+    """
+    Runs arXiv and Semantic Scholar requests on one asyncio event loop with a
+    shared connection pool, so many requests can be in flight at once.
+
+    The loop lives in a background thread. Synchronous code (the pipeline and
+    its worker threads) drives it with run(); requests from every thread share
+    the loop, the pool and the per-host token buckets, so rate limits hold.
+    Statistics, URLs and the disk ledger are those of the scrapers it serves.
+    """
+
+    def __init__(self, arxiv_scraper, reference_scraper=None,
+                 max_connections: int = ASYNC_MAX_CONNECTIONS,
+                 connections_per_host: int = ASYNC_CONNECTIONS_PER_HOST):
+        """
+        Initialize engine (call start() before use)
+
+        Args:
+            arxiv_scraper: ArxivScraper whose metadata lookups and downloads go through the engine
+            reference_scraper: OptimizedReferenceScraper whose batch requests go through the engine
+            max_connections: Size of the shared connection pool
+            connections_per_host: Connection limit per host
+        """
+        self.arxiv_scraper = arxiv_scraper
+        self.reference_scraper = reference_scraper
+        self.max_connections = max_connections
+        self.connections_per_host = connections_per_host
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="async-engine", daemon=True)
+        self.session = None
+        self.in_flight = 0
+        # Only modified on the event loop thread
+        self.stats = {
+            'requests': 0,
+            'max_in_flight': 0,
+            'request_errors': 0
+        }
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                         limit_per_host=self.connections_per_host)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT)
+
+    def start(self):
+        """Start the event loop thread and route the scrapers' requests through the engine"""
+        self.thread.start()
+        self.run(self._open_session())
+        self.arxiv_scraper.engine = self
+        if self.reference_scraper is not None and hasattr(self.reference_scraper, 'parse_batch_response'):
+            self.reference_scraper.engine = self
+        logger.info(f"Async HTTP engine started ({self.max_connections} connections, "
+                    f"{self.connections_per_host} per host)")
+
+    def close(self):
+        """Detach from the scrapers, close the connection pool and stop the loop"""
+        self.arxiv_scraper.engine = None
+        if self.reference_scraper is not None and getattr(self.reference_scraper, 'engine', None) is self:
+            self.reference_scraper.engine = None
+        if self.session is not None:
+            self.run(self.session.close())
+            self.session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def run(self, coro):
+        """
+        Run a coroutine on the engine loop and wait for its result
+
+        Must not be called from the loop thread itself.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    @asynccontextmanager
+    async def _request(self, method: str, url: str, **kwargs):
+        self.stats['requests'] += 1
+        self.in_flight += 1
+        if self.in_flight > self.stats['max_in_flight']:
+            self.stats['max_in_flight'] = self.in_flight
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                yield response
+        except Exception:
+            self.stats['request_errors'] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    # ------------------------------------------------------------------
+    # arXiv metadata
+    # ------------------------------------------------------------------
+
+    @timed('metadata_query')
+    async def _query_entries(self, id_list: List[str]) -> Optional[List[Dict]]:
+        """Awaitable ArxivScraper._query_entries"""
+        scraper = self.arxiv_scraper
+        params = {
+            'id_list': ','.join(id_list),
+            'max_results': str(len(id_list))
+        }
+
+        for attempt in range(MAX_RETRIES):
+            try:
+                await scraper.limiter.acquire_async()
+                scraper._update_stat('metadata_requests')
+                async with self._request('GET', scraper.api_url, params=params) as response:
+                    if response.status != 200:
+                        raise Exception(f"HTTP {response.status}")
+
+                    parser = AtomEntryParser()
+                    entries = []
+                    async for chunk in response.content.iter_chunked(65536):
+                        entries.extend(parser.feed(chunk))
+                    entries.extend(parser.close())
+                    return tag_entries(entries)
+
+            except Exception as e:
+                logger.warning(f"Metadata query attempt {attempt + 1}/{MAX_RETRIES} failed "
+                             f"({len(id_list)} IDs, first {id_list[0]}): {e}")
+                if attempt < MAX_RETRIES - 1:
+                    await timed_async_sleep(RETRY_DELAY, 'retry_backoff')
+
+        return None
+
+    async def _metadata_window(self, chunk: List[str]) -> Dict[str, Optional[Dict]]:
+        entries = await self._query_entries(chunk)
+        if entries is None:
+            logger.error(f"Failed to get metadata for {len(chunk)} papers starting at {chunk[0]} "
+                       f"after {MAX_RETRIES} attempts")
+            return {}
+
+        found, version_dates, intermediate_ids = collect_latest_entries(entries)
+
+        queries = [intermediate_ids[j:j + METADATA_BATCH_SIZE]
+                   for j in range(0, len(intermediate_ids), METADATA_BATCH_SIZE)]
+        for version_entries in await asyncio.gather(*(self._query_entries(q) for q in queries)):
+            if version_entries is None:
+                logger.warning(f"Could not get intermediate version dates for {chunk[0]} - {chunk[-1]}")
+                continue
+            add_version_dates(version_dates, version_entries)
+
+        return finalize_window(chunk, found, version_dates)
+
+    async def get_papers_metadata_batch(self, arxiv_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Awaitable ArxivScraper.get_papers_metadata_batch; windows are queried concurrently
+
+        Args:
+            arxiv_ids: arXiv IDs
+
+        Returns:
+            Dictionary mapping arXiv ID to metadata, or None if the paper does not exist.
+            IDs whose request failed after all retries are left out.
+        """
+        chunks = [arxiv_ids[i:i + METADATA_BATCH_SIZE]
+                  for i in range(0, len(arxiv_ids), METADATA_BATCH_SIZE)]
+        results = {}
+        for window in await asyncio.gather(*(self._metadata_window(c) for c in chunks)):
+            results.update(window)
+        return results
+
+    async def get_paper_metadata(self, arxiv_id: str) -> Optional[Dict]:
+        """Awaitable ArxivScraper.get_paper_metadata"""
+        return (await self.get_papers_metadata_batch([arxiv_id])).get(arxiv_id)
+
+    # ------------------------------------------------------------------
+    # arXiv sources
+    # ------------------------------------------------------------------
+
+    async def _stream_to_file(self, response: aiohttp.ClientResponse, path: str,
+                              source_url: str) -> Optional[int]:
+        """
+        Awaitable ArxivScraper.stream_to_file (gzip magic checked before the file
+        is created, bodies above MAX_FILE_SIZE raise OversizedSourceError)
+        """
+        if response.content_length is not None and response.content_length > MAX_FILE_SIZE:
+            raise OversizedSourceError(f"{source_url} is {response.content_length} bytes (limit {MAX_FILE_SIZE})")
+
+        chunks = response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE)
+
+        head = b''
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= len(GZIP_MAGIC):
+                break
+
+        if not head.startswith(GZIP_MAGIC):
+            self.arxiv_scraper._update_stat('downloads_rejected')
+            logger.debug(f"Skipping {source_url} (not a gzip file, starts with {head[:8]!r})")
+            return None
+
+        size = 0
+        try:
+            # Local 64 KB writes are short enough to run on the loop thread
+            with open(path, 'wb') as f:
+                f.write(head)
+                size += len(head)
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > MAX_FILE_SIZE:
+                        raise OversizedSourceError(f"{source_url} is larger than {MAX_FILE_SIZE} bytes")
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+        return size
+
+    @timed('download', label_arg='arxiv_id')
+    async def download_source(self, arxiv_id: str, version: str, output_dir: str) -> Tuple[bool, Optional[str]]:
+        """
+        Awaitable ArxivScraper.download_source
+
+        Args:
+            arxiv_id: arXiv ID without version
+            version: Version string (e.g., "v1")
+            output_dir: Directory to save source
+
+        Returns:
+            Tuple of (success, tar_path)
+
+        Raises:
+            OversizedSourceError: If the source is larger than MAX_FILE_SIZE
+        """
+        scraper = self.arxiv_scraper
+        versioned_id = f"{arxiv_id}{version}"
+
+        temp_dir = os.path.join(output_dir, "temp")
+        ensure_dir(temp_dir)
+        tar_path = os.path.join(temp_dir, f"{versioned_id}.tar.gz")
+
+        cached = scraper._from_cache(versioned_id, tar_path)
+        if cached is not None:
+            return cached, tar_path if cached else None
+
+        for attempt in range(MAX_RETRIES):
+            logger.info(f"Downloading source for {versioned_id}...")
+            start_time = time.time()
+            transient_error = False
+
+            for source_url in scraper.source_urls(versioned_id):
+                try:
+                    await scraper.limiter.acquire_async()
+                    async with self._request('GET', source_url, allow_redirects=True) as response:
+                        if response.status == 200:
+                            if 'html' in response.headers.get('Content-Type', '').lower():
+                                logger.debug(f"Skipping {source_url} (HTML response, paper may not have source)")
+                                continue
+
+                            size = await self._stream_to_file(response, tar_path, source_url)
+                            if size is None:
+                                continue
+
+                            scraper._record_download(versioned_id, source_url, tar_path, size, start_time)
+                            return True, tar_path
+
+                        elif response.status == 404:
+                            logger.debug(f"404 for {source_url}, trying next URL...")
+                        else:
+                            logger.debug(f"HTTP {response.status} for {source_url}, trying next URL...")
+                            transient_error = True
+
+                except OversizedSourceError:
+                    scraper._update_stat('sources_oversized')
+                    raise
+                except Exception as url_err:
+                    logger.debug(f"Error downloading from {source_url}: {url_err}, trying next URL...")
+                    transient_error = True
+
+            if not transient_error:
+                logger.warning(f"Paper {versioned_id} does not have source files available (only PDF). "
+                             f"This paper will be skipped as it requires TeX source files.")
+                scraper._record_missing(versioned_id)
+                return False, None
+
+            logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES} failed for {versioned_id}")
+            if attempt < MAX_RETRIES - 1:
+                await timed_async_sleep(RETRY_DELAY, 'retry_backoff')
+
+        logger.error(f"Failed to download {versioned_id} after {MAX_RETRIES} attempts")
+        return False, None
+
+    async def download_versions(self, arxiv_id: str, versions: List[str],
+                                output_dir: str) -> List[Tuple[bool, Optional[str]]]:
+        """
+        Download several versions of a paper concurrently
+
+        Returns:
+            One (success, tar_path) per version, in the order given
+
+        Raises:
+            OversizedSourceError: If any version is larger than MAX_FILE_SIZE
+        """
+        # Let every download finish before raising, so none is still writing
+        # into the temp directory while the caller cleans it up
+        results = await asyncio.gather(*(self.download_source(arxiv_id, version, output_dir)
+                                         for version in versions), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    # ------------------------------------------------------------------
+    # Semantic Scholar
+    # ------------------------------------------------------------------
+
+    @timed('s2_batch_request')
+    async def get_papers_batch(self, arxiv_ids: List[str]):
+        """
+        Awaitable OptimizedReferenceScraper._request_batch (cache lookups and
+        bisection stay in get_papers_batch)
+
+        Args:
+            arxiv_ids: arXiv IDs (at most the scraper's batch size)
+
+        Returns:
+            Dictionary mapping arXiv ID to its reference list (None if not in
+            Semantic Scholar), THROTTLED if rate limited, or None if the request
+            failed
+        """
+        scraper = self.reference_scraper
+        scraper.stats['batch_requests'] += 1
+
+        url = f"{scraper.api_base}/paper/batch"
+        params = {"fields": SEMANTIC_SCHOLAR_FIELDS}
+        data = {"ids": [f"arXiv:{arxiv_id}" for arxiv_id in arxiv_ids]}
+        attempts = scraper.batch_attempts(len(arxiv_ids))
+        failures = 0
+
+        for attempt in range(MAX_RETRIES):
+            try:
+                await scraper.limiter.acquire_async()
+                start_time = time.time()
+                async with self._request('POST', url, params=params, json=data) as response:
+                    if response.status == 200:
+                        scraper.limiter.on_success()
+                        papers_data = scraper.parse_batch_response(arxiv_ids, await response.json(content_type=None))
+                        scraper.record_batch_success(len(arxiv_ids), time.time() - start_time)
+                        return papers_data
+
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+                    body = await response.text() if status in (400, 413) else ''
+
+                if status == 429:
+                    # acquire_async() waits out the pause of the shared limiter
+                    wait_time = scraper.limiter.on_throttle(parse_retry_after(retry_after))
+                    logger.warning(f"Batch rate limit ({len(arxiv_ids)} papers), re-queued for {wait_time:.0f}s")
+                    return THROTTLED
+
+                logger.warning(f"Batch attempt {attempt + 1}/{MAX_RETRIES}: HTTP {status} ({len(arxiv_ids)} papers)")
+                if scraper.is_oversized(status, body):
+                    scraper.shrink_batch(len(arxiv_ids), "response too large")
+
+            except asyncio.TimeoutError:
+                logger.warning(f"Batch attempt {attempt + 1}/{MAX_RETRIES}: timeout ({len(arxiv_ids)} papers)")
+                scraper.shrink_batch(len(arxiv_ids), "timeout")
+
+            except Exception as e:
+                logger.warning(f"Batch attempt {attempt + 1}/{MAX_RETRIES}: {e}")
+
+            failures += 1
+            if failures >= attempts:
+                break
+            await timed_async_sleep(RETRY_DELAY, 'retry_backoff')
+
+        scraper.stats['api_errors'] += 1
+        logger.warning(f"Batch request failed for {len(arxiv_ids)} papers")
+        return None
+
+    def get_stats(self) -> Dict:
+        stats = self.stats.copy()
+        stats['max_connections'] = self.max_connections
+        stats['connections_per_host'] = self.connections_per_host
+        return stats
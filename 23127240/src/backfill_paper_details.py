@@ -1,166 +1,267 @@
 """
 Script to backfill paper_details.csv with information from already scraped papers
+
+Incremental: only paper folders modified since the previous backfill
+(backfill_state.json watermark) are opened, and their rows are appended to the
+CSV instead of rewriting it. Papers packed into shards (--storage shards) are
+read through the shard index, and only looked at when the index changed.
+
+Usage: python backfill_paper_details.py [--output DATA_DIR] [--workers N] [--full]
 """
 
 import os
 import json
 import csv
 import time
-from pathlib import Path
-from config import STUDENT_ID, DATA_DIR
-from utils import get_directory_size
-
-def get_all_completed_papers(output_dir):
-    """Get all completed papers from the output directory"""
-    completed_papers = []
-    
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from config import STUDENT_ID, DATA_DIR, SHARD_DIR_NAME
+from utils import get_directory_size, atomic_write_json, format_folder_name
+from shard_store import ShardStore, INDEX_NAME
+
+STATE_FILE = "backfill_state.json"
+
+FIELDNAMES = ['paper_id', 'arxiv_id', 'title', 'authors', 'runtime_s',
+              'size_before', 'size_after', 'size_before_figures', 'size_after_figures',
+              'num_refs', 'current_output_size', 'max_rss', 'avg_rss', 'processed_at']
+
+
+def load_state(output_dir):
+    """Watermark and papers to look at again from the previous backfill"""
+    state_path = os.path.join(output_dir, STATE_FILE)
+    if os.path.exists(state_path):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read {state_path}, scanning everything: {e}")
+    return {'watermark': 0.0, 'retry': []}
+
+
+def open_shards(output_dir):
+    """ShardStore of the output directory, or None if no paper was packed"""
+    if os.path.exists(os.path.join(output_dir, SHARD_DIR_NAME, INDEX_NAME)):
+        return ShardStore(output_dir)
+    return None
+
+
+def get_changed_papers(output_dir, watermark=0.0, retry=(), shard_store=None):
+    """
+    List paper folders modified at or after the watermark
+
+    A folder's mtime changes whenever a file is created or atomically replaced in
+    it (metadata.json, references.json), so one cached stat per folder is enough.
+    Packed papers are listed when the shard index was appended to since the
+    watermark, unless the paper also still has a folder.
+
+    Returns:
+        List of (arxiv_id, paper_dir) sorted by arxiv_id, with paper_dir None for
+        papers packed in shards
+    """
+    changed = []
+    folders = set()
+    retry = set(retry)
     if not os.path.exists(output_dir):
-        return completed_papers
-    
-    for item in sorted(os.listdir(output_dir)):
-        item_path = os.path.join(output_dir, item)
-        if os.path.isdir(item_path):
-            metadata_file = os.path.join(item_path, "metadata.json")
-            references_file = os.path.join(item_path, "references.json")
-            
-            if os.path.exists(metadata_file) and os.path.exists(references_file):
-                # Convert folder name to arxiv_id (e.g., "2311-14685" -> "2311.14685")
-                arxiv_id = item.replace('-', '.')
-                completed_papers.append((arxiv_id, item_path))
-    
-    return completed_papers
-
-def extract_paper_details(arxiv_id, paper_dir, paper_id, total_output_size):
-    """Extract details from a completed paper"""
+        return changed
+
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if '-' not in entry.name or entry.name == SHARD_DIR_NAME or not entry.is_dir():
+                continue
+            # Convert folder name to arxiv_id (e.g., "2311-14685" -> "2311.14685")
+            arxiv_id = entry.name.replace('-', '.')
+            folders.add(arxiv_id)
+            if entry.stat().st_mtime >= watermark or arxiv_id in retry:
+                changed.append((arxiv_id, entry.path))
+
+    if shard_store is not None:
+        index_changed = os.stat(shard_store.index_path).st_mtime >= watermark
+        for arxiv_id in shard_store.list_papers():
+            if arxiv_id not in folders and (index_changed or arxiv_id in retry):
+                changed.append((arxiv_id, None))
+
+    return sorted(changed, key=lambda paper: paper[0])
+
+
+def read_existing_csv(csv_file):
+    """
+    Summary of the rows already in paper_details.csv
+
+    Returns:
+        Tuple of (set of arxiv_ids, highest paper_id, highest current_output_size)
+    """
+    existing_arxiv_ids = set()
+    last_paper_id = 0
+    output_size = 0
+    if not os.path.exists(csv_file):
+        return existing_arxiv_ids, last_paper_id, output_size
+
+    try:
+        with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                existing_arxiv_ids.add(row['arxiv_id'])
+                try:
+                    last_paper_id = max(last_paper_id, int(row['paper_id']))
+                    output_size = max(output_size, int(float(row['current_output_size'])))
+                except (TypeError, ValueError):
+                    pass
+    except Exception as e:
+        print(f"Warning: Could not read existing CSV: {e}")
+    return existing_arxiv_ids, last_paper_id, output_size
+
+
+def extract_paper_details(arxiv_id, paper_dir):
+    """
+    Extract details from a completed paper (runs in a worker thread)
+
+    Returns:
+        Row without paper_id / current_output_size, None if the paper is not
+        complete yet, or an Exception if its files could not be read
+    """
+    metadata_path = os.path.join(paper_dir, "metadata.json")
+    references_path = os.path.join(paper_dir, "references.json")
     try:
         # Load metadata
-        metadata_path = os.path.join(paper_dir, "metadata.json")
         with open(metadata_path, 'r', encoding='utf-8') as f:
             metadata = json.load(f)
-        
+
         # Load references
-        references_path = os.path.join(paper_dir, "references.json")
         with open(references_path, 'r', encoding='utf-8') as f:
-            references = json.load(f)
-        num_refs = len(references)
-        
+            num_refs = len(json.load(f))
+
         # Get paper size (after figures removed)
         paper_size = get_directory_size(paper_dir)
-        
+
         # Get modification time as processed_at
-        try:
-            mod_time = os.path.getmtime(metadata_path)
-            processed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mod_time))
-        except:
-            processed_at = "N/A"
-        
-        detail = {
-            'paper_id': paper_id,
-            'arxiv_id': arxiv_id,
-            'title': metadata.get('title', 'N/A'),
-            'authors': ', '.join(metadata.get('authors', [])),
-            'runtime_s': 0,  # Not available for old papers
-            'size_before': 0,  # Not available
-            'size_after': paper_size,
-            'size_before_figures': 0,  # Not available
-            'size_after_figures': paper_size,
-            'num_refs': num_refs,
-            'current_output_size': total_output_size,
-            'max_rss': 0.0,  # Not available
-            'avg_rss': 0.0,  # Not available
-            'processed_at': processed_at
-        }
-        
-        return detail
-    except Exception as e:
-        print(f"Error extracting details for {arxiv_id}: {e}")
+        mod_time = os.stat(metadata_path).st_mtime
+    except FileNotFoundError:
         return None
+    except Exception as e:
+        return e
+
+    return build_row(arxiv_id, metadata, num_refs, paper_size, mod_time)
+
+
+def extract_packed_paper_details(arxiv_id, shard_store, paper_size):
+    """
+    extract_paper_details for a paper packed in a shard
+
+    Args:
+        arxiv_id: arXiv ID
+        shard_store: ShardStore holding the paper
+        paper_size: Uncompressed size of the paper's files (ShardStore.paper_sizes)
+    """
+    folder = format_folder_name(arxiv_id)
+    try:
+        metadata = shard_store.read_json(f"{folder}/metadata.json")
+        references = shard_store.read_json(f"{folder}/references.json")
+        if metadata is None or references is None:
+            return None
+        mod_time = shard_store.mtime(f"{folder}/metadata.json")
+    except Exception as e:
+        return e
 
-def backfill_paper_details():
-    """Backfill paper_details.csv with information from completed papers"""
-    output_dir = DATA_DIR
+    return build_row(arxiv_id, metadata, len(references), paper_size, mod_time)
+
+
+def build_row(arxiv_id, metadata, num_refs, paper_size, mod_time):
+    """CSV row of a completed paper (without paper_id / current_output_size)"""
+    processed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mod_time))
+    return {
+        'arxiv_id': arxiv_id,
+        'title': metadata.get('title', 'N/A'),
+        'authors': ', '.join(metadata.get('authors', [])),
+        'runtime_s': 0,  # Not available for old papers
+        'size_before': 0,  # Not available
+        'size_after': paper_size,
+        'size_before_figures': 0,  # Not available
+        'size_after_figures': paper_size,
+        'num_refs': num_refs,
+        'max_rss': 0.0,  # Not available
+        'avg_rss': 0.0,  # Not available
+        'processed_at': processed_at
+    }
+
+
+def backfill_paper_details(output_dir=DATA_DIR, workers=8, full=False):
+    """Append completed papers missing from paper_details.csv"""
     csv_file = os.path.join(output_dir, "paper_details.csv")
-    
+    state = {'watermark': 0.0, 'retry': []} if full else load_state(output_dir)
+    scan_started = time.time()
+
     print(f"Scanning directory: {output_dir}")
-    
-    # Get all completed papers
-    completed_papers = get_all_completed_papers(output_dir)
-    print(f"Found {len(completed_papers)} completed papers")
-    
-    if not completed_papers:
-        print("No completed papers found!")
-        return
-    
-    # Load existing paper_details if exists
-    existing_arxiv_ids = set()
-    if os.path.exists(csv_file):
-        try:
-            with open(csv_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    existing_arxiv_ids.add(row['arxiv_id'])
-            print(f"Found {len(existing_arxiv_ids)} papers already in CSV")
-        except Exception as e:
-            print(f"Warning: Could not read existing CSV: {e}")
-    
-    # Extract details for all papers
-    all_details = []
-    total_output_size = get_directory_size(output_dir)
-    
-    print("\nExtracting paper details...")
-    for i, (arxiv_id, paper_dir) in enumerate(completed_papers, 1):
-        if arxiv_id in existing_arxiv_ids:
-            print(f"[{i}/{len(completed_papers)}] Skipping {arxiv_id} (already in CSV)")
-            continue
-        
-        print(f"[{i}/{len(completed_papers)}] Processing {arxiv_id}")
-        detail = extract_paper_details(arxiv_id, paper_dir, i, total_output_size)
-        if detail:
-            all_details.append(detail)
-    
-    if not all_details:
+
+    # Only folders touched since the last backfill (plus earlier unreadable ones)
+    shard_store = open_shards(output_dir)
+    changed_papers = get_changed_papers(output_dir, state['watermark'], state.get('retry', []), shard_store)
+    existing_arxiv_ids, last_paper_id, output_size = read_existing_csv(csv_file)
+    candidates = [(arxiv_id, paper_dir) for arxiv_id, paper_dir in changed_papers
+                  if arxiv_id not in existing_arxiv_ids]
+    print(f"Found {len(changed_papers)} changed papers, "
+          f"{len(candidates)} not in CSV ({len(existing_arxiv_ids)} papers already in CSV)")
+
+    # JSON parsing and folder sizing are I/O bound: run them on a thread pool
+    packed_sizes = shard_store.paper_sizes() if shard_store is not None else {}
+
+    def extract(arxiv_id, paper_dir):
+        if paper_dir is None:
+            return extract_packed_paper_details(arxiv_id, shard_store, packed_sizes.get(arxiv_id, 0))
+        return extract_paper_details(arxiv_id, paper_dir)
+
+    new_details = []
+    retry = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(lambda paper: extract(*paper), candidates)
+        for (arxiv_id, _), detail in zip(candidates, results):
+            if isinstance(detail, Exception):
+                print(f"Error extracting details for {arxiv_id}: {detail}")
+                retry.append(arxiv_id)
+            elif detail is not None:
+                new_details.append(detail)
+
+    # Number and size rows as if they had been processed in this order
+    for detail in new_details:
+        last_paper_id += 1
+        output_size += detail['size_after']
+        detail['paper_id'] = last_paper_id
+        detail['current_output_size'] = output_size
+
+    if new_details:
+        write_header = not os.path.exists(csv_file) or os.path.getsize(csv_file) == 0
+        with open(csv_file, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(new_details)
+
+    # Watermark last: a crash before this point just rescans the same folders
+    atomic_write_json(os.path.join(output_dir, STATE_FILE), {
+        'watermark': scan_started,
+        'retry': retry,
+        'updated_at': time.strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+    if not new_details:
         print("\nNo new papers to add to CSV!")
         return
-    
-    # Read existing details if file exists
-    if os.path.exists(csv_file):
-        try:
-            with open(csv_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                existing_details = list(reader)
-                # Convert to dict format
-                for row in existing_details:
-                    row['paper_id'] = int(row['paper_id'])
-                    row['runtime_s'] = float(row['runtime_s'])
-                    row['size_before'] = int(row['size_before'])
-                    row['size_after'] = int(row['size_after'])
-                    row['size_before_figures'] = int(row['size_before_figures'])
-                    row['size_after_figures'] = int(row['size_after_figures'])
-                    row['num_refs'] = int(row['num_refs'])
-                    row['current_output_size'] = int(row['current_output_size'])
-                    row['max_rss'] = float(row['max_rss'])
-                    row['avg_rss'] = float(row['avg_rss'])
-                all_details = existing_details + all_details
-        except Exception as e:
-            print(f"Warning: Could not merge with existing CSV: {e}")
-    
-    # Re-number paper_ids sequentially
-    for i, detail in enumerate(all_details, 1):
-        detail['paper_id'] = i
-    
-    # Write to CSV
-    fieldnames = ['paper_id', 'arxiv_id', 'title', 'authors', 'runtime_s', 
-                 'size_before', 'size_after', 'size_before_figures', 'size_after_figures',
-                 'num_refs', 'current_output_size', 'max_rss', 'avg_rss', 'processed_at']
-    
-    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(all_details)
-    
+
     print(f"\n✅ Successfully backfilled paper_details.csv!")
-    print(f"   Total papers in CSV: {len(all_details)}")
+    print(f"   Papers appended: {len(new_details)}")
+    print(f"   Total papers in CSV: {len(existing_arxiv_ids) + len(new_details)}")
     print(f"   File location: {csv_file}")
 
+
+def main():
+    parser = argparse.ArgumentParser(description='Append already scraped papers to paper_details.csv')
+    parser.add_argument('--output', type=str, default=DATA_DIR, help='Scraper output directory')
+    parser.add_argument('--workers', type=int, default=8, help='Threads reading paper folders')
+    parser.add_argument('--full', action='store_true', help='Ignore the watermark and check every folder')
+    args = parser.parse_args()
+
+    start = time.time()
+    backfill_paper_details(args.output, workers=args.workers, full=args.full)
+    print(f"   Time: {time.time() - start:.2f}s")
+
+
 if __name__ == "__main__":
-    backfill_paper_details()
+    main()
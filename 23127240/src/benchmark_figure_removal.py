@@ -0,0 +1,80 @@
+"""
+Benchmark remove_figures_from_tex against the previous three-pass regex version
+
+Usage: python benchmark_figure_removal.py [size_mb]
+"""
+
+import re
+import sys
+import time
+
+from utils import remove_figures_from_tex
+
+
+def legacy_remove_figures_from_tex(tex_content: str) -> str:
+    """Previous implementation (three re.sub passes), kept for comparison"""
+    tex_content = re.sub(
+        r'\\includegraphics(\[.*?\])?\{.*?\}',
+        r'% Figure removed',
+        tex_content
+    )
+    tex_content = re.sub(
+        r'\\begin\{figure\}.*?\\end\{figure\}',
+        r'% Figure environment removed',
+        tex_content,
+        flags=re.DOTALL
+    )
+    tex_content = re.sub(
+        r'\\begin\{figure\*\}.*?\\end\{figure\*\}',
+        r'% Figure environment removed',
+        tex_content,
+        flags=re.DOTALL
+    )
+    return tex_content
+
+
+def build_paper(size_mb: float, unterminated: int = 0) -> str:
+    """
+    Build a synthetic paper of roughly size_mb megabytes
+
+    Args:
+        size_mb: Target size in MB
+        unterminated: Number of \\begin{figure} without \\end{figure} appended at the end
+    """
+    section = (
+        "\\section{Results}\n"
+        "Some text with an inline \\includegraphics[width=0.3\\linewidth]{plots/inline.png} image.\n"
+        + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20 + "\n"
+        "\\begin{figure}[t]\n\\centering\n\\includegraphics{fig.pdf}\n\\caption{A figure}\n\\end{figure}\n"
+        "\\begin{figure*}\n\\includegraphics[scale=2]{wide.pdf}\n\\end{figure*}\n"
+    )
+    repeats = max(1, int(size_mb * 1024 * 1024 / len(section)))
+    body = section * repeats
+    tail = "\\begin{figure}\nunterminated\n" * unterminated
+    return "\\documentclass{article}\n\\begin{document}\n" + body + tail + "\\end{document}\n"
+
+
+def time_call(func, content: str) -> float:
+    start = time.perf_counter()
+    func(content)
+    return time.perf_counter() - start
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+
+    cases = [
+        (f"{size_mb:g} MB paper", build_paper(size_mb)),
+        (f"{size_mb / 10:g} MB paper + 2000 unterminated figures", build_paper(size_mb / 10, unterminated=2000)),
+    ]
+
+    print(f"{'Case':<45} {'legacy (s)':>12} {'single-pass (s)':>16} {'speedup':>9}  same output")
+    for name, content in cases:
+        legacy_time = time_call(legacy_remove_figures_from_tex, content)
+        new_time = time_call(remove_figures_from_tex, content)
+        same = legacy_remove_figures_from_tex(content) == remove_figures_from_tex(content)
+        print(f"{name:<45} {legacy_time:>12.3f} {new_time:>16.3f} {legacy_time / max(new_time, 1e-9):>8.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+End-to-end throughput benchmark of ArxivScraperPipeline against the local stand-in
+(mock_servers.py), without touching arXiv or Semantic Scholar
+
+Reports papers/sec, peak RSS and disk usage; --json appends the result to a
+file so runs of different revisions or settings can be compared.
+
+Usage: python benchmark_pipeline.py [--papers 200] [--workers 4] [--async-engine] [--no-batch]
+                                    [--extract-processes 2]
+                                    [--latency 0.05] [--throttle-rate 0.1] [--retry-after 1]
+                                    [--json results.jsonl]
+"""
+
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import urllib.request
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS falls back to the pipeline's own samples
+    resource = None
+
+from main import ArxivScraperPipeline
+from mock_servers import serve_in_process
+from rate_limiter import set_host_delay, get_limiter_stats, ARXIV_HOST, SEMANTIC_SCHOLAR_HOST
+from utils import get_directory_size
+
+
+def peak_rss_mb(pipeline: ArxivScraperPipeline) -> float:
+    """Peak resident memory of this process in MB"""
+    if resource is None:
+        return pipeline.stats['max_ram_mb']
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def point_at(pipeline: ArxivScraperPipeline, base_url: str):
+    """Send every request of the pipeline to the stand-in"""
+    pipeline.arxiv_scraper.api_url = f"{base_url}/api/query"
+    pipeline.arxiv_scraper.eprint_url = f"{base_url}/e-print"
+    pipeline.arxiv_scraper.src_url = f"{base_url}/src"
+    pipeline.reference_scraper.api_base = f"{base_url}/graph/v1"
+
+
+def run_benchmark(args) -> dict:
+    corpus_options = {'year_month': args.month, 'num_papers': args.papers, 'seed': args.seed}
+    server_options = {'latency': args.latency, 'throttle_rate': args.throttle_rate,
+                      'retry_after': args.retry_after, 'seed': args.seed}
+    server, base_url = serve_in_process(corpus_options, server_options)
+
+    output_dir = args.output or tempfile.mkdtemp(prefix="arxiv_benchmark_")
+    try:
+        # The stand-in has no rate limit; pace only as much as asked for
+        set_host_delay(ARXIV_HOST, args.arxiv_delay)
+        set_host_delay(SEMANTIC_SCHOLAR_HOST, args.s2_delay)
+
+        pipeline = ArxivScraperPipeline(output_dir, use_batch=not args.no_batch, workers=args.workers,
+                                        use_async_engine=args.async_engine, s2_cache_path=None,
+                                        extract_processes=args.extract_processes)
+        point_at(pipeline, base_url)
+
+        start = time.perf_counter()
+        pipeline.run(start_ym=args.month, start_id=1, end_ym=args.month, end_id=args.papers)
+        elapsed = time.perf_counter() - start
+
+        with urllib.request.urlopen(f"{base_url}/stats") as response:
+            server_stats = json.load(response)
+
+        successful = pipeline.stats['successful_papers']
+        return {
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'papers': args.papers,
+            'workers': args.workers,
+            'async_engine': args.async_engine,
+            'batch': not args.no_batch,
+            'extract_processes': args.extract_processes,
+            'latency_s': args.latency,
+            'throttle_rate': args.throttle_rate,
+            'retry_after_s': args.retry_after,
+            'wall_time_s': round(elapsed, 2),
+            'successful_papers': successful,
+            'failed_papers': pipeline.stats['failed_papers'],
+            'papers_per_sec': round(successful / elapsed, 2) if elapsed > 0 else None,
+            'peak_rss_mb': round(peak_rss_mb(pipeline), 1),
+            'max_disk_mb': round(pipeline.stats['max_disk_mb'], 2),
+            'final_disk_mb': round(pipeline.stats['final_disk_mb'], 2),
+            'output_dir_mb': round(get_directory_size(output_dir) / (1024 * 1024), 2),
+            'server': server_stats,
+            'extract_pool': pipeline.extract_pool.get_stats() if pipeline.extract_pool is not None else None,
+            'commit_writer': pipeline.commit_writer.get_stats() if pipeline.commit_writer is not None else None,
+            'rate_limiters': get_limiter_stats()
+        }
+    finally:
+        server.terminate()
+        server.join()
+        if not args.output and not args.keep:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scraper pipeline against a local stand-in')
+    parser.add_argument('--papers', type=int, default=200, help='Number of synthetic IDs to scrape')
+    parser.add_argument('--month', type=str, default='2311', help='arXiv month of the synthetic IDs')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus and of the 429 injection')
+    parser.add_argument('--workers', type=int, default=1, help='Papers processed concurrently')
+    parser.add_argument('--async-engine', action='store_true', help='Use the asyncio HTTP engine (needs aiohttp)')
+    parser.add_argument('--no-batch', action='store_true', help='One Semantic Scholar request per paper')
+    parser.add_argument('--extract-processes', type=int, default=0, help='Extraction worker processes (0: in the paper threads)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stand-in delays every response')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of Semantic Scholar requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After seconds sent with each 429')
+    parser.add_argument('--arxiv-delay', type=float, default=0.001, help='Seconds between arXiv requests')
+    parser.add_argument('--s2-delay', type=float, default=0.001, help='Initial seconds between Semantic Scholar requests')
+    parser.add_argument('--output', type=str, default=None, help='Output directory (a temporary one is removed afterwards)')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary output directory')
+    parser.add_argument('--json', type=str, default=None, help='Append the result as one JSON line to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show the pipeline log')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    result = run_benchmark(args)
+
+    print(f"\nPipeline benchmark: {args.papers} IDs, {args.workers} worker(s)"
+          f"{', async engine' if args.async_engine else ''}{', no batch' if args.no_batch else ''}"
+          f"{f', {args.extract_processes} extraction processes' if args.extract_processes else ''}, "
+          f"latency {args.latency * 1000:.0f} ms, 429 rate {args.throttle_rate:.0%}")
+    print(f"  Wall time:        {result['wall_time_s']:.2f} s")
+    print(f"  Papers:           {result['successful_papers']} ok, {result['failed_papers']} failed")
+    print(f"  Throughput:       {result['papers_per_sec']} papers/s")
+    print(f"  Peak RSS:         {result['peak_rss_mb']:.1f} MB")
+    print(f"  Disk (peak/final): {result['max_disk_mb']:.2f} / {result['final_disk_mb']:.2f} MB")
+    server_stats = result['server']
+    print(f"  Requests:         {server_stats['arxiv_queries']} metadata, {server_stats['eprint_requests']} e-print, "
+          f"{server_stats['s2_batch_requests'] + server_stats['s2_requests']} Semantic Scholar "
+          f"({server_stats['throttled']} answered 429)")
+    if result['extract_pool'] is not None:
+        pool, writer = result['extract_pool'], result['commit_writer']
+        print(f"  Extraction:       {pool['utilization']:.0%} busy, queue avg {pool['queue']['avg_depth']:.1f} "
+              f"/ max {pool['queue']['max_depth']}, p95 {pool['task_s']['p95']}s")
+        print(f"  Commit writer:    {writer['utilization']:.0%} busy, queue avg {writer['queue']['avg_depth']:.1f} "
+              f"/ max {writer['queue']['max_depth']}")
+
+    if args.json:
+        with open(args.json, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result) + '\n')
+
+
+if __name__ == "__main__":
+    main()
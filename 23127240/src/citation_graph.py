@@ -0,0 +1,293 @@
+"""
+Citation graph index over references.json files (NumPy CSR adjacency)
+
+Usage: python citation_graph.py [--output DATA_DIR] [--graph PATH] [--top K]
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from config import DATA_DIR, CITATION_GRAPH_PATH
+from export_corpus import iter_completed_papers
+from shard_store import ShardStore
+from utils import reference_key_to_arxiv_id, format_folder_name
+
+logger = logging.getLogger(__name__)
+
+
+class CitationGraph:
+    """
+    Directed citation graph: paper -> papers it references.
+
+    arXiv IDs are encoded as integers (self.ids / self.id_index). Out-edges are
+    kept in CSR form (indptr, indices), in-edges in the transposed CSR built on
+    demand. Papers added since the last query are buffered as edge lists and
+    merged into the arrays in one vectorised pass when the next query needs them.
+    Nodes whose own references were added are the corpus (self.is_source).
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.id_index: Dict[str, int] = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.is_source = np.zeros(0, dtype=bool)
+        self.lock = threading.Lock()
+
+        # Buffered updates, merged by _compact()
+        self.pending_sources: List[int] = []
+        self.pending_targets: List[int] = []
+        self.pending_replaced = set()
+        self.pending_new_sources = set()
+
+        self._in_indptr = None
+        self._in_indices = None
+
+    def _encode(self, arxiv_id: str) -> int:
+        node = self.id_index.get(arxiv_id)
+        if node is None:
+            node = len(self.ids)
+            self.ids.append(arxiv_id)
+            self.id_index[arxiv_id] = node
+        return node
+
+    def add_paper(self, arxiv_id: str, reference_ids: Iterable[str]):
+        """
+        Add (or replace) the references of one paper
+
+        Args:
+            arxiv_id: Citing paper
+            reference_ids: arXiv IDs it references
+        """
+        with self.lock:
+            source = self._encode(arxiv_id)
+            if source < len(self.is_source) and self.is_source[source]:
+                self.pending_replaced.add(source)
+            self.pending_new_sources.add(source)
+            for reference_id in reference_ids:
+                self.pending_sources.append(source)
+                self.pending_targets.append(self._encode(reference_id))
+
+    def _compact(self):
+        """Merge buffered papers into the CSR arrays (caller holds self.lock)"""
+        num_nodes = len(self.ids)
+        if not self.pending_new_sources and len(self.is_source) == num_nodes:
+            return
+
+        # Existing edges back to COO, minus papers whose references were replaced
+        old_degree = np.diff(self.indptr)
+        old_sources = np.repeat(np.arange(len(old_degree), dtype=np.int64), old_degree)
+        old_targets = self.indices
+        if self.pending_replaced:
+            keep = ~np.isin(old_sources, np.fromiter(self.pending_replaced, dtype=np.int64))
+            old_sources = old_sources[keep]
+            old_targets = old_targets[keep]
+
+        sources = np.concatenate([old_sources, np.asarray(self.pending_sources, dtype=np.int64)])
+        targets = np.concatenate([old_targets, np.asarray(self.pending_targets, dtype=np.int32)])
+
+        order = np.argsort(sources, kind='stable')
+        self.indices = targets[order].astype(np.int32)
+        counts = np.bincount(sources, minlength=num_nodes)
+        self.indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+
+        is_source = np.zeros(num_nodes, dtype=bool)
+        is_source[:len(self.is_source)] = self.is_source
+        is_source[np.fromiter(self.pending_new_sources, dtype=np.int64)] = True
+        self.is_source = is_source
+
+        self.pending_sources = []
+        self.pending_targets = []
+        self.pending_replaced = set()
+        self.pending_new_sources = set()
+        self._in_indptr = None
+        self._in_indices = None
+
+    def _in_csr(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Transposed CSR (target -> citing papers), caller holds self.lock"""
+        if self._in_indptr is None:
+            sources = np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind='stable')
+            self._in_indices = sources[order]
+            self._in_indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=len(self.ids)), out=self._in_indptr[1:])
+        return self._in_indptr, self._in_indices
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def out_degree(self, arxiv_id: str) -> int:
+        """Number of references of a paper"""
+        with self.lock:
+            self._compact()
+            node = self.id_index.get(arxiv_id)
+            return 0 if node is None else int(self.indptr[node + 1] - self.indptr[node])
+
+    def in_degree(self, arxiv_id: str) -> int:
+        """Number of corpus papers citing a paper"""
+        with self.lock:
+            self._compact()
+            node = self.id_index.get(arxiv_id)
+            if node is None:
+                return 0
+            in_indptr, _ = self._in_csr()
+            return int(in_indptr[node + 1] - in_indptr[node])
+
+    def references(self, arxiv_id: str) -> List[str]:
+        """Papers referenced by a paper"""
+        with self.lock:
+            self._compact()
+            node = self.id_index.get(arxiv_id)
+            if node is None:
+                return []
+            return [self.ids[t] for t in self.indices[self.indptr[node]:self.indptr[node + 1]]]
+
+    def cited_by(self, arxiv_id: str) -> List[str]:
+        """Corpus papers citing a paper"""
+        with self.lock:
+            self._compact()
+            node = self.id_index.get(arxiv_id)
+            if node is None:
+                return []
+            in_indptr, in_indices = self._in_csr()
+            return [self.ids[s] for s in in_indices[in_indptr[node]:in_indptr[node + 1]]]
+
+    def intra_corpus_edges(self) -> List[Tuple[str, str]]:
+        """Citations where both the citing and the cited paper are in the corpus"""
+        with self.lock:
+            self._compact()
+            sources = np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(self.indptr))
+            mask = self.is_source[self.indices]
+            return [(self.ids[s], self.ids[t]) for s, t in zip(sources[mask], self.indices[mask])]
+
+    def top_cited(self, k: int = 10, corpus_only: bool = False) -> List[Tuple[str, int]]:
+        """
+        Most cited papers
+
+        Args:
+            k: Number of papers
+            corpus_only: Only rank papers that are themselves in the corpus
+
+        Returns:
+            List of (arxiv_id, in-degree), highest first
+        """
+        with self.lock:
+            self._compact()
+            counts = np.bincount(self.indices, minlength=len(self.ids))
+            if corpus_only:
+                counts = np.where(self.is_source, counts, 0)
+            k = min(k, len(counts))
+            if k == 0:
+                return []
+            top = np.argpartition(-counts, k - 1)[:k]
+            top = top[np.argsort(-counts[top], kind='stable')]
+            return [(self.ids[n], int(counts[n])) for n in top if counts[n] > 0]
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            self._compact()
+            return {
+                'nodes': len(self.ids),
+                'corpus_papers': int(self.is_source.sum()),
+                'edges': int(len(self.indices)),
+                'intra_corpus_edges': int(self.is_source[self.indices].sum()) if len(self.indices) else 0
+            }
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: str):
+        """Write the graph to a compressed .npz file (atomically)"""
+        with self.lock:
+            self._compact()
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = path + '.tmp.npz'
+            np.savez_compressed(tmp_path, ids=np.array(self.ids, dtype=str), indptr=self.indptr,
+                                indices=self.indices, is_source=self.is_source)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CitationGraph':
+        """Load a graph written by save(), or an empty graph if the file does not exist"""
+        graph = cls()
+        if not os.path.exists(path):
+            return graph
+        with np.load(path) as data:
+            graph.ids = data['ids'].tolist()
+            graph.indptr = data['indptr']
+            graph.indices = data['indices']
+            graph.is_source = data['is_source']
+        graph.id_index = {arxiv_id: node for node, arxiv_id in enumerate(graph.ids)}
+        return graph
+
+    def update_from_output(self, output_dir: str) -> int:
+        """
+        Add every completed paper of an output directory not in the graph yet
+
+        Args:
+            output_dir: Scraper output directory (folders and/or shards)
+
+        Returns:
+            Number of papers added
+        """
+        shard_store = None
+        added = 0
+        for arxiv_id, paper_dir in iter_completed_papers(output_dir):
+            node = self.id_index.get(arxiv_id)
+            if node is not None and node < len(self.is_source) and self.is_source[node]:
+                continue
+            if paper_dir is not None:
+                references = load_references(os.path.join(paper_dir, "references.json"))
+            else:
+                shard_store = shard_store or ShardStore(output_dir)
+                references = shard_store.read_json(f"{format_folder_name(arxiv_id)}/references.json") or {}
+            self.add_paper(arxiv_id, (reference_key_to_arxiv_id(key) for key in references))
+            added += 1
+        return added
+
+
+def load_references(path: str) -> Dict:
+    """references.json content, empty if missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update the citation graph index')
+    parser.add_argument('--output', type=str, default=DATA_DIR, help='Scraper output directory')
+    parser.add_argument('--graph', type=str, default=CITATION_GRAPH_PATH, help='Graph file (.npz)')
+    parser.add_argument('--top', type=int, default=10, help='Number of most cited papers to print')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    start = time.time()
+    graph = CitationGraph.load(args.graph)
+    added = graph.update_from_output(args.output)
+    graph.save(args.graph)
+    stats = graph.get_stats()
+    print(f"Added {added} papers in {time.time() - start:.2f}s: {stats['corpus_papers']} papers, "
+          f"{stats['nodes']} nodes, {stats['edges']} edges ({stats['intra_corpus_edges']} within the corpus)")
+
+    print(f"\nTop {args.top} cited:")
+    for arxiv_id, count in graph.top_cited(args.top):
+        print(f"  {arxiv_id}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,16 +14,102 @@ END_YEAR_MONTH = "2312"
 END_ID = 844
 
 ARXIV_API_DELAY = 3.0
+ARXIV_API_URL = "https://export.arxiv.org/api/query"
+ARXIV_EPRINT_URL = "https://arxiv.org/e-print"
+ARXIV_SRC_URL = "https://arxiv.org/src"
+# IDs per id_list query in the batched metadata stage
+METADATA_BATCH_SIZE = 200
 SEMANTIC_SCHOLAR_DELAY = 1.1
 
+# Adaptive Semantic Scholar pacing (AIMD): starts at 1 / SEMANTIC_SCHOLAR_DELAY,
+# adds S2_RATE_INCREASE req/s per successful response (up to S2_MAX_RATE) and
+# multiplies the rate by S2_RATE_DECREASE on a 429 (down to S2_MIN_RATE)
+S2_MIN_RATE = 0.05
+S2_MAX_RATE = 3.0
+S2_RATE_INCREASE = 0.02
+S2_RATE_DECREASE = 0.5
+# Pause after a 429 without Retry-After: doubles per consecutive 429, capped
+S2_RATE_LIMIT_BACKOFF = 10.0
+S2_RATE_LIMIT_MAX_PAUSE = 300.0
+
 MAX_RETRIES = 3
 RETRY_DELAY = 5.0
 
 DATA_DIR = f"../{STUDENT_ID}_data"
+# Consolidated tables written by export_corpus.py (kept out of the graded output directory)
+EXPORT_DIR = f"../{STUDENT_ID}_export"
+CITATION_GRAPH_PATH = f"{EXPORT_DIR}/citation_graph.npz"
 LOGS_DIR = "./logs"
 
 MAX_FILE_SIZE = 100 * 1024 * 1024
 
+# Source size guards (downloads above MAX_FILE_SIZE are aborted, the paper is
+# recorded as 'oversized'). An archive may expand to MAX_COMPRESSION_RATIO times
+# its download size, but always to MAX_MEMBER_SIZE and never past
+# MAX_EXTRACTED_SIZE; members (.tex/.bib) above MAX_MEMBER_SIZE are never read
+MAX_COMPRESSION_RATIO = 100
+MAX_EXTRACTED_SIZE = 1024 * 1024 * 1024
+MAX_MEMBER_SIZE = 32 * 1024 * 1024
+
+# Papers between full walks that correct the running disk ledger
+DISK_RECONCILE_INTERVAL = 500
+
+# SQLite file (inside the output directory) holding each paper's lifecycle status
+RUN_STATE_DB = "run_state.db"
+
+# Connection pool of the asyncio HTTP engine (--async-engine)
+ASYNC_MAX_CONNECTIONS = 32
+ASYNC_CONNECTIONS_PER_HOST = 8
+
+# Bounded queues of the process-pool pipeline (--extract-processes): archives
+# waiting for or in extraction, and papers waiting for the commit thread
+EXTRACT_QUEUE_SIZE = 16
+COMMIT_QUEUE_SIZE = 8
+
+# Size cap of the source tarball cache (--cache-dir); least recently used entries are evicted
+SOURCE_CACHE_MAX_MB = 2048
+
+# Semantic Scholar response cache shared by all runs (--s2-cache); "not found"
+# answers expire sooner since papers can be indexed later
+S2_CACHE_PATH = "./cache/s2_responses.db"
+S2_CACHE_TTL_DAYS = 30
+S2_CACHE_NEGATIVE_TTL_DAYS = 7
+
+# Background resource sampler: seconds between RSS / CPU / I/O samples written to
+# the time series file in the output directory (--sample-interval, 0 disables);
+# with --tracemalloc the top allocation sites are snapshotted at the slower interval
+RESOURCE_SAMPLE_INTERVAL = 0.5
+RESOURCE_SAMPLES_FILE = "resource_samples.csv"
+TRACEMALLOC_INTERVAL = 30.0
+TRACEMALLOC_TOP = 10
+TRACEMALLOC_FILE = "tracemalloc_snapshots.jsonl"
+
+# Subdirectory of the output directory holding packed shards (--storage shards)
+SHARD_DIR_NAME = "shards"
+# Committed papers packed per shard append (each append rewrites the central
+# directory of the zip, so packing one paper at a time is quadratic)
+SHARD_PACK_BATCH_SIZE = 50
+
+# Environments removed from paper.tex in addition to figure / figure*
+EXTRA_FIGURE_ENVIRONMENTS = ['wrapfigure', 'subfigure', 'tikzpicture']
+
+# Deferred reference phase: flush queued papers to /paper/batch when this many
+# are waiting (API maximum is 500) or the oldest has waited this many seconds
+REFERENCE_BATCH_SIZE = 500
+REFERENCE_FLUSH_INTERVAL = 600
+
+# /paper/batch sizing: halved (not below the minimum) after a timeout or an
+# oversized response, grown again after a batch answered within the fast threshold
+REFERENCE_MIN_BATCH_SIZE = 25
+REFERENCE_BATCH_GROWTH = 50
+REFERENCE_FAST_BATCH_SECONDS = 10.0
+# Failing batches are split in half; after this many failed requests in a row the
+# rest is left for a later retry. Above log2(500) + 1, so isolating one bad ID never trips it
+REFERENCE_MAX_CONSECUTIVE_FAILURES = 12
+# Rate-limited (429) batches are re-queued whole, neither split nor counted as
+# failures; after this many 429s in a row the rest is left for a later retry
+REFERENCE_MAX_CONSECUTIVE_THROTTLES = 20
+
 SEMANTIC_SCHOLAR_API_BASE = "https://api.semanticscholar.org/graph/v1"
 SEMANTIC_SCHOLAR_FIELDS = "references,references.paperId,references.externalIds,references.title,references.authors,references.publicationDate,references.year"
 
@@ -0,0 +1,3 @@
+# test_scraper.py and test_source_url.py are interactive scripts that talk to
+# arXiv; pytest only collects the offline tests
+collect_ignore = ["test_scraper.py", "test_source_url.py"]
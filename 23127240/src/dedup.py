@@ -0,0 +1,155 @@
+"""
+Hash-based deduplication of output files with hardlinks
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "dedup_manifest.jsonl"
+
+
+def sha256_of(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    """
+    Replaces output files whose content was already written (an unchanged
+    references.bib in v2, the same paper.tex in two versions or two papers)
+    with hardlinks to the first copy.
+
+    Every decision is appended to dedup_manifest.jsonl in the output directory:
+    one line per file with its hash, size and, for duplicates, the file it is
+    linked to. The manifest also rebuilds the hash index on the next run.
+    """
+
+    def __init__(self, output_dir: str, disk_ledger=None):
+        """
+        Initialize index from an existing manifest, if any
+
+        Args:
+            output_dir: Output directory (paths in the manifest are relative to it)
+            disk_ledger: Optional DiskLedger of the output directory; manifest
+                appends are reported to it
+        """
+        self.output_dir = output_dir
+        self.disk_ledger = disk_ledger
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        self.canonical = {}  # sha256 -> relative path of the first copy
+        self.links_supported = True
+        self.stats = {
+            'files_checked': 0,
+            'files_deduplicated': 0,
+            'bytes_checked': 0,
+            'bytes_saved': 0,
+            'link_errors': 0
+        }
+        self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    self.stats['files_checked'] += 1
+                    self.stats['bytes_checked'] += record['size']
+                    if record.get('link_to'):
+                        self.stats['files_deduplicated'] += 1
+                        self.stats['bytes_saved'] += record['size']
+                    else:
+                        self.canonical.setdefault(record['sha256'], record['path'])
+            logger.info(f"Loaded dedup manifest: {len(self.canonical)} unique files, "
+                        f"{self.stats['files_deduplicated']} links")
+        except Exception as e:
+            logger.warning(f"Failed to load dedup manifest: {e}")
+
+    def _append_manifest(self, record: Dict):
+        """Append one record (caller holds self.lock)"""
+        line = json.dumps(record) + '\n'
+        with open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+        if self.disk_ledger is not None:
+            self.disk_ledger.add(len(line.encode('utf-8')))
+
+    def deduplicate(self, path: str) -> int:
+        """
+        Hash a freshly written file and hardlink it to an identical earlier file
+
+        Args:
+            path: File inside the output directory
+
+        Returns:
+            Bytes saved (the file size if it became a link, else 0)
+        """
+        try:
+            size = os.path.getsize(path)
+            if size == 0:
+                return 0
+            sha256 = sha256_of(path)
+        except OSError as e:
+            logger.warning(f"Could not hash {path}: {e}")
+            return 0
+
+        rel_path = os.path.relpath(path, self.output_dir)
+        record = {'path': rel_path, 'sha256': sha256, 'size': size, 'link_to': None}
+        saved = 0
+
+        with self.lock:
+            self.stats['files_checked'] += 1
+            self.stats['bytes_checked'] += size
+
+            canonical = self.canonical.get(sha256)
+            canonical_path = os.path.join(self.output_dir, canonical) if canonical else None
+            if canonical_path is None or canonical == rel_path or not os.path.exists(canonical_path):
+                # First copy of this content (or the previous first copy is gone)
+                self.canonical[sha256] = rel_path
+            elif self.links_supported and not os.path.samefile(canonical_path, path):
+                tmp_path = f"{path}.dedup"
+                try:
+                    os.link(canonical_path, tmp_path)
+                    os.replace(tmp_path, path)
+                    record['link_to'] = canonical
+                    saved = size
+                    self.stats['files_deduplicated'] += 1
+                    self.stats['bytes_saved'] += size
+                except OSError as e:
+                    # e.g. a filesystem without hardlinks (mounted Drive): keep copies
+                    self.stats['link_errors'] += 1
+                    self.links_supported = False
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    logger.warning(f"Hardlinks not supported in {self.output_dir}, deduplication disabled: {e}")
+
+            try:
+                self._append_manifest(record)
+            except OSError as e:
+                logger.warning(f"Failed to write dedup manifest: {e}")
+
+        if saved:
+            logger.debug(f"Deduplicated {rel_path} -> {canonical} ({size} bytes)")
+        return saved
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+        stored = stats['bytes_checked'] - stats['bytes_saved']
+        stats['unique_files'] = len(self.canonical)
+        stats['dedup_ratio'] = round(stats['bytes_checked'] / stored, 3) if stored > 0 else 1.0
+        stats['bytes_saved_mb'] = round(stats['bytes_saved'] / (1024 * 1024), 2)
+        return stats
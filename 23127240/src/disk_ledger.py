@@ -0,0 +1,102 @@
+"""
+Running byte ledger for the output directory
+"""
+
+import os
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict
+
+from utils import get_directory_size
+
+logger = logging.getLogger(__name__)
+
+
+def file_size(path: str) -> int:
+    """Size of a file in bytes, 0 if it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class DiskLedger:
+    """
+    Tracks the size of the output tree from the writes the pipeline makes,
+    instead of walking the whole tree after every paper
+    """
+
+    def __init__(self, root: str):
+        """
+        Initialize ledger with one full walk of the output directory
+
+        Args:
+            root: Output directory
+        """
+        self.root = root
+        self.lock = threading.Lock()
+        self.current_bytes = get_directory_size(root) if os.path.exists(root) else 0
+        self.peak_bytes = self.current_bytes
+        self.stats = {
+            'updates': 0,
+            'reconciles': 0,
+            'last_drift_bytes': 0
+        }
+
+    def add(self, delta: int):
+        """
+        Record bytes written (positive) or deleted (negative)
+
+        Args:
+            delta: Change in bytes
+        """
+        with self.lock:
+            self.current_bytes += delta
+            if self.current_bytes > self.peak_bytes:
+                self.peak_bytes = self.current_bytes
+            self.stats['updates'] += 1
+
+    @contextmanager
+    def tracking(self, *paths: str):
+        """Record the size change of the files (re)written inside the block"""
+        before = sum(file_size(path) for path in paths)
+        try:
+            yield
+        finally:
+            self.add(sum(file_size(path) for path in paths) - before)
+
+    def reconcile(self) -> int:
+        """
+        Correct accumulated drift with one full walk (e.g. files removed by hand,
+        temp files left behind by a crash)
+
+        Returns:
+            Current size in bytes
+        """
+        actual = get_directory_size(self.root)
+        with self.lock:
+            drift = actual - self.current_bytes
+            self.current_bytes = actual
+            if actual > self.peak_bytes:
+                self.peak_bytes = actual
+            self.stats['reconciles'] += 1
+            self.stats['last_drift_bytes'] = drift
+        if drift:
+            logger.info(f"Disk ledger reconciled: drift {drift / 1024:.1f} KB")
+        return actual
+
+    def get_current_mb(self) -> float:
+        with self.lock:
+            return self.current_bytes / (1024 * 1024)
+
+    def get_peak_mb(self) -> float:
+        with self.lock:
+            return self.peak_bytes / (1024 * 1024)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+            stats['current_bytes'] = self.current_bytes
+            stats['peak_bytes'] = self.peak_bytes
+            return stats
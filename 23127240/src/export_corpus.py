@@ -0,0 +1,325 @@
+"""
+Export the scraped corpus into two consolidated tables
+
+    <export_dir>/metadata.jsonl.gz     one row per paper (metadata.json + num_references)
+    <export_dir>/references.jsonl.gz   one row per reference edge (source_id -> target_id)
+
+plus metadata/part-NNNNN.parquet and references/part-NNNNN.parquet when pyarrow
+is installed. Each run only appends papers that were not exported before
+(tracked in export_state.json); gzip members and parquet parts are appended.
+A paper whose references.json changed since its export (e.g. after
+retry_references.py) is exported again: its old rows are first removed from
+the tables, the only case in which earlier output is rewritten.
+
+Usage: python export_corpus.py [--output DATA_DIR] [--export-dir DIR] [--full]
+"""
+
+import os
+import gzip
+import json
+import time
+import shutil
+import argparse
+import logging
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from config import DATA_DIR, EXPORT_DIR, SHARD_DIR_NAME
+from shard_store import ShardStore, INDEX_NAME
+from utils import reference_key_to_arxiv_id
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # parquet output is optional
+    pa = None
+    pc = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "export_state.json"
+METADATA_TABLE = "metadata"
+REFERENCES_TABLE = "references"
+
+# Key column of each table: the paper its rows belong to
+TABLE_KEYS = {METADATA_TABLE: 'arxiv_id', REFERENCES_TABLE: 'source_id'}
+
+METADATA_FIELDS = ['arxiv_id', 'title', 'authors', 'submission_date', 'revised_dates',
+                   'publication_venue', 'abstract', 'categories', 'primary_category',
+                   'doi', 'journal_ref', 'pdf_url', 'comment', 'num_references']
+
+if pa is not None:
+    METADATA_SCHEMA = pa.schema([
+        ('arxiv_id', pa.string()),
+        ('title', pa.string()),
+        ('authors', pa.list_(pa.string())),
+        ('submission_date', pa.string()),
+        ('revised_dates', pa.list_(pa.string())),
+        ('publication_venue', pa.string()),
+        ('abstract', pa.string()),
+        ('categories', pa.list_(pa.string())),
+        ('primary_category', pa.string()),
+        ('doi', pa.string()),
+        ('journal_ref', pa.string()),
+        ('pdf_url', pa.string()),
+        ('comment', pa.string()),
+        ('num_references', pa.int32()),
+    ])
+    REFERENCES_SCHEMA = pa.schema([
+        ('source_id', pa.string()),
+        ('target_id', pa.string()),
+        ('title', pa.string()),
+        ('authors', pa.list_(pa.string())),
+        ('submission_date', pa.string()),
+        ('semantic_scholar_id', pa.string()),
+    ])
+
+
+def iter_completed_papers(output_dir: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    List papers that have both metadata.json and references.json
+
+    Yields:
+        Tuple of (arxiv_id, paper_dir), with paper_dir None for papers packed in
+        shards. Each paper is yielded once: a paper that is both a folder and a
+        shard entry (packing interrupted, or unpacked without removing the
+        shards) is read from its folder.
+    """
+    folders = set()
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir() or entry.name == SHARD_DIR_NAME or '-' not in entry.name:
+                continue
+            if (os.path.exists(os.path.join(entry.path, "metadata.json"))
+                    and os.path.exists(os.path.join(entry.path, "references.json"))):
+                arxiv_id = entry.name.replace('-', '.')
+                folders.add(arxiv_id)
+                yield arxiv_id, entry.path
+
+    if os.path.exists(os.path.join(output_dir, SHARD_DIR_NAME, INDEX_NAME)):
+        for arxiv_id in ShardStore(output_dir).list_papers():
+            if arxiv_id not in folders:
+                yield arxiv_id, None
+
+
+class CorpusExporter:
+    """Appends new papers of an output directory to the consolidated tables"""
+
+    def __init__(self, output_dir: str, export_dir: str):
+        """
+        Args:
+            output_dir: Scraper output directory (folders and/or shards)
+            export_dir: Directory of the exported tables
+        """
+        self.output_dir = output_dir
+        self.export_dir = export_dir
+        self.state_path = os.path.join(export_dir, STATE_FILE)
+        self.shard_store = None
+        os.makedirs(export_dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict:
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            # Older states list IDs only: their version is recorded on the next export
+            if 'exported_ids' in state:
+                state['exported'] = dict.fromkeys(state.pop('exported_ids'))
+            return state
+        return {'exported': {}, 'parts': 0, 'papers': 0, 'edges': 0}
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _read_json(self, arxiv_id: str, paper_dir: Optional[str], filename: str) -> Dict:
+        if paper_dir is not None:
+            with open(os.path.join(paper_dir, filename), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        if self.shard_store is None:
+            self.shard_store = ShardStore(self.output_dir)
+        folder = arxiv_id.replace('.', '-')
+        return self.shard_store.read_json(f"{folder}/{filename}") or {}
+
+    def _references_version(self, arxiv_id: str, paper_dir: Optional[str]) -> Optional[int]:
+        """
+        Modification time of references.json, floored to even seconds: zip
+        entries keep 2-second times, so a paper keeps its version when packed
+        """
+        if paper_dir is not None:
+            mtime = os.stat(os.path.join(paper_dir, "references.json")).st_mtime
+        else:
+            if self.shard_store is None:
+                self.shard_store = ShardStore(self.output_dir)
+            mtime = self.shard_store.mtime(f"{arxiv_id.replace('.', '-')}/references.json")
+            if mtime is None:
+                return None
+        return int(mtime) // 2 * 2
+
+    def _build_rows(self, arxiv_id: str, paper_dir: Optional[str]) -> Tuple[Dict, List[Dict]]:
+        metadata = self._read_json(arxiv_id, paper_dir, "metadata.json")
+        references = self._read_json(arxiv_id, paper_dir, "references.json")
+
+        row = {field: metadata.get(field) for field in METADATA_FIELDS}
+        row['arxiv_id'] = arxiv_id
+        row['num_references'] = len(references)
+
+        edges = []
+        for key, ref in references.items():
+            edges.append({
+                'source_id': arxiv_id,
+                'target_id': reference_key_to_arxiv_id(key),
+                'title': ref.get('title'),
+                'authors': ref.get('authors') or [],
+                'submission_date': ref.get('submission_date'),
+                'semantic_scholar_id': ref.get('semantic_scholar_id')
+            })
+        return row, edges
+
+    def _append_jsonl(self, table: str, rows: List[Dict]):
+        """Append rows as one new gzip member (concatenated members are one valid .gz file)"""
+        path = os.path.join(self.export_dir, f"{table}.jsonl.gz")
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as gz:
+                for row in rows:
+                    gz.write((json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    def _append_parquet(self, table: str, rows: List[Dict], schema, part: int):
+        table_dir = os.path.join(self.export_dir, table)
+        os.makedirs(table_dir, exist_ok=True)
+        pq.write_table(pa.Table.from_pylist(rows, schema=schema),
+                       os.path.join(table_dir, f"part-{part:05d}.parquet"),
+                       compression='zstd')
+
+    def _drop_papers(self, arxiv_ids: Set[str]) -> Tuple[int, int]:
+        """
+        Remove the rows of papers that are exported again from every table
+
+        Returns:
+            Number of (metadata rows, reference edges) removed
+        """
+        removed = {}
+        for table, key in TABLE_KEYS.items():
+            removed[table] = 0
+            path = os.path.join(self.export_dir, f"{table}.jsonl.gz")
+            if os.path.exists(path):
+                tmp_path = path + '.tmp'
+                with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                    for row in iter_jsonl(path):
+                        if row[key] in arxiv_ids:
+                            removed[table] += 1
+                        else:
+                            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                os.replace(tmp_path, path)
+
+            table_dir = os.path.join(self.export_dir, table)
+            if pa is None or not os.path.isdir(table_dir):
+                continue
+            value_set = pa.array(sorted(arxiv_ids), type=pa.string())
+            for name in sorted(os.listdir(table_dir)):
+                part_path = os.path.join(table_dir, name)
+                part = pq.read_table(part_path)
+                kept = part.filter(pc.invert(pc.is_in(part[key], value_set=value_set)))
+                if kept.num_rows < part.num_rows:
+                    tmp_path = part_path + '.tmp'
+                    pq.write_table(kept, tmp_path, compression='zstd')
+                    os.replace(tmp_path, part_path)
+        return removed[METADATA_TABLE], removed[REFERENCES_TABLE]
+
+    def export(self) -> Dict:
+        """
+        Export papers that are not in the tables yet, and papers whose
+        references.json changed since they were exported
+
+        Returns:
+            Dictionary with the number of new papers, papers exported again and
+            edges written
+        """
+        start = time.time()
+        exported = self.state['exported']
+        papers = []
+        versions = {}
+        changed = set()
+        for arxiv_id, paper_dir in iter_completed_papers(self.output_dir):
+            versions[arxiv_id] = self._references_version(arxiv_id, paper_dir)
+            if arxiv_id not in exported:
+                papers.append((arxiv_id, paper_dir))
+            elif exported[arxiv_id] is None:
+                exported[arxiv_id] = versions[arxiv_id]
+            elif exported[arxiv_id] != versions[arxiv_id]:
+                changed.add(arxiv_id)
+                papers.append((arxiv_id, paper_dir))
+        papers.sort(key=lambda paper: paper[0])
+        if not papers:
+            logger.info("Export is up to date")
+            return {'new_papers': 0, 'new_edges': 0, 'updated_papers': 0}
+
+        removed_papers, removed_edges = self._drop_papers(changed) if changed else (0, 0)
+
+        metadata_rows = []
+        edge_rows = []
+        for arxiv_id, paper_dir in papers:
+            try:
+                row, edges = self._build_rows(arxiv_id, paper_dir)
+            except Exception as e:
+                logger.warning(f"Skipping {arxiv_id}: {e}")
+                continue
+            metadata_rows.append(row)
+            edge_rows.extend(edges)
+
+        self._append_jsonl(METADATA_TABLE, metadata_rows)
+        self._append_jsonl(REFERENCES_TABLE, edge_rows)
+
+        part = self.state['parts'] + 1
+        if pa is not None:
+            self._append_parquet(METADATA_TABLE, metadata_rows, METADATA_SCHEMA, part)
+            if edge_rows:
+                self._append_parquet(REFERENCES_TABLE, edge_rows, REFERENCES_SCHEMA, part)
+        else:
+            logger.info("pyarrow not installed, parquet output skipped")
+
+        # State last: a crash before this point re-exports the same papers next time
+        for row in metadata_rows:
+            exported[row['arxiv_id']] = versions[row['arxiv_id']]
+        self.state['parts'] = part
+        self.state['papers'] += len(metadata_rows) - removed_papers
+        self.state['edges'] += len(edge_rows) - removed_edges
+        self.state['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._save_state()
+
+        updated = len(changed & {row['arxiv_id'] for row in metadata_rows})
+        logger.info(f"Exported {len(metadata_rows)} papers ({updated} with changed references) and "
+                    f"{len(edge_rows)} reference edges in {time.time() - start:.2f}s "
+                    f"(total {self.state['papers']} papers)")
+        return {'new_papers': len(metadata_rows) - updated, 'updated_papers': updated, 'new_edges': len(edge_rows)}
+
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    """Read an exported table sequentially, one row at a time"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the scraped corpus into consolidated tables')
+    parser.add_argument('--output', type=str, default=DATA_DIR, help='Scraper output directory')
+    parser.add_argument('--export-dir', type=str, default=EXPORT_DIR, help='Directory of the exported tables')
+    parser.add_argument('--full', action='store_true', help='Discard the previous export and export everything again')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.full and os.path.exists(args.export_dir):
+        shutil.rmtree(args.export_dir)
+
+    result = CorpusExporter(args.output, args.export_dir).export()
+    print(f"New papers: {result['new_papers']}, papers with changed references: {result['updated_papers']}, "
+          f"reference edges written: {result['new_edges']}")
+
+
+if __name__ == "__main__":
+    main()
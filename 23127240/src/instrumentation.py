@@ -0,0 +1,211 @@
+"""
+Lightweight timing spans for the pipeline stages
+"""
+
+import math
+import time
+import asyncio
+import inspect
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+PERCENTILES = (50, 95, 99)
+
+
+class _Span:
+    __slots__ = ('stage', 'label', 'parent', 'sleep')
+
+    def __init__(self, stage: str, label: Optional[str], parent: Optional['_Span']):
+        self.stage = stage
+        self.label = label
+        self.parent = parent
+        self.sleep = 0.0
+
+
+class StageTimer:
+    """
+    Wall time per stage, with the time spent sleeping counted separately.
+
+    Spans nest and each stage is inclusive of the stages it contains (a
+    'download' span includes its rate-limit wait, 'extract' includes
+    'figure_removal'). Sleeps reported through record_sleep() (rate-limit waits,
+    retry backoff) are charged to every span open in the current thread or
+    asyncio task, so work time = wall time - sleep time. Open spans are tracked
+    in a context variable: worker threads and engine coroutines each see their own.
+    A span can carry a label (the arXiv ID being processed), inherited by the
+    spans nested in it; active_spans() lists what is running right now, for
+    samplers on other threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[Tuple[float, float]]] = {}   # stage -> [(wall, sleep)]
+        self.sleeps: Dict[str, List[float]] = {}                  # reason -> [seconds]
+        self.open_spans = contextvars.ContextVar('open_spans', default=())
+        self.active = set()                                       # spans open in any thread
+
+    @contextmanager
+    def span(self, stage: str, label: Optional[str] = None):
+        """Time the enclosed block as one sample of a stage"""
+        stack = self.open_spans.get()
+        parent = stack[-1] if stack else None
+        if label is None and parent is not None:
+            label = parent.label
+        span = _Span(stage, label, parent)
+        token = self.open_spans.set(stack + (span,))
+        with self.lock:
+            self.active.add(span)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            self.open_spans.reset(token)
+            with self.lock:
+                self.active.discard(span)
+                self.samples.setdefault(stage, []).append((wall, span.sleep))
+
+    def active_spans(self) -> List[Tuple[str, Optional[str]]]:
+        """(stage, label) of the innermost open span of every thread / task"""
+        with self.lock:
+            active = list(self.active)
+        parents = {id(span.parent) for span in active if span.parent is not None}
+        return sorted((span.stage, span.label) for span in active if id(span) not in parents)
+
+    def record_sleep(self, reason: str, seconds: float):
+        """Account for time spent sleeping (the caller did the sleeping)"""
+        if seconds <= 0:
+            return
+        for span in self.open_spans.get():
+            span.sleep += seconds
+        with self.lock:
+            self.sleeps.setdefault(reason, []).append(seconds)
+
+    def get_stats(self) -> Dict:
+        """
+        Per-stage and per-sleep-reason summaries
+
+        Returns:
+            {'stages': {stage: {count, wall_total_s, sleep_total_s, work_total_s,
+            wall_s: {p50, p95, p99}, work_s: {p50, p95, p99}}},
+            'sleep': {reason: {count, total_s, p50, p95, p99}}}
+        """
+        with self.lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+            sleeps = {reason: list(values) for reason, values in self.sleeps.items()}
+
+        stages = {}
+        for stage, values in sorted(samples.items()):
+            wall = [w for w, _ in values]
+            work = [max(0.0, w - s) for w, s in values]
+            sleep_total = sum(s for _, s in values)
+            stages[stage] = {
+                'count': len(values),
+                'wall_total_s': round(sum(wall), 3),
+                'sleep_total_s': round(sleep_total, 3),
+                'work_total_s': round(sum(work), 3),
+                'wall_s': percentiles(wall),
+                'work_s': percentiles(work)
+            }
+        return {
+            'stages': stages,
+            'sleep': {reason: {'count': len(values), 'total_s': round(sum(values), 3), **percentiles(values)}
+                      for reason, values in sorted(sleeps.items())}
+        }
+
+    def drain(self) -> Tuple[Dict[str, List[Tuple[float, float]]], Dict[str, List[float]]]:
+        """Take the samples and sleeps recorded so far, leaving the timer empty"""
+        with self.lock:
+            samples, self.samples = self.samples, {}
+            sleeps, self.sleeps = self.sleeps, {}
+        return samples, sleeps
+
+    def merge(self, samples: Dict[str, List[Tuple[float, float]]], sleeps: Dict[str, List[float]]):
+        """Add samples and sleeps taken by another timer (e.g., drained in a worker process)"""
+        with self.lock:
+            for stage, values in samples.items():
+                self.samples.setdefault(stage, []).extend(values)
+            for reason, values in sleeps.items():
+                self.sleeps.setdefault(reason, []).extend(values)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.sleeps.clear()
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50 / p95 / p99 of a list of seconds"""
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES}
+    ordered = sorted(values)
+    return {f"p{p}": round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 4) for p in PERCENTILES}
+
+
+# Process-wide timer used by the pipeline modules
+timer = StageTimer()
+
+
+def span(stage: str, label: Optional[str] = None):
+    """Context manager timing one sample of a stage on the shared timer"""
+    return timer.span(stage, label)
+
+
+def timed(stage: str, label_arg: Optional[str] = None):
+    """
+    Decorator timing every call of a function (or coroutine function) as a stage
+
+    Args:
+        stage: Stage name
+        label_arg: Name of the argument used as span label (e.g., 'arxiv_id')
+    """
+    def decorator(func):
+        position = list(inspect.signature(func).parameters).index(label_arg) if label_arg else None
+
+        def label(args, kwargs) -> Optional[str]:
+            if position is None:
+                return None
+            if label_arg in kwargs:
+                return kwargs[label_arg]
+            return args[position] if position < len(args) else None
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer.span(stage, label(args, kwargs)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer.span(stage, label(args, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_sleep(reason: str, seconds: float):
+    timer.record_sleep(reason, seconds)
+
+
+def timed_sleep(seconds: float, reason: str):
+    """time.sleep that is reported as sleep time"""
+    time.sleep(seconds)
+    timer.record_sleep(reason, seconds)
+
+
+async def timed_async_sleep(seconds: float, reason: str):
+    """asyncio.sleep that is reported as sleep time"""
+    await asyncio.sleep(seconds)
+    timer.record_sleep(reason, seconds)
+
+
+def get_stage_stats() -> Dict:
+    return timer.get_stats()
+
+
+def active_spans() -> List[Tuple[str, Optional[str]]]:
+    return timer.active_spans()
@@ -12,42 +12,118 @@ import logging
 import shutil
 import psutil
 import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 
 from config import (
     STUDENT_ID, START_YEAR_MONTH, START_ID,
-    END_YEAR_MONTH, END_ID, DATA_DIR, LOGS_DIR
+    END_YEAR_MONTH, END_ID, DATA_DIR, LOGS_DIR, METADATA_BATCH_SIZE,
+    REFERENCE_BATCH_SIZE, REFERENCE_FLUSH_INTERVAL, DISK_RECONCILE_INTERVAL,
+    RUN_STATE_DB, SOURCE_CACHE_MAX_MB, CITATION_GRAPH_PATH,
+    S2_CACHE_PATH, S2_CACHE_TTL_DAYS, S2_CACHE_NEGATIVE_TTL_DAYS,
+    RESOURCE_SAMPLE_INTERVAL, RESOURCE_SAMPLES_FILE, TRACEMALLOC_INTERVAL, TRACEMALLOC_TOP, TRACEMALLOC_FILE,
+    EXTRACT_QUEUE_SIZE, COMMIT_QUEUE_SIZE, SHARD_PACK_BATCH_SIZE
 )
 from utils import (
     setup_logging, format_arxiv_id, format_folder_name,
-    ensure_dir, get_directory_size
+    ensure_dir, get_directory_size, reference_key_to_arxiv_id
 )
 from arxiv_scraper import ArxivScraper
 from reference_scraper import ReferenceScraper
 from reference_scraper_optimized import OptimizedReferenceScraper
 from bibtex_generator import BibtexGenerator
+from rate_limiter import get_limiter_stats
+from instrumentation import timed, span, get_stage_stats
+from resource_sampler import ResourceSampler
+from stage_pipeline import ExtractionPool, CommitWriter
+from disk_ledger import DiskLedger, file_size
+from source_cache import SourceCache
+from s2_cache import open_cache
+from dedup import DedupIndex
+from shard_store import ShardStore
+from run_state import (
+    RunState, STATUS_ATTEMPTED, STATUS_REFERENCES, STATUS_COMMITTED, STATUS_FAILED,
+    PENDING_REFERENCE_STATUSES
+)
 
 logger = logging.getLogger(__name__)
 
 
 class ArxivScraperPipeline:
     
-    def __init__(self, output_dir: str, use_batch: bool = True):
+    def __init__(self, output_dir: str, use_batch: bool = True, workers: int = 1,
+                 use_async_engine: bool = False, cache_dir: str = None,
+                 cache_size_mb: float = SOURCE_CACHE_MAX_MB, use_dedup: bool = True,
+                 storage: str = 'tree', citation_graph_path: str = None,
+                 s2_cache_path: str = S2_CACHE_PATH, sample_interval: float = RESOURCE_SAMPLE_INTERVAL,
+                 use_tracemalloc: bool = False, extract_processes: int = 0):
         self.output_dir = output_dir
         self.use_batch = use_batch
+        self.workers = max(1, workers)
         ensure_dir(output_dir)
         
-        self.arxiv_scraper = ArxivScraper(output_dir)
+        # Guards stats, paper_details and checkpoint writes when several
+        # papers are processed at once (--workers > 1)
+        self.lock = threading.RLock()
+        # Semantic Scholar calls are serialized so that per-paper reference
+        # counts (taken as a before/after difference) stay correct
+        self.reference_lock = threading.Lock()
+        
+        # Running byte count of the output tree; replaces a full os.walk per paper
+        self.disk_ledger = DiskLedger(output_dir)
+        # Lifecycle of every paper; resume queries this instead of scanning folders
+        self.run_state = RunState(os.path.join(output_dir, RUN_STATE_DB), disk_ledger=self.disk_ledger)
+        # Source tarballs survive reruns and output directory changes when a cache dir is given
+        self.source_cache = None
+        if cache_dir:
+            self.source_cache = SourceCache(cache_dir, int(cache_size_mb * 1024 * 1024))
+            logger.info(f"Using source cache at {cache_dir} (max {cache_size_mb:.0f} MB)")
+        # Semantic Scholar answers are reused across runs (disabled when the path is None)
+        self.s2_cache = open_cache(s2_cache_path, S2_CACHE_TTL_DAYS, S2_CACHE_NEGATIVE_TTL_DAYS)
+        # Repeated paper.tex / references.bib files become hardlinks to the first copy
+        self.dedup = DedupIndex(output_dir, disk_ledger=self.disk_ledger) if use_dedup else None
+        # storage='shards': finished papers are moved into per-month zip shards
+        self.shard_store = ShardStore(output_dir) if storage == 'shards' else None
+        
+        # Optional citation graph index, updated as papers are committed
+        self.citation_graph = None
+        self.citation_graph_path = citation_graph_path
+        if citation_graph_path:
+            from citation_graph import CitationGraph  # needs numpy, only imported when enabled
+            self.citation_graph = CitationGraph.load(citation_graph_path)
+        self.arxiv_scraper = ArxivScraper(output_dir, disk_ledger=self.disk_ledger,
+                                          run_state=self.run_state, source_cache=self.source_cache,
+                                          dedup=self.dedup)
         
         if use_batch:
-            self.reference_scraper = OptimizedReferenceScraper(batch_size=500)
+            self.reference_scraper = OptimizedReferenceScraper(batch_size=REFERENCE_BATCH_SIZE, cache=self.s2_cache)
             logger.info("Using OPTIMIZED batch reference scraper (up to 500x faster!)")
         else:
-            self.reference_scraper = ReferenceScraper()
+            self.reference_scraper = ReferenceScraper(cache=self.s2_cache)
             logger.info("Using standard reference scraper")
         
         self.bibtex_generator = BibtexGenerator()
         
+        # Optional asyncio engine: metadata, source and reference requests share
+        # one connection pool and all versions of a paper download concurrently
+        self.engine = None
+        if use_async_engine:
+            from async_engine import AsyncHttpEngine  # needs aiohttp, only imported when enabled
+            self.engine = AsyncHttpEngine(self.arxiv_scraper, self.reference_scraper)
+            self.engine.start()
+        
+        # Optional producer / consumer stages: archives are extracted in worker
+        # processes and one thread commits finished papers, so a paper thread
+        # moves on to the next download while the previous paper is extracted
+        self.extract_pool = None
+        self.commit_writer = None
+        if extract_processes > 0:
+            self.extract_pool = ExtractionPool(extract_processes, EXTRACT_QUEUE_SIZE)
+            self.arxiv_scraper.extract_pool = self.extract_pool
+            self.commit_writer = CommitWriter(self.commit_paper, COMMIT_QUEUE_SIZE)
+            logger.info(f"Extracting sources in {extract_processes} worker processes")
+        
         self.stats = {
             'total_papers': 0,
             'successful_papers': 0,
@@ -68,85 +144,63 @@ class ArxivScraperPipeline:
         
         # Detailed paper tracking for CSV
         self.paper_details = []
+        self.paper_detail_index = {}  # arxiv_id -> row in paper_details
+        
+        # Deferred reference phase (batch mode): arxiv_id -> references.json path,
+        # flushed through scrape_references_batch on a size or time threshold
+        self.pending_references = {}
+        self.pending_since = None
+        self.pending_lock = threading.Lock()
+        
+        # Committed papers waiting to be packed into shards (--storage shards)
+        self.pending_pack = []
+        self.pack_lock = threading.Lock()
         
         self.process = psutil.Process()
         self.initial_ram = self.process.memory_info().rss / (1024 * 1024)
+        
+        # Background RSS / CPU / I/O time series; catches peaks inside a paper and
+        # failed papers, which the per-paper sample above never sees
+        self.sampler = None
+        if sample_interval > 0:
+            self.sampler = ResourceSampler(
+                os.path.join(output_dir, RESOURCE_SAMPLES_FILE), sample_interval,
+                tracemalloc_path=os.path.join(output_dir, TRACEMALLOC_FILE) if use_tracemalloc else None,
+                tracemalloc_interval=TRACEMALLOC_INTERVAL, tracemalloc_top=TRACEMALLOC_TOP,
+                disk_ledger=self.disk_ledger
+            )
     
     def get_completed_papers(self) -> set:
         """Get set of paper IDs that have already been scraped successfully"""
-        completed = set()
-        if not os.path.exists(self.output_dir):
-            return completed
-        
-        for item in os.listdir(self.output_dir):
-            item_path = os.path.join(self.output_dir, item)
-            if os.path.isdir(item_path):
-                # Check if paper has metadata.json and references.json (signs of completion)
-                metadata_file = os.path.join(item_path, "metadata.json")
-                references_file = os.path.join(item_path, "references.json")
-                
-                if os.path.exists(metadata_file) and os.path.exists(references_file):
-                    # Convert folder name back to arxiv_id format (e.g., "2311-14685" -> "2311.14685")
-                    arxiv_id = item.replace('-', '.')
-                    completed.add(arxiv_id)
-        
-        return completed
+        return self.run_state.get_ids([STATUS_COMMITTED])
     
     def get_attempted_papers(self) -> set:
-        """Get set of ALL paper IDs that have been attempted (have any folder)"""
-        attempted = set()
-        if not os.path.exists(self.output_dir):
-            return attempted
-        
-        for item in os.listdir(self.output_dir):
-            item_path = os.path.join(self.output_dir, item)
-            # Check if it's a directory and looks like a paper folder (format: YYMM-NNNNN)
-            if os.path.isdir(item_path) and '-' in item:
-                # Convert folder name back to arxiv_id format (e.g., "2311-14685" -> "2311.14685")
-                arxiv_id = item.replace('-', '.')
-                attempted.add(arxiv_id)
-        
-        return attempted
+        """Get set of ALL paper IDs that have been attempted (successful or failed)"""
+        return self.run_state.get_ids()
     
     def load_checkpoint_stats(self, completed_papers: set):
         """Load statistics from checkpoint to preserve previous progress
         
         Returns:
-            set: arxiv_ids of papers already in CSV (to skip during scraping)
+            set: arxiv_ids of papers already in paper details (to skip during scraping)
         """
         stats_file = os.path.join(self.output_dir, "scraping_stats.json")
-        details_csv = os.path.join(self.output_dir, "paper_details.csv")
         csv_papers = set()
         
-        # Load paper details from CSV if exists
-        if os.path.exists(details_csv):
-            try:
-                with open(details_csv, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        # Convert numeric fields
-                        row['paper_id'] = int(row['paper_id'])
-                        row['runtime_s'] = float(row['runtime_s'])
-                        row['size_before'] = int(row['size_before'])
-                        row['size_after'] = int(row['size_after'])
-                        row['size_before_figures'] = int(row['size_before_figures'])
-                        row['size_after_figures'] = int(row['size_after_figures'])
-                        row['num_refs'] = int(row['num_refs'])
-                        row['current_output_size'] = int(row['current_output_size'])
-                        row['max_rss'] = float(row['max_rss'])
-                        row['avg_rss'] = float(row['avg_rss'])
-                        self.paper_details.append(row)
-                        # Track arxiv_id to skip this paper
-                        csv_papers.add(row['arxiv_id'])
-                logger.info(f"Loaded {len(self.paper_details)} paper details from checkpoint")
-            except Exception as e:
-                logger.warning(f"Failed to load paper details from CSV: {e}")
+        # Paper details rows live in the run state store (CSV rows it lacks are
+        # merged by ensure_initialized)
+        for row in self.run_state.load_paper_details():
+            self.paper_details.append(row)
+            self.paper_detail_index[row['arxiv_id']] = row
+            csv_papers.add(row['arxiv_id'])
+        if self.paper_details:
+            logger.info(f"Loaded {len(self.paper_details)} paper details from run state")
         
         if not os.path.exists(stats_file):
             # No checkpoint file, count manually from completed papers
             logger.info("No checkpoint file found, counting from completed papers...")
             self.stats['successful_papers'] = len(completed_papers)
-            return
+            return csv_papers
         
         try:
             with open(stats_file, 'r', encoding='utf-8') as f:
@@ -175,15 +229,17 @@ class ArxivScraperPipeline:
     
     def update_memory_stats(self):
         current_ram = self.process.memory_info().rss / (1024 * 1024)
-        self.stats['ram_samples'].append(current_ram)
-        if current_ram > self.stats['max_ram_mb']:
-            self.stats['max_ram_mb'] = current_ram
+        peak_ram = max(current_ram, self.sampler.get_peak_rss_mb() if self.sampler is not None else 0.0)
+        with self.lock:
+            self.stats['ram_samples'].append(current_ram)
+            if peak_ram > self.stats['max_ram_mb']:
+                self.stats['max_ram_mb'] = peak_ram
     
     def update_disk_stats(self):
-        if os.path.exists(self.output_dir):
-            disk_usage = get_directory_size(self.output_dir) / (1024 * 1024)
-            if disk_usage > self.stats['max_disk_mb']:
-                self.stats['max_disk_mb'] = disk_usage
+        disk_peak = self.disk_ledger.get_peak_mb()
+        with self.lock:
+            if disk_peak > self.stats['max_disk_mb']:
+                self.stats['max_disk_mb'] = disk_peak
     
     def generate_paper_ids(self, start_ym: str, start_id: int, 
                           end_ym: str, end_id: int) -> list:
@@ -230,7 +286,31 @@ class ArxivScraperPipeline:
         
         return paper_ids
     
-    def scrape_single_paper(self, arxiv_id: str) -> bool:
+    def iter_papers_with_metadata(self, paper_ids: list):
+        """
+        Batched metadata stage: fetch metadata for one window of IDs at a time
+        with a few large id_list queries instead of one query per paper
+        
+        Args:
+            paper_ids: arXiv IDs to process
+        
+        Yields:
+            Tuple of (arxiv_id, metadata, metadata_fetched)
+        """
+        for i in range(0, len(paper_ids), METADATA_BATCH_SIZE):
+            window = paper_ids[i:i + METADATA_BATCH_SIZE]
+            metadata_map = self.arxiv_scraper.get_papers_metadata_batch(window)
+            logger.info(f"Metadata stage: {len(metadata_map)}/{len(window)} papers resolved "
+                        f"in window {window[0]} - {window[-1]}")
+            
+            for arxiv_id in window:
+                # IDs missing from the map had a failed request; scrape_paper retries them alone
+                fetched = arxiv_id in metadata_map
+                yield arxiv_id, metadata_map.pop(arxiv_id, None), fetched
+    
+    @timed('paper', label_arg='arxiv_id')
+    def scrape_single_paper(self, arxiv_id: str, metadata: dict = None,
+                            metadata_fetched: bool = False) -> bool:
         start_time = time.time()
         
         logger.info(f"\n{'='*60}")
@@ -239,20 +319,48 @@ class ArxivScraperPipeline:
         
         folder_name = format_folder_name(arxiv_id)
         paper_dir = os.path.join(self.output_dir, folder_name)
+        self.run_state.mark(arxiv_id, STATUS_ATTEMPTED)
         ensure_dir(paper_dir)
         
         size_before = get_directory_size(paper_dir) if os.path.exists(paper_dir) else 0
         
-        success = self.arxiv_scraper.scrape_paper(arxiv_id, paper_dir)
+        if self.commit_writer is not None:
+            sources = self.arxiv_scraper.fetch_paper(arxiv_id, paper_dir, metadata, metadata_fetched)
+            if sources is not None:
+                # Extraction continues in the pool; the writer thread commits the paper
+                self.commit_writer.put(sources, start_time, size_before)
+                return True
+            return self._paper_failed(arxiv_id)
         
+        success = self.arxiv_scraper.scrape_paper(arxiv_id, paper_dir, metadata, metadata_fetched)
         if not success:
-            logger.error(f"Failed to scrape paper {arxiv_id}")
+            return self._paper_failed(arxiv_id)
+        return self._save_paper(arxiv_id, paper_dir, start_time, size_before)
+    
+    def commit_paper(self, sources, start_time: float, size_before: int):
+        """Commit writer: wait for a paper's extractions, then save it like scrape_single_paper"""
+        arxiv_id = sources.arxiv_id
+        try:
+            with span('commit', arxiv_id):
+                if not self.arxiv_scraper.finish_paper(sources):
+                    self._paper_failed(arxiv_id)
+                    return
+                self._save_paper(arxiv_id, sources.paper_dir, start_time, size_before)
+        except Exception as e:
+            self._paper_error(arxiv_id, e)
+    
+    def _paper_failed(self, arxiv_id: str) -> bool:
+        logger.error(f"Failed to scrape paper {arxiv_id}")
+        with self.lock:
             self.stats['failed_papers'] += 1
-            return False
-        
+        return False
+    
+    def _save_paper(self, arxiv_id: str, paper_dir: str, start_time: float, size_before: int) -> bool:
+        """Sizes, references and paper details of a paper whose sources are in place"""
         size_after = get_directory_size(paper_dir)
-        self.stats['paper_sizes_before'].append(size_before)
-        self.stats['paper_sizes_after'].append(size_after)
+        with self.lock:
+            self.stats['paper_sizes_before'].append(size_before)
+            self.stats['paper_sizes_after'].append(size_after)
         
         self.update_memory_stats()
         self.update_disk_stats()
@@ -263,7 +371,9 @@ class ArxivScraperPipeline:
                 metadata = json.load(f)
         except Exception as e:
             logger.error(f"Failed to load metadata: {e}")
-            self.stats['failed_papers'] += 1
+            self.run_state.mark(arxiv_id, STATUS_FAILED, 'metadata_unreadable')
+            with self.lock:
+                self.stats['failed_papers'] += 1
             return False
         
         # NOTE: NO references.bib at paper level!
@@ -272,32 +382,149 @@ class ArxivScraperPipeline:
         
         # Scrape references from Semantic Scholar
         references_path = os.path.join(paper_dir, "references.json")
-        ref_before = self.reference_scraper.get_stats()['total_references']
-        self.reference_scraper.scrape_references(arxiv_id, references_path)
-        ref_after = self.reference_scraper.get_stats()['total_references']
-        
         num_refs = 0
-        try:
-            with open(references_path, 'r', encoding='utf-8') as f:
-                references = json.load(f)
-                num_refs = len(references)
+        if not self.use_batch:
+            with self.reference_lock, self.disk_ledger.tracking(references_path):
+                ref_before = self.reference_scraper.get_stats()['total_references']
+                self.reference_scraper.scrape_references(arxiv_id, references_path)
+                ref_after = self.reference_scraper.get_stats()['total_references']
+            
+            num_refs = self._count_references(references_path)
+            with self.lock:
                 self.stats['reference_counts'].append(num_refs)
                 self.stats['reference_success_counts'].append(ref_after - ref_before)
-        except:
-            self.stats['reference_counts'].append(0)
-            self.stats['reference_success_counts'].append(0)
+            self.run_state.mark(arxiv_id, STATUS_COMMITTED)
+            self.add_citations(arxiv_id, references_path)
+            self.pack_papers([arxiv_id])
         
         runtime = time.time() - start_time
-        self.stats['paper_runtimes'].append(runtime)
-        self.stats['successful_papers'] += 1
         
         # Get current memory usage
         current_ram = self.process.memory_info().rss / (1024 * 1024)
-        current_disk = get_directory_size(self.output_dir) / (1024 * 1024)
-        avg_ram = sum(self.stats['ram_samples']) / len(self.stats['ram_samples']) if self.stats['ram_samples'] else current_ram
+        current_disk = self.disk_ledger.get_current_mb()
+        
+        with self.lock:
+            self.stats['paper_runtimes'].append(runtime)
+            self.stats['successful_papers'] += 1
+            avg_ram = sum(self.stats['ram_samples']) / len(self.stats['ram_samples']) if self.stats['ram_samples'] else current_ram
+            
+            # Save detailed paper info
+            # paper_id follows completion order, which differs from arxiv_id order with --workers > 1
+            paper_detail = self._build_paper_detail(
+                arxiv_id, metadata, runtime, size_before, size_after, num_refs, current_disk, avg_ram
+            )
+            self.paper_details.append(paper_detail)
+            self.paper_detail_index[arxiv_id] = paper_detail
+        self.run_state.save_paper_detail(paper_detail)
+        
+        if self.use_batch:
+            # Deferred: num_refs is filled in when the batch resolves
+            self.run_state.mark(arxiv_id, STATUS_REFERENCES)
+            self.queue_references(arxiv_id, references_path)
+            self.flush_references()
+        
+        logger.info(f"Successfully processed {arxiv_id} in {runtime:.2f}s")
+        logger.info(f"Paper size: {size_after / 1024:.2f} KB")
         
-        # Save detailed paper info
-        paper_detail = {
+        return True
+    
+    def _count_references(self, references_path: str) -> int:
+        try:
+            with open(references_path, 'r', encoding='utf-8') as f:
+                return len(json.load(f))
+        except:
+            return 0
+    
+    def queue_references(self, arxiv_id: str, references_path: str):
+        """Queue a paper for the next batched Semantic Scholar request"""
+        with self.pending_lock:
+            if not self.pending_references:
+                self.pending_since = time.time()
+            self.pending_references[arxiv_id] = references_path
+    
+    def flush_references(self, force: bool = False):
+        """
+        Resolve queued references with scrape_references_batch
+        
+        Args:
+            force: Flush whatever is queued (shutdown). Otherwise only flush once
+                REFERENCE_BATCH_SIZE papers are queued or the oldest one has waited
+                REFERENCE_FLUSH_INTERVAL seconds.
+        """
+        with self.pending_lock:
+            if not self.pending_references:
+                return
+            waited = time.time() - self.pending_since
+            if (not force and len(self.pending_references) < REFERENCE_BATCH_SIZE
+                    and waited < REFERENCE_FLUSH_INTERVAL):
+                return
+            batch = self.pending_references
+            self.pending_references = {}
+            self.pending_since = None
+        
+        logger.info(f"Flushing reference queue: {len(batch)} papers (oldest queued {waited:.0f}s ago)")
+        with self.reference_lock:
+            size_before = sum(file_size(path) for path in batch.values())
+            results = self.reference_scraper.scrape_references_batch(batch)
+            self.disk_ledger.add(sum(file_size(path) for path in batch.values()) - size_before)
+        
+        # Papers whose requests failed got no references.json: queue them again
+        # instead of committing them with an empty file (on shutdown they stay in
+        # the references state and are retried by the next run)
+        failed = [arxiv_id for arxiv_id in batch if results.get(arxiv_id, False) is None]
+        if failed:
+            logger.warning(f"Semantic Scholar requests failed for {len(failed)} papers, re-queued")
+            for arxiv_id in failed:
+                self.queue_references(arxiv_id, batch.pop(arxiv_id))
+        
+        for arxiv_id, references_path in batch.items():
+            num_refs = self._count_references(references_path)
+            with self.lock:
+                self.stats['reference_counts'].append(num_refs)
+                paper_detail = self.paper_detail_index.get(arxiv_id)
+                if paper_detail is not None:
+                    paper_detail['num_refs'] = num_refs
+            if paper_detail is not None:
+                self.run_state.save_paper_detail(paper_detail)
+            self.add_citations(arxiv_id, references_path)
+        self.run_state.mark_many(batch.keys(), STATUS_COMMITTED)
+        self.pack_papers(batch.keys(), force=True)
+    
+    def add_citations(self, arxiv_id: str, references_path: str):
+        """Add a committed paper's references to the citation graph, if enabled"""
+        if self.citation_graph is None:
+            return
+        try:
+            with open(references_path, 'r', encoding='utf-8') as f:
+                references = json.load(f)
+        except Exception:
+            references = {}
+        self.citation_graph.add_paper(arxiv_id, (reference_key_to_arxiv_id(key) for key in references))
+    
+    def pack_papers(self, arxiv_ids, force: bool = False):
+        """
+        Move committed papers into shards when the shard storage backend is used
+        
+        Args:
+            arxiv_ids: Newly committed papers
+            force: Pack everything queued (batched references, shutdown). Otherwise
+                papers are only packed once SHARD_PACK_BATCH_SIZE are queued.
+        """
+        if self.shard_store is None:
+            return
+        with self.pack_lock:
+            self.pending_pack.extend(arxiv_ids)
+            if not self.pending_pack or (not force and len(self.pending_pack) < SHARD_PACK_BATCH_SIZE):
+                return
+            batch = self.pending_pack
+            self.pending_pack = []
+        self.disk_ledger.add(self.shard_store.pack_papers(batch))
+    
+    def _build_paper_detail(self, arxiv_id: str, metadata: dict, runtime: float,
+                            size_before: int, size_after: int, num_refs: int,
+                            current_disk: float, avg_ram: float) -> dict:
+        """Build one paper_details.csv row (caller must hold self.lock)"""
+        return {
             'paper_id': self.stats['successful_papers'],
             'arxiv_id': arxiv_id,
             'title': metadata.get('title', 'N/A'),
@@ -313,12 +540,6 @@ class ArxivScraperPipeline:
             'avg_rss': round(avg_ram, 2),
             'processed_at': time.strftime('%Y-%m-%d %H:%M:%S')
         }
-        self.paper_details.append(paper_detail)
-        
-        logger.info(f"Successfully processed {arxiv_id} in {runtime:.2f}s")
-        logger.info(f"Paper size: {size_after / 1024:.2f} KB")
-        
-        return True
     
     def run(self, start_ym: str = None, start_id: int = None,
             end_ym: str = None, end_id: int = None):
@@ -345,7 +566,14 @@ class ArxivScraperPipeline:
         original_total = len(paper_ids)
         self.stats['total_papers'] = original_total
         
-        # Check for papers that have been attempted (any folder exists)
+        # Output written before the run state existed is indexed once;
+        # every later resume is a few queries on the state store plus a merge
+        # of paper_details.csv rows appended by backfill_paper_details.py
+        self.run_state.ensure_initialized(
+            self.output_dir, os.path.join(self.output_dir, "paper_details.csv")
+        )
+        
+        # Check for papers that have been attempted (successful or failed)
         attempted_papers = self.get_attempted_papers()
         completed_papers = self.get_completed_papers()
         
@@ -359,6 +587,15 @@ class ArxivScraperPipeline:
         if csv_papers:
             logger.info(f"Found {len(csv_papers)} papers already tracked in CSV")
         
+        # Papers whose deferred references were never flushed (e.g. crash) are
+        # queued again instead of being re-scraped
+        if self.use_batch:
+            for arxiv_id in self.run_state.get_ids(PENDING_REFERENCE_STATUSES):
+                paper_dir = os.path.join(self.output_dir, format_folder_name(arxiv_id))
+                self.queue_references(arxiv_id, os.path.join(paper_dir, "references.json"))
+            if self.pending_references:
+                logger.info(f"Re-queued {len(self.pending_references)} papers with pending references")
+        
         # Skip ALL attempted papers (whether successful or failed)
         papers_to_skip = attempted_papers
         if papers_to_skip:
@@ -375,36 +612,128 @@ class ArxivScraperPipeline:
             logger.info(f"First paper: {paper_ids[0]}")
             logger.info(f"Last paper: {paper_ids[-1]}")
         
-        for i, arxiv_id in enumerate(paper_ids, 1):
-            logger.info(f"\n[{i}/{len(paper_ids)}] Processing {arxiv_id}")
-            
-            try:
-                self.scrape_single_paper(arxiv_id)
-            except Exception as e:
-                logger.error(f"Unexpected error processing {arxiv_id}: {e}")
-                self.stats['failed_papers'] += 1
-            
-            # Print progress và save stats mỗi 10 papers
-            if i % 10 == 0:
-                self.print_progress()
-                # Save intermediate stats để không mất dữ liệu nếu crash
-                self.save_stats(intermediate=True)
-            
-            # Save stats mỗi 50 papers (full save)
-            if i % 50 == 0:
-                logger.info(f"💾 Checkpoint: Saving full statistics at paper {i}/{len(paper_ids)}")
-                self.save_stats(intermediate=False)
+        if self.sampler is not None:
+            self.sampler.start()
+        if self.commit_writer is not None:
+            self.commit_writer.start()
+        
+        try:
+            if self.workers > 1:
+                logger.info(f"Concurrent mode: {self.workers} workers")
+                self.run_concurrent(paper_ids)
+            else:
+                papers = self.iter_papers_with_metadata(paper_ids)
+                for i, (arxiv_id, metadata, fetched) in enumerate(papers, 1):
+                    logger.info(f"\n[{i}/{len(paper_ids)}] Processing {arxiv_id}")
+                    self.process_paper(arxiv_id, metadata, fetched)
+                    self.checkpoint(i, len(paper_ids))
+        finally:
+            # Shutdown: commit the papers still in the stage queues, then
+            # resolve every reference still queued
+            if self.commit_writer is not None:
+                self.commit_writer.close()
+            if self.extract_pool is not None:
+                self.extract_pool.close()
+            self.flush_references(force=True)
+            self.pack_papers([], force=True)
+            if self.pending_references:
+                logger.warning(f"{len(self.pending_references)} papers still have no references; "
+                               f"the next run retries them")
+            if self.engine is not None:
+                self.engine.close()
+            if self.sampler is not None:
+                self.sampler.stop()
         
         self.cleanup_all_temp_files()
         
         self.stats['total_runtime'] = time.time() - pipeline_start
         if self.stats['ram_samples']:
             self.stats['avg_ram_mb'] = sum(self.stats['ram_samples']) / len(self.stats['ram_samples'])
-        self.stats['final_disk_mb'] = get_directory_size(self.output_dir) / (1024 * 1024)
+        if self.sampler is not None and self.sampler.get_stats()['samples']:
+            # The regular time series gives the better average and the true peak
+            self.stats['avg_ram_mb'] = self.sampler.get_avg_rss_mb()
+            self.update_memory_stats()
+        self.stats['final_disk_mb'] = self.disk_ledger.reconcile() / (1024 * 1024)
+        self.update_disk_stats()
         
         self.print_final_stats()
         self.save_stats()
     
+    def process_paper(self, arxiv_id: str, metadata: dict = None, metadata_fetched: bool = False):
+        """Scrape one paper, counting unexpected errors as failures"""
+        try:
+            self.scrape_single_paper(arxiv_id, metadata, metadata_fetched)
+        except Exception as e:
+            self._paper_error(arxiv_id, e)
+    
+    def _paper_error(self, arxiv_id: str, error: Exception):
+        logger.error(f"Unexpected error processing {arxiv_id}: {error}")
+        self.run_state.mark(arxiv_id, STATUS_FAILED, f"error: {type(error).__name__}")
+        with self.lock:
+            self.stats['failed_papers'] += 1
+    
+    def run_concurrent(self, paper_ids: list):
+        """
+        Process papers with a thread pool. Network waits overlap across
+        papers while the shared per-host rate limiters keep arXiv and
+        Semantic Scholar at their allowed request rates.
+        
+        Args:
+            paper_ids: arXiv IDs to process
+        """
+        papers = self.iter_papers_with_metadata(paper_ids)
+        # Only a few papers are queued ahead of the workers so that metadata
+        # windows are fetched lazily and do not pile up in memory
+        max_pending = self.workers * 2
+        pending = {}
+        done = 0
+        
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="paper") as executor:
+            for arxiv_id, metadata, fetched in papers:
+                while len(pending) >= max_pending:
+                    done = self._collect_finished(pending, done, len(paper_ids))
+                future = executor.submit(self.process_paper, arxiv_id, metadata, fetched)
+                pending[future] = arxiv_id
+            
+            while pending:
+                done = self._collect_finished(pending, done, len(paper_ids))
+    
+    def _collect_finished(self, pending: dict, done: int, total: int) -> int:
+        """Wait for at least one running paper and checkpoint every finished one"""
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            arxiv_id = pending.pop(future)
+            done += 1
+            # Checkpoints count finished papers, not positions in the ID list,
+            # because papers complete out of order
+            logger.info(f"[{done}/{total}] Finished {arxiv_id}")
+            self.checkpoint(done, total)
+        return done
+    
+    def checkpoint(self, done: int, total: int):
+        """
+        Print progress and save stats after every finished paper count
+        
+        Args:
+            done: Number of papers finished in this run
+            total: Number of papers to process in this run
+        """
+        with self.lock:
+            # Print progress và save stats mỗi 10 papers
+            if done % 10 == 0:
+                self.print_progress()
+                # Save intermediate stats để không mất dữ liệu nếu crash
+                self.save_stats(intermediate=True)
+            
+            # Cheap periodic correction of the disk ledger
+            if done % DISK_RECONCILE_INTERVAL == 0:
+                self.disk_ledger.reconcile()
+            
+            # Save stats mỗi 50 papers (full save)
+            if done % 50 == 0:
+                logger.info(f"💾 Checkpoint: Saving full statistics at paper {done}/{total}")
+                self.save_stats(intermediate=False)
+    
     def print_progress(self):
         logger.info("\n" + "="*60)
         logger.info("PROGRESS UPDATE")
@@ -483,15 +812,44 @@ class ArxivScraperPipeline:
         
         logger.info(f"\n5. Performance - Memory Footprint:")
         logger.info(f"  Maximum RAM used: {self.stats['max_ram_mb']:.2f} MB")
+        if self.sampler is not None:
+            sampler_stats = self.sampler.get_stats()
+            if sampler_stats['peak_at']:
+                logger.info(f"  Peak RSS sample: {sampler_stats['peak_rss_mb']:.2f} MB at {sampler_stats['peak_at']} "
+                           f"(stages: {', '.join(sampler_stats['peak_stages']) or '-'}; "
+                           f"papers: {', '.join(sampler_stats['peak_papers']) or '-'})")
         logger.info(f"  Average RAM consumption: {self.stats['avg_ram_mb']:.2f} MB")
         logger.info(f"  Maximum disk storage required: {self.stats['max_disk_mb']:.2f} MB")
         logger.info(f"  Final output storage size: {self.stats['final_disk_mb']:.2f} MB")
+        if self.dedup is not None:
+            dedup_stats = self.dedup.get_stats()
+            logger.info(f"  Deduplicated files: {dedup_stats['files_deduplicated']}/{dedup_stats['files_checked']} "
+                       f"({dedup_stats['bytes_saved_mb']:.2f} MB saved, ratio {dedup_stats['dedup_ratio']:.2f})")
         
         arxiv_stats = self.arxiv_scraper.get_stats()
         logger.info(f"\n6. Additional ArXiv Statistics:")
         logger.info(f"  Total versions downloaded: {arxiv_stats['versions_downloaded']}")
         logger.info(f"  Total download time: {arxiv_stats['total_download_time']:.2f}s")
         
+        stage_stats = get_stage_stats()
+        if stage_stats['stages']:
+            logger.info("\n7. Stage Timings (work p50 / p95 / p99, total sleep):")
+            for stage, timing in stage_stats['stages'].items():
+                work = timing['work_s']
+                logger.info(f"  {stage}: {timing['count']} x, {work['p50']:.3f} / {work['p95']:.3f} / {work['p99']:.3f}s, "
+                            f"slept {timing['sleep_total_s']:.1f}s of {timing['wall_total_s']:.1f}s")
+        
+        if self.extract_pool is not None:
+            pool_stats = self.extract_pool.get_stats()
+            writer_stats = self.commit_writer.get_stats()
+            logger.info("\n8. Pipeline Stages (utilization, avg / max queue depth):")
+            logger.info(f"  Extraction ({pool_stats['processes']} processes): {pool_stats['utilization']:.0%}, "
+                        f"{pool_stats['queue']['avg_depth']:.1f} / {pool_stats['queue']['max_depth']} archives, "
+                        f"downloads blocked {pool_stats['blocked']} x ({pool_stats['blocked_s']:.1f}s)")
+            logger.info(f"  Commit writer: {writer_stats['utilization']:.0%}, "
+                        f"{writer_stats['queue']['avg_depth']:.1f} / {writer_stats['queue']['max_depth']} papers, "
+                        f"paper threads blocked {writer_stats['blocked']} x ({writer_stats['blocked_s']:.1f}s)")
+        
         logger.info("\n" + "="*80)
     
     def save_stats(self, intermediate=False):
@@ -533,11 +891,26 @@ class ArxivScraperPipeline:
                 'final_output_storage_mb': round(self.stats['final_disk_mb'], 2)
             },
             'arxiv_statistics': self.arxiv_scraper.get_stats(),
-            'reference_statistics': self.reference_scraper.get_stats()
+            'reference_statistics': self.reference_scraper.get_stats(),
+            'rate_limiter_statistics': get_limiter_stats(),
+            'resource_sampler_statistics': self.sampler.get_stats() if self.sampler is not None else None,
+            'stage_timings': get_stage_stats(),
+            'disk_ledger_statistics': self.disk_ledger.get_stats(),
+            'run_state_statistics': self.run_state.get_stats(),
+            'async_engine_statistics': self.engine.get_stats() if self.engine is not None else None,
+            'extract_pool_statistics': self.extract_pool.get_stats() if self.extract_pool is not None else None,
+            'commit_writer_statistics': self.commit_writer.get_stats() if self.commit_writer is not None else None,
+            'source_cache_statistics': self.source_cache.get_stats() if self.source_cache is not None else None,
+            's2_cache_statistics': self.s2_cache.get_stats() if self.s2_cache is not None else None,
+            'dedup_statistics': self.dedup.get_stats() if self.dedup is not None else None,
+            'shard_statistics': self.shard_store.get_stats() if self.shard_store is not None else None,
+            'citation_graph_statistics': self.citation_graph.get_stats() if self.citation_graph is not None else None,
+            'workers': self.workers
         }
         
-        with open(stats_file, 'w', encoding='utf-8') as f:
-            json.dump(all_stats, f, indent=2)
+        with self.disk_ledger.tracking(stats_file):
+            with open(stats_file, 'w', encoding='utf-8') as f:
+                json.dump(all_stats, f, indent=2)
         
         if not intermediate:
             logger.info(f"\nStatistics saved to: {stats_file}")
@@ -546,6 +919,8 @@ class ArxivScraperPipeline:
         if not intermediate:
             self.save_stats_csv()
             self.save_paper_details_csv()
+            if self.citation_graph is not None:
+                self.citation_graph.save(self.citation_graph_path)
     
     def save_stats_csv(self):
         """Save statistics in CSV format for easy import into reports"""
@@ -597,9 +972,10 @@ class ArxivScraperPipeline:
             ['Performance - Memory Footprint', 'Final Output Storage Size', f"{self.stats['final_disk_mb']/1024:.2f}", 'GB'],
         ]
         
-        with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerows(rows)
+        with self.disk_ledger.tracking(csv_file):
+            with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerows(rows)
         
         logger.info(f"CSV statistics saved to: {csv_file}")
     
@@ -611,14 +987,15 @@ class ArxivScraperPipeline:
             logger.warning("No paper details to save")
             return
         
-        with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-            fieldnames = ['paper_id', 'arxiv_id', 'title', 'authors', 'runtime_s', 
-                         'size_before', 'size_after', 'size_before_figures', 'size_after_figures',
-                         'num_refs', 'current_output_size', 'max_rss', 'avg_rss', 'processed_at']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            
-            writer.writeheader()
-            writer.writerows(self.paper_details)
+        with self.disk_ledger.tracking(csv_file):
+            with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+                fieldnames = ['paper_id', 'arxiv_id', 'title', 'authors', 'runtime_s', 
+                             'size_before', 'size_after', 'size_before_figures', 'size_after_figures',
+                             'num_refs', 'current_output_size', 'max_rss', 'avg_rss', 'processed_at']
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                
+                writer.writeheader()
+                writer.writerows(self.paper_details)
         
         logger.info(f"Paper details CSV saved to: {csv_file} ({len(self.paper_details)} papers)")
 
@@ -631,6 +1008,21 @@ def main():
     parser.add_argument('--end-id', type=int, help='End paper ID')
     parser.add_argument('--output', type=str, default=DATA_DIR, help='Output directory')
     parser.add_argument('--no-batch', action='store_true', help='Disable batch API optimization')
+    parser.add_argument('--workers', type=int, default=1, help='Number of papers processed concurrently')
+    parser.add_argument('--async-engine', action='store_true', help='Send HTTP requests through the asyncio engine (needs aiohttp)')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Directory of the source tarball cache (disabled if not set)')
+    parser.add_argument('--cache-size-mb', type=float, default=SOURCE_CACHE_MAX_MB, help='Size cap of the source cache in MB')
+    parser.add_argument('--storage', choices=['tree', 'shards'], default='tree', help='Output layout: one folder per paper, or per-month zip shards')
+    parser.add_argument('--citation-graph', type=str, nargs='?', const=CITATION_GRAPH_PATH, default=None,
+                        help=f'Maintain the citation graph index while scraping (default file: {CITATION_GRAPH_PATH})')
+    parser.add_argument('--s2-cache', type=str, default=S2_CACHE_PATH, help='SQLite file caching Semantic Scholar responses across runs')
+    parser.add_argument('--no-s2-cache', action='store_true', help='Always query Semantic Scholar')
+    parser.add_argument('--no-dedup', action='store_true', help='Keep duplicate paper.tex / references.bib files instead of hardlinking them')
+    parser.add_argument('--sample-interval', type=float, default=RESOURCE_SAMPLE_INTERVAL,
+                        help=f'Seconds between background RSS/CPU/IO samples written to {RESOURCE_SAMPLES_FILE} (0 disables)')
+    parser.add_argument('--tracemalloc', action='store_true', help=f'Also write top allocation sites to {TRACEMALLOC_FILE} (slower)')
+    parser.add_argument('--extract-processes', type=int, default=0,
+                        help='Extract and clean sources in this many worker processes, committing papers on a separate thread (0: in the paper thread)')
     
     args = parser.parse_args()
     
@@ -638,7 +1030,13 @@ def main():
     
     use_batch = not args.no_batch
     
-    pipeline = ArxivScraperPipeline(args.output, use_batch=use_batch)
+    pipeline = ArxivScraperPipeline(args.output, use_batch=use_batch, workers=args.workers,
+                                    use_async_engine=args.async_engine, cache_dir=args.cache_dir,
+                                    cache_size_mb=args.cache_size_mb, use_dedup=not args.no_dedup,
+                                    storage=args.storage, citation_graph_path=args.citation_graph,
+                                    s2_cache_path=None if args.no_s2_cache else args.s2_cache,
+                                    sample_interval=args.sample_interval, use_tracemalloc=args.tracemalloc,
+                                    extract_processes=args.extract_processes)
     pipeline.run(
         start_ym=args.start_ym,
         start_id=args.start_id,
@@ -0,0 +1,440 @@
+"""
+Local stand-in for the arXiv and Semantic Scholar APIs, serving a synthetic corpus
+
+    GET  /api/query?id_list=...          arXiv Atom feed (unversioned or versioned IDs)
+    GET  /e-print/<id>v<n>               gzipped tar source of one version
+    GET  /src/<id>v<n>                   always 404 (alternative source URL)
+    POST /graph/v1/paper/batch           Semantic Scholar references, one item per ID
+    GET  /graph/v1/paper/arXiv:<id>      Semantic Scholar references of one paper
+    GET  /stats                          request counters of the stand-in (JSON)
+
+Every response can be delayed by a fixed latency, and Semantic Scholar requests
+can be answered with 429 (optionally with a Retry-After header) at a given rate.
+The corpus is generated from a seed, so two runs with the same settings serve
+byte-identical responses.
+
+Usage: python mock_servers.py [--port 8000] [--month 2311] [--papers 200]
+                              [--latency 0.05] [--throttle-rate 0.1] [--retry-after 1]
+"""
+
+import io
+import gzip
+import json
+import time
+import random
+import tarfile
+import argparse
+import threading
+import multiprocessing
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.sax.saxutils import escape
+from typing import Dict, List, Optional, Tuple
+
+from utils import format_arxiv_id
+
+WORDS = ("model data learning network results method training graph language performance "
+         "analysis approach dataset optimization representation inference attention sparse "
+         "robust efficient benchmark evaluation structure signal").split()
+
+# Semantic Scholar rejects larger /paper/batch requests with a 400
+S2_MAX_BATCH_IDS = 500
+
+
+class SyntheticCorpus:
+    """
+    Deterministic fake papers for one arXiv month (IDs <month>.00001 to <month>.<num_papers>)
+
+    Each paper gets a number of versions, a source tarball per version (main.tex
+    with figure environments, a .bib file and incompressible figure files) and a
+    reference list mixing papers of the corpus with outside arXiv and non-arXiv
+    papers. A fraction of the IDs does not exist, has no source, or is unknown to
+    Semantic Scholar, like the real services.
+    """
+
+    def __init__(self, year_month: str = "2311", num_papers: int = 200, seed: int = 0,
+                 missing_rate: float = 0.02, no_source_rate: float = 0.02,
+                 not_in_s2_rate: float = 0.05, max_versions: int = 3, max_references: int = 40,
+                 tex_kb: int = 40, figures: int = 3, figure_kb: int = 30):
+        """
+        Args:
+            year_month: arXiv month of the IDs (e.g., "2311")
+            num_papers: Number of IDs in the month
+            seed: Seed of the generator
+            missing_rate: Fraction of IDs that do not exist
+            no_source_rate: Fraction of papers without a source tarball (PDF only)
+            not_in_s2_rate: Fraction of papers Semantic Scholar does not know
+            max_versions: Highest number of versions of a paper
+            max_references: Highest number of references of a paper
+            tex_kb: Approximate size of main.tex in KB
+            figures: Figure files per tarball
+            figure_kb: Size of each figure file in KB
+        """
+        self.year_month = year_month
+        self.seed = seed
+        self.tex_kb = tex_kb
+        self.figures = figures
+        self.figure_kb = figure_kb
+        self.papers: Dict[str, Dict] = {}
+
+        all_ids = [format_arxiv_id(year_month, i) for i in range(1, num_papers + 1)]
+        for arxiv_id in all_ids:
+            rng = random.Random(f"{seed}:{arxiv_id}")
+            if rng.random() < missing_rate:
+                continue
+            num_refs = rng.randint(0, max_references)
+            references = []
+            for _ in range(num_refs):
+                kind = rng.random()
+                if kind < 0.5:
+                    references.append(rng.choice(all_ids))          # Inside the corpus
+                elif kind < 0.8:
+                    references.append(f"{rng.randint(1501, 2310)}.{rng.randint(1, 20000):05d}")
+                else:
+                    references.append(None)                         # No arXiv ID
+            self.papers[arxiv_id] = {
+                'versions': rng.randint(1, max_versions),
+                'day': rng.randint(1, 28),
+                'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 10))).capitalize(),
+                'authors': [f"Author {rng.randint(1, 5000)}" for _ in range(rng.randint(1, 6))],
+                'has_source': rng.random() >= no_source_rate,
+                'in_s2': rng.random() >= not_in_s2_rate,
+                'references': references
+            }
+
+    def version_date(self, arxiv_id: str, version: int) -> str:
+        paper = self.papers[arxiv_id]
+        year, month = 2000 + int(self.year_month[:2]), int(self.year_month[2:])
+        day = min(28, paper['day'] + 3 * (version - 1))
+        return f"{year}-{month:02d}-{day:02d}T{version:02d}:00:00Z"
+
+    def atom_entry(self, arxiv_id: str, version: int) -> str:
+        """Atom <entry> of one version, as in an export.arxiv.org/api/query feed"""
+        paper = self.papers[arxiv_id]
+        authors = ''.join(f"<author><name>{escape(name)}</name></author>" for name in paper['authors'])
+        return (
+            f"<entry><id>http://arxiv.org/abs/{arxiv_id}v{version}</id>"
+            f"<updated>{self.version_date(arxiv_id, version)}</updated>"
+            f"<published>{self.version_date(arxiv_id, 1)}</published>"
+            f"<title>{escape(paper['title'])}</title>"
+            f"<summary>Synthetic abstract of {arxiv_id}. {escape(paper['title'])}.</summary>"
+            f"{authors}"
+            f"<arxiv:comment>{paper['versions']} versions, 10 pages</arxiv:comment>"
+            f'<link title="pdf" href="http://arxiv.org/pdf/{arxiv_id}v{version}" rel="related"/>'
+            f'<arxiv:primary_category term="cs.LG"/>'
+            f'<category term="cs.LG"/><category term="stat.ML"/>'
+            f"</entry>"
+        )
+
+    def atom_feed(self, id_list: List[str]) -> bytes:
+        """Feed for an id_list query; unknown IDs and versions are left out"""
+        entries = []
+        for requested in id_list:
+            base_id, sep, version = requested.rpartition('v')
+            if not sep or not version.isdigit():
+                base_id, version = requested, None
+            paper = self.papers.get(base_id)
+            if paper is None:
+                continue
+            version = int(version) if version else paper['versions']
+            if 1 <= version <= paper['versions']:
+                entries.append(self.atom_entry(base_id, version))
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:arxiv="http://arxiv.org/schemas/atom">'
+            f"<title>ArXiv Query</title>{''.join(entries)}</feed>"
+        ).encode('utf-8')
+
+    def has_source(self, arxiv_id: str, version: int) -> bool:
+        paper = self.papers.get(arxiv_id)
+        return paper is not None and paper['has_source'] and 1 <= version <= paper['versions']
+
+    def source_tarball(self, arxiv_id: str, version: int) -> bytes:
+        """Gzipped tar of one version (main.tex, refs.bib, figure files)"""
+        rng = random.Random(f"{self.seed}:{arxiv_id}v{version}")
+        section = []
+        size = 0
+        while size < self.tex_kb * 1024:
+            paragraph = ' '.join(rng.choice(WORDS) for _ in range(120))
+            section.append(f"\\section{{{rng.choice(WORDS).capitalize()}}}\n{paragraph}\n")
+            section.append("\\begin{figure}[t]\n\\centering\n"
+                           f"\\includegraphics[width=\\linewidth]{{figures/fig{rng.randint(1, self.figures or 1)}.png}}\n"
+                           "\\caption{Synthetic figure}\n\\end{figure}\n")
+            size += len(section[-2]) + len(section[-1])
+        tex = ("\\documentclass{article}\n\\begin{document}\n"
+               + ''.join(section) + "\\bibliography{refs}\n\\end{document}\n").encode('utf-8')
+        bib = ''.join(f"@article{{ref{i},\n  title={{{' '.join(rng.choice(WORDS) for _ in range(6))}}},\n"
+                      f"  year={{{rng.randint(2000, 2023)}}}\n}}\n"
+                      for i in range(len(self.papers[arxiv_id]['references']))).encode('utf-8')
+
+        files = [("main.tex", tex), ("refs.bib", bib)]
+        files += [(f"figures/fig{i}.png", rng.randbytes(self.figure_kb * 1024))
+                  for i in range(1, self.figures + 1)]
+
+        buffer = io.BytesIO()
+        # Fixed gzip mtime so the same version is always the same bytes
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode='w') as tar:
+                for name, data in files:
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    info.mtime = 1700000000
+                    tar.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def s2_paper(self, arxiv_id: str) -> Optional[Dict]:
+        """Semantic Scholar paper object with references, or None if S2 does not know the paper"""
+        paper = self.papers.get(arxiv_id)
+        if paper is None or not paper['in_s2']:
+            return None
+        references = []
+        for i, ref_id in enumerate(paper['references']):
+            ref_rng = random.Random(f"{self.seed}:{arxiv_id}:ref{i}")
+            references.append({
+                'paperId': f"{ref_rng.getrandbits(160):040x}",
+                'externalIds': {'ArXiv': ref_id} if ref_id else {'DOI': f"10.1000/{ref_rng.randint(1, 10**6)}"},
+                'title': ' '.join(ref_rng.choice(WORDS) for _ in range(6)).capitalize(),
+                'authors': [{'authorId': str(ref_rng.randint(1, 10**7)), 'name': f"Author {ref_rng.randint(1, 5000)}"}
+                            for _ in range(ref_rng.randint(1, 4))],
+                'publicationDate': f"{ref_rng.randint(2015, 2023)}-{ref_rng.randint(1, 12):02d}-01",
+                'year': ref_rng.randint(2015, 2023)
+            })
+        return {'paperId': f"{random.Random(f'{self.seed}:{arxiv_id}').getrandbits(160):040x}",
+                'references': references}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes requests to the StandInServer attached to the HTTP server"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real services
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'', content_type: str = 'application/json',
+              headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stand_in.count('bytes_sent', len(body))
+
+    def _throttled(self) -> bool:
+        """Answer with 429 (and Retry-After if configured) when the stand-in injects one"""
+        stand_in = self.server.stand_in
+        if not stand_in.throttle():
+            return False
+        headers = {'Retry-After': f"{stand_in.retry_after:g}"} if stand_in.retry_after is not None else None
+        self._send(429, b'{"message": "Too Many Requests"}', headers=headers)
+        return True
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        if path == '/stats':
+            self._send(200, json.dumps(stand_in.get_stats()).encode('utf-8'))
+            return
+
+        stand_in.delay()
+        if path == '/api/query':
+            stand_in.count('arxiv_queries')
+            id_list = parse_qs(url.query).get('id_list', [''])[0]
+            ids = [arxiv_id for arxiv_id in id_list.split(',') if arxiv_id]
+            self._send(200, stand_in.corpus.atom_feed(ids), 'application/atom+xml')
+        elif path.startswith('/e-print/'):
+            stand_in.count('eprint_requests')
+            body = stand_in.tarball(path[len('/e-print/'):])
+            if body is None:
+                self._send(404, b'<html><body>No source available</body></html>', 'text/html')
+            else:
+                self._send(200, body, 'application/x-eprint-tar')
+        elif path.startswith('/src/'):
+            stand_in.count('src_requests')
+            self._send(404, b'<html><body>Not found</body></html>', 'text/html')
+        elif path.startswith('/graph/v1/paper/arXiv:'):
+            stand_in.count('s2_requests')
+            if self._throttled():
+                return
+            paper = stand_in.corpus.s2_paper(path[len('/graph/v1/paper/arXiv:'):])
+            if paper is None:
+                self._send(404, b'{"error": "Paper not found"}')
+            else:
+                self._send(200, json.dumps(paper).encode('utf-8'))
+        else:
+            self._send(404, b'{"error": "Unknown path"}')
+
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        # Read the body first so the connection can be reused whatever the answer
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = self.rfile.read(length)
+
+        stand_in.delay()
+        if urlparse(self.path).path != '/graph/v1/paper/batch':
+            self._send(404, b'{"error": "Unknown path"}')
+            return
+
+        stand_in.count('s2_batch_requests')
+        if self._throttled():
+            return
+        try:
+            ids = json.loads(payload)['ids']
+        except (ValueError, KeyError, TypeError):
+            self._send(400, b'{"error": "Invalid body"}')
+            return
+        if len(ids) > S2_MAX_BATCH_IDS:
+            self._send(400, json.dumps({'error': f"Batch size {len(ids)} exceeds {S2_MAX_BATCH_IDS} ids"}).encode('utf-8'))
+            return
+
+        stand_in.count('s2_batch_ids', len(ids))
+        results = [stand_in.corpus.s2_paper(paper_id.split(':', 1)[-1]) for paper_id in ids]
+        self._send(200, json.dumps(results).encode('utf-8'))
+
+
+class StandInServer:
+    """Threaded HTTP server answering for arXiv and Semantic Scholar on one port"""
+
+    def __init__(self, corpus: SyntheticCorpus, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: Optional[float] = None, seed: int = 0):
+        """
+        Args:
+            corpus: Papers to serve
+            host: Interface to listen on
+            port: Port (0 picks a free one)
+            latency: Seconds every response is delayed by
+            throttle_rate: Fraction of Semantic Scholar requests answered with 429
+            retry_after: Retry-After seconds sent with each 429 (no header if None)
+            seed: Seed of the 429 injection
+        """
+        self.corpus = corpus
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {
+            'arxiv_queries': 0,
+            'eprint_requests': 0,
+            'src_requests': 0,
+            's2_requests': 0,
+            's2_batch_requests': 0,
+            's2_batch_ids': 0,
+            'throttled': 0,
+            'bytes_sent': 0
+        }
+        self.tarball = lru_cache(maxsize=512)(self._tarball)
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.stand_in = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _tarball(self, versioned_id: str) -> Optional[bytes]:
+        arxiv_id, sep, version = versioned_id.rpartition('v')
+        if not sep or not version.isdigit() or not self.corpus.has_source(arxiv_id, int(version)):
+            return None
+        return self.corpus.source_tarball(arxiv_id, int(version))
+
+    def count(self, key: str, value: int = 1):
+        with self.lock:
+            self.stats[key] += value
+
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def throttle(self) -> bool:
+        """True for the fraction throttle_rate of calls"""
+        with self.lock:
+            throttled = self.throttle_rate > 0 and self.rng.random() < self.throttle_rate
+            if throttled:
+                self.stats['throttled'] += 1
+        return throttled
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return self.stats.copy()
+
+    def start(self) -> 'StandInServer':
+        """Serve from a background thread"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _serve(conn, corpus_options: Dict, server_options: Dict):
+    """Child process body of serve_in_process"""
+    server = StandInServer(SyntheticCorpus(**corpus_options), **server_options)
+    conn.send(server.url)
+    conn.close()
+    server.httpd.serve_forever()
+
+
+def serve_in_process(corpus_options: Optional[Dict] = None,
+                     server_options: Optional[Dict] = None) -> Tuple[multiprocessing.Process, str]:
+    """
+    Run a stand-in in a child process, so that its CPU time and memory do not
+    count against the process being measured
+
+    Args:
+        corpus_options: Keyword arguments of SyntheticCorpus
+        server_options: Keyword arguments of StandInServer
+
+    Returns:
+        Tuple of (process, base URL); terminate() the process when done
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(child_conn, corpus_options or {}, server_options or {}),
+                                      daemon=True)
+    process.start()
+    if not parent_conn.poll(60):
+        process.terminate()
+        raise RuntimeError("Stand-in server did not start")
+    return process, parent_conn.recv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local arXiv / Semantic Scholar stand-in')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--month', type=str, default='2311', help='arXiv month of the synthetic IDs')
+    parser.add_argument('--papers', type=int, default=200, help='Number of IDs in the month')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus and of the 429 injection')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every response is delayed by')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of Semantic Scholar requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After seconds sent with each 429')
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(args.month, args.papers, seed=args.seed)
+    server = StandInServer(corpus, args.host, args.port, latency=args.latency, throttle_rate=args.throttle_rate,
+                           retry_after=args.retry_after, seed=args.seed)
+    print(f"Serving {len(corpus.papers)} synthetic papers on {server.url}")
+    print(f"  arXiv API:        {server.url}/api/query")
+    print(f"  arXiv e-print:    {server.url}/e-print")
+    print(f"  Semantic Scholar: {server.url}/graph/v1")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"Requests served: {server.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Thread-safe token-bucket rate limiters, one per remote host
+"""
+
+import time
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config import (
+    ARXIV_API_DELAY, SEMANTIC_SCHOLAR_DELAY,
+    S2_MIN_RATE, S2_MAX_RATE, S2_RATE_INCREASE, S2_RATE_DECREASE,
+    S2_RATE_LIMIT_BACKOFF, S2_RATE_LIMIT_MAX_PAUSE
+)
+from instrumentation import timed_sleep, timed_async_sleep
+
+logger = logging.getLogger(__name__)
+
+
+ARXIV_HOST = "arxiv"
+SEMANTIC_SCHOLAR_HOST = "semantic_scholar"
+
+# Minimum spacing between two requests to the same host
+HOST_DELAYS = {
+    ARXIV_HOST: ARXIV_API_DELAY,
+    SEMANTIC_SCHOLAR_HOST: SEMANTIC_SCHOLAR_DELAY,
+}
+
+
+class TokenBucket:
+    """Token bucket shared by every thread talking to one host"""
+
+    def __init__(self, rate: float, capacity: float = 1.0, name: str = 'default'):
+        """
+        Initialize token bucket
+
+        Args:
+            rate: Tokens added per second (allowed requests per second)
+            capacity: Maximum burst size
+            name: Host key, used to report waits as sleep time "rate_limit.<name>"
+        """
+        self.rate = rate
+        self.name = name
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+        self.first_request = None
+        self.last_request = None
+        self.stats = {
+            'acquired': 0,
+            'total_wait_time': 0.0
+        }
+
+    def _refill(self, now: float):
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.last_refill = now
+
+    def _reserve(self) -> float:
+        """Take a token and return how long the caller must wait for it"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Reserve the token now, even if it has not been produced yet.
+            # Callers are served in arrival order and never busy-wait.
+            # last_refill lies in the future while the bucket is paused.
+            self.tokens -= 1
+            wait_time = max(0.0, self.last_refill - now)
+            if self.tokens < 0:
+                wait_time += -self.tokens / self.rate
+            self.stats['acquired'] += 1
+            self.stats['total_wait_time'] += wait_time
+            if self.first_request is None:
+                self.first_request = now + wait_time
+            self.last_request = now + wait_time
+        return wait_time
+
+    def acquire(self) -> float:
+        """
+        Block until a token is available and take it
+
+        Returns:
+            Seconds spent waiting
+        """
+        wait_time = self._reserve()
+        if wait_time > 0:
+            timed_sleep(wait_time, f"rate_limit.{self.name}")
+        return wait_time
+
+    async def acquire_async(self) -> float:
+        """
+        Awaitable acquire for the asyncio engine; shares the bucket (and so
+        the rate limit) with threads using acquire()
+
+        Returns:
+            Seconds spent waiting
+        """
+        wait_time = self._reserve()
+        if wait_time > 0:
+            await timed_async_sleep(wait_time, f"rate_limit.{self.name}")
+        return wait_time
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+            span = (self.last_request - self.first_request) if self.first_request is not None else 0.0
+            # Requests actually sent per second, from the first to the last one
+            stats['effective_rps'] = round((stats['acquired'] - 1) / span, 3) if span > 0 else None
+            return stats
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Token bucket whose rate follows the server (AIMD).
+
+    Every successful response adds `increase` requests per second, up to
+    max_rate; every 429 multiplies the rate by `decrease` (down to min_rate) and
+    pauses the bucket, so all threads and coroutines sharing it back off
+    together instead of each sleeping on its own. 429s that arrive while the
+    bucket is already paused belong to the same burst and only lower the rate once.
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float,
+                 increase: float, decrease: float, capacity: float = 1.0, name: str = 'default'):
+        """
+        Initialize adaptive token bucket
+
+        Args:
+            rate: Initial requests per second
+            min_rate: Lower bound of the rate
+            max_rate: Upper bound of the rate
+            increase: Requests per second added per successful response
+            decrease: Factor applied to the rate on a 429 (0 < decrease < 1)
+            capacity: Maximum burst size
+            name: Host key (see TokenBucket)
+        """
+        super().__init__(rate, capacity, name)
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.consecutive_throttles = 0
+        self.stats.update({
+            'successes': 0,
+            'throttles': 0,
+            'rate_decreases': 0,
+            'pause_time': 0.0,
+            'min_rate_reached': rate,
+            'max_rate_reached': rate
+        })
+
+    def on_success(self):
+        """Additive increase after a response that was not rate limited"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self.consecutive_throttles = 0
+            self.stats['successes'] += 1
+            self.stats['max_rate_reached'] = max(self.stats['max_rate_reached'], self.rate)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> float:
+        """
+        Multiplicative decrease after a 429, and pause the bucket
+
+        Args:
+            retry_after: Seconds requested by the server (parse_retry_after), if any
+
+        Returns:
+            Seconds until the bucket hands out tokens again
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.stats['throttles'] += 1
+            if self.last_refill > now:
+                # Same burst: the bucket is already paused
+                if retry_after is not None and now + retry_after > self.last_refill:
+                    self.stats['pause_time'] += now + retry_after - self.last_refill
+                    self.last_refill = now + retry_after
+                return self.last_refill - now
+
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.stats['rate_decreases'] += 1
+            self.stats['min_rate_reached'] = min(self.stats['min_rate_reached'], self.rate)
+
+            if retry_after is None:
+                retry_after = min(S2_RATE_LIMIT_MAX_PAUSE,
+                                  S2_RATE_LIMIT_BACKOFF * 2 ** self.consecutive_throttles)
+            self.consecutive_throttles += 1
+            # Drop saved-up tokens and produce none until the pause ends
+            self.tokens = min(self.tokens, 0.0)
+            self.last_refill = now + retry_after
+            self.stats['pause_time'] += retry_after
+        logger.info(f"Rate limited: pausing for {retry_after:.1f}s, rate lowered to {self.rate:.3f} req/s")
+        return retry_after
+
+    def get_stats(self) -> Dict:
+        stats = super().get_stats()
+        with self.lock:
+            stats['current_rate'] = round(self.rate, 3)
+        stats['min_rate_reached'] = round(stats['min_rate_reached'], 3)
+        stats['max_rate_reached'] = round(stats['max_rate_reached'], 3)
+        return stats
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header, which is either delay-seconds or an HTTP-date
+
+    Args:
+        value: Header value (e.g. "120" or "Wed, 21 Oct 2015 07:28:00 GMT")
+
+    Returns:
+        Seconds to wait (0 for dates in the past), or None if missing or unparsable
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring unparsable Retry-After header: {value!r}")
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(host: str) -> TokenBucket:
+    """
+    Get the process-wide limiter for a host, creating it on first use
+
+    Args:
+        host: Host key (ARXIV_HOST or SEMANTIC_SCHOLAR_HOST)
+
+    Returns:
+        TokenBucket shared by all callers for this host
+    """
+    with _limiters_lock:
+        if host not in _limiters:
+            delay = HOST_DELAYS[host]
+            if host == SEMANTIC_SCHOLAR_HOST:
+                # Semantic Scholar limits vary with load: pace adaptively from the configured delay
+                _limiters[host] = AdaptiveTokenBucket(rate=1.0 / delay, min_rate=S2_MIN_RATE, max_rate=S2_MAX_RATE,
+                                                      increase=S2_RATE_INCREASE, decrease=S2_RATE_DECREASE,
+                                                      name=host)
+            else:
+                _limiters[host] = TokenBucket(rate=1.0 / delay, capacity=1.0, name=host)
+            logger.debug(f"Created rate limiter for {host}: 1 request / {delay}s")
+        return _limiters[host]
+
+
+def set_host_delay(host: str, delay: float):
+    """
+    Change the request spacing of a host (e.g. for a local stand-in server)
+
+    The limiter is created again on next use, so call this before the scrapers
+    are constructed: they keep a reference to the limiter they got.
+    """
+    with _limiters_lock:
+        HOST_DELAYS[host] = delay
+        _limiters.pop(host, None)
+
+
+def get_limiter_stats() -> Dict[str, Dict]:
+    """Get wait statistics for every limiter created so far"""
+    with _limiters_lock:
+        return {host: limiter.get_stats() for host, limiter in _limiters.items()}
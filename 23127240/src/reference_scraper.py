@@ -2,8 +2,6 @@
 Reference scraper using Semantic Scholar API
 """
 
-import time
-import json
 import logging
 import requests
 from typing import Dict, List, Optional
@@ -12,10 +10,12 @@ from datetime import datetime
 from config import (
     SEMANTIC_SCHOLAR_API_BASE,
     SEMANTIC_SCHOLAR_FIELDS,
-    SEMANTIC_SCHOLAR_DELAY,
     MAX_RETRIES,
     RETRY_DELAY
 )
+from rate_limiter import get_rate_limiter, parse_retry_after, SEMANTIC_SCHOLAR_HOST
+from utils import atomic_write_json
+from instrumentation import timed, timed_sleep
 
 logger = logging.getLogger(__name__)
 
@@ -23,19 +23,44 @@ logger = logging.getLogger(__name__)
 class ReferenceScraper:
     """Scraper for paper references using Semantic Scholar API"""
     
-    def __init__(self):
-        """Initialize reference scraper"""
+    def __init__(self, cache=None):
+        """
+        Initialize reference scraper
+        
+        Args:
+            cache: Optional S2ResponseCache consulted before the API
+        """
         self.api_base = SEMANTIC_SCHOLAR_API_BASE
         self.session = requests.Session()
+        self.limiter = get_rate_limiter(SEMANTIC_SCHOLAR_HOST)
+        self.cache = cache
         self.stats = {
             'papers_queried': 0,
             'papers_found': 0,
             'papers_not_found': 0,
             'total_references': 0,
             'references_with_arxiv_id': 0,
-            'api_errors': 0
+            'api_errors': 0,
+            'cache_hits': 0,
+            'cache_misses': 0
         }
     
+    def _cached_references(self, arxiv_id: str):
+        """(True, references or None) for a fresh cache entry, (False, None) otherwise"""
+        if self.cache is None:
+            return False, None
+        cached = self.cache.get_many([arxiv_id], SEMANTIC_SCHOLAR_FIELDS)
+        if arxiv_id not in cached:
+            self.stats['cache_misses'] += 1
+            return False, None
+        self.stats['cache_hits'] += 1
+        return True, cached[arxiv_id]
+    
+    def _cache_store(self, arxiv_id: str, references: Optional[List[Dict]]):
+        if self.cache is not None:
+            self.cache.put_many({arxiv_id: references}, SEMANTIC_SCHOLAR_FIELDS)
+    
+    @timed('references')
     def get_paper_references(self, arxiv_id: str) -> Optional[List[Dict]]:
         """
         Get references for a paper from Semantic Scholar
@@ -48,6 +73,17 @@ class ReferenceScraper:
         """
         self.stats['papers_queried'] += 1
         
+        found, references = self._cached_references(arxiv_id)
+        if found:
+            if references is None:
+                self.stats['papers_not_found'] += 1
+                logger.info(f"Paper {arxiv_id} not found in Semantic Scholar (cached)")
+                return None
+            self.stats['papers_found'] += 1
+            self.stats['total_references'] += len(references)
+            logger.info(f"Found {len(references)} references for {arxiv_id} (cached)")
+            return references
+        
         url = f"{self.api_base}/paper/arXiv:{arxiv_id}"
         params = {"fields": SEMANTIC_SCHOLAR_FIELDS}
         
@@ -57,43 +93,36 @@ class ReferenceScraper:
         
         for attempt in range(max_retries_for_rate_limit):
             try:
+                self.limiter.acquire()
                 response = self.session.get(url, params=params, timeout=30)
                 
                 if response.status_code == 200:
+                    # Only real answers raise the shared rate: speeding up on
+                    # 5xx would hit a failing server harder
+                    self.limiter.on_success()
                     data = response.json()
                     references = data.get("references", [])
                     
                     self.stats['papers_found'] += 1
                     self.stats['total_references'] += len(references)
+                    self._cache_store(arxiv_id, references)
                     
                     logger.info(f"Found {len(references)} references for {arxiv_id}")
-                    time.sleep(SEMANTIC_SCHOLAR_DELAY)
                     return references
                 
                 elif response.status_code == 404:
+                    self.limiter.on_success()
                     logger.warning(f"Paper {arxiv_id} not found in Semantic Scholar database")
                     self.stats['papers_not_found'] += 1
-                    time.sleep(SEMANTIC_SCHOLAR_DELAY)
+                    self._cache_store(arxiv_id, None)
                     return None
                 
                 elif response.status_code == 429:
                     consecutive_rate_limits += 1
-                    # Rate limit exceeded - check Retry-After header
-                    retry_after = response.headers.get('Retry-After')
-                    if retry_after:
-                        try:
-                            wait_time = int(retry_after)
-                            logger.warning(f"Rate limit exceeded (attempt {attempt + 1}/{max_retries_for_rate_limit}), waiting {wait_time} seconds (from Retry-After header)...")
-                            time.sleep(wait_time)
-                        except ValueError:
-                            wait_time = 120
-                            logger.warning(f"Rate limit exceeded (attempt {attempt + 1}/{max_retries_for_rate_limit}), waiting {wait_time} seconds...")
-                            time.sleep(wait_time)
-                    else:
-                        # Exponential backoff: wait longer on each retry
-                        wait_time = min(60 * (attempt + 1), 300)  # 60s, 120s, 180s, 240s, 300s (max 5 min)
-                        logger.warning(f"Rate limit exceeded (attempt {attempt + 1}/{max_retries_for_rate_limit}), waiting {wait_time} seconds...")
-                        time.sleep(wait_time)
+                    # Slow down and pause the shared limiter (Retry-After if given,
+                    # else exponential backoff); the next acquire() waits it out
+                    wait_time = self.limiter.on_throttle(parse_retry_after(response.headers.get('Retry-After')))
+                    logger.warning(f"Rate limit exceeded (attempt {attempt + 1}/{max_retries_for_rate_limit}), retrying in {wait_time:.0f} seconds...")
                     
                     # Continue retrying for rate limit
                     if attempt < max_retries_for_rate_limit - 1:
@@ -105,21 +134,21 @@ class ReferenceScraper:
                 else:
                     logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES}: HTTP {response.status_code}")
                     if attempt < MAX_RETRIES - 1:
-                        time.sleep(RETRY_DELAY)
+                        timed_sleep(RETRY_DELAY, 'retry_backoff')
                     else:
                         break
                 
             except requests.exceptions.Timeout:
                 logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES}: Request timeout")
                 if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
+                    timed_sleep(RETRY_DELAY, 'retry_backoff')
                 else:
                     break
             
             except Exception as e:
                 logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES}: {e}")
                 if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
+                    timed_sleep(RETRY_DELAY, 'retry_backoff')
                 else:
                     break
         
@@ -199,8 +228,7 @@ class ReferenceScraper:
             
             if references is None:
                 # Create empty references file
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, indent=2, ensure_ascii=False)
+                atomic_write_json(output_path, {})
                 logger.warning(f"No references found for {arxiv_id} (paper may not exist in Semantic Scholar or API unavailable), saved empty file")
                 return False
             
@@ -220,8 +248,7 @@ class ReferenceScraper:
                 logger.info(f"Extracted {arxiv_refs_count} references with arXiv IDs from {total_refs} total references")
             
             # Save to file (always create file, even if empty)
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(arxiv_references, f, indent=2, ensure_ascii=False)
+            atomic_write_json(output_path, arxiv_references)
             
             logger.info(f"Saved {len(arxiv_references)} arXiv references to {output_path}")
             return True
@@ -230,8 +257,7 @@ class ReferenceScraper:
             logger.error(f"Failed to scrape references for {arxiv_id}: {e}")
             # Always create file, even on error (empty dict)
             try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, indent=2, ensure_ascii=False)
+                atomic_write_json(output_path, {})
                 logger.warning(f"Created empty references.json due to error for {arxiv_id}")
             except Exception as write_error:
                 logger.error(f"Failed to create references.json file for {arxiv_id}: {write_error}")
@@ -3,29 +3,50 @@ Optimized reference scraper using Semantic Scholar Batch API
 """
 
 import time
-import json
 import logging
 import requests
+from collections import deque
 from typing import Dict, List, Optional
 from datetime import datetime
 
 from config import (
     SEMANTIC_SCHOLAR_API_BASE,
     SEMANTIC_SCHOLAR_FIELDS,
-    SEMANTIC_SCHOLAR_DELAY,
     MAX_RETRIES,
-    RETRY_DELAY
+    RETRY_DELAY,
+    REFERENCE_MIN_BATCH_SIZE,
+    REFERENCE_BATCH_GROWTH,
+    REFERENCE_FAST_BATCH_SECONDS,
+    REFERENCE_MAX_CONSECUTIVE_FAILURES,
+    REFERENCE_MAX_CONSECUTIVE_THROTTLES
 )
+from rate_limiter import get_rate_limiter, parse_retry_after, SEMANTIC_SCHOLAR_HOST
+from utils import atomic_write_json
+from instrumentation import timed, timed_sleep
 
 logger = logging.getLogger(__name__)
 
+# Result of a batch request answered with HTTP 429: the IDs are fine, the
+# request only has to be sent again once the rate limiter's pause is over
+THROTTLED = object()
+
 
 class OptimizedReferenceScraper:
     
-    def __init__(self, batch_size: int = 500):
+    def __init__(self, batch_size: int = 500, cache=None, read_cache: bool = True):
         self.api_base = SEMANTIC_SCHOLAR_API_BASE
         self.session = requests.Session()
+        self.limiter = get_rate_limiter(SEMANTIC_SCHOLAR_HOST)
         self.batch_size = batch_size
+        # IDs per request, shrunk after timeouts / oversized responses and
+        # grown back (up to batch_size) after fast successes
+        self.current_batch_size = batch_size
+        # Optional S2ResponseCache; only IDs without a fresh entry are requested.
+        # With read_cache False every ID is requested and the cache is only written
+        self.cache = cache
+        self.read_cache = read_cache
+        # Optional AsyncHttpEngine; when set, batch requests go through its shared session
+        self.engine = None
         self.stats = {
             'papers_queried': 0,
             'papers_found': 0,
@@ -33,10 +54,162 @@ class OptimizedReferenceScraper:
             'total_references': 0,
             'references_with_arxiv_id': 0,
             'api_errors': 0,
-            'batch_requests': 0
+            'batch_requests': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'bisections': 0,
+            'throttled_batches': 0,
+            'failed_ids': 0,
+            'batch_size_decreases': 0,
+            'batch_size_increases': 0
         }
     
+    def parse_batch_response(self, arxiv_ids: List[str], results: List) -> Dict[str, Optional[List[Dict]]]:
+        """Map a /paper/batch response (one item per requested ID, in order) to reference lists"""
+        papers_data = {}
+        for i, paper_data in enumerate(results):
+            arxiv_id = arxiv_ids[i]
+            
+            if paper_data is None:
+                self.stats['papers_not_found'] += 1
+                papers_data[arxiv_id] = None
+                logger.warning(f"Paper {arxiv_id} not found in batch")
+            else:
+                self.stats['papers_found'] += 1
+                references = paper_data.get("references", [])
+                self.stats['total_references'] += len(references)
+                papers_data[arxiv_id] = references
+                logger.debug(f"Found {len(references)} references for {arxiv_id}")
+        
+        self.stats['papers_queried'] += len(arxiv_ids)
+        if self.cache is not None:
+            self.cache.put_many(papers_data, SEMANTIC_SCHOLAR_FIELDS)
+        logger.info(f"Batch request successful: {len(arxiv_ids)} papers, {sum(len(r) if r else 0 for r in papers_data.values())} total references")
+        
+        return papers_data
+    
+    def _cached_batch(self, arxiv_ids: List[str]) -> Dict[str, Optional[List[Dict]]]:
+        """Fresh cache entries of a batch, counted like API answers"""
+        if self.cache is None or not self.read_cache:
+            return {}
+        cached = self.cache.get_many(arxiv_ids, SEMANTIC_SCHOLAR_FIELDS)
+        for references in cached.values():
+            if references is None:
+                self.stats['papers_not_found'] += 1
+            else:
+                self.stats['papers_found'] += 1
+                self.stats['total_references'] += len(references)
+        self.stats['papers_queried'] += len(cached)
+        self.stats['cache_hits'] += len(cached)
+        self.stats['cache_misses'] += len(arxiv_ids) - len(cached)
+        if cached:
+            logger.info(f"Semantic Scholar cache: {len(cached)}/{len(arxiv_ids)} papers served locally")
+        return cached
+    
     def get_papers_batch(self, arxiv_ids: List[str]) -> Dict[str, Optional[List[Dict]]]:
+        """
+        Get references for a list of papers
+        
+        Cached answers are used first. The rest is requested current_batch_size
+        IDs at a time; a request that fails (HTTP error, timeout) is split in half
+        and both halves are requested again, until the failing IDs are isolated.
+        A rate-limited request is sent again whole once the limiter allows it.
+        
+        Args:
+            arxiv_ids: arXiv IDs
+        
+        Returns:
+            Dictionary mapping arXiv ID to its reference list, or None if the paper
+            is not in Semantic Scholar. IDs whose requests failed are left out.
+        """
+        results = self._cached_batch(arxiv_ids)
+        missing = [arxiv_id for arxiv_id in arxiv_ids if arxiv_id not in results]
+        pending = deque([missing] if missing else [])
+        consecutive_failures = 0
+        consecutive_throttles = 0
+        
+        while pending:
+            chunk = pending.popleft()
+            if len(chunk) > self.current_batch_size:
+                pending.appendleft(chunk[self.current_batch_size:])
+                chunk = chunk[:self.current_batch_size]
+            
+            fetched = self._fetch_batch(chunk)
+            if fetched is THROTTLED:
+                self.stats['throttled_batches'] += 1
+                consecutive_throttles += 1
+                if consecutive_throttles >= REFERENCE_MAX_CONSECUTIVE_THROTTLES:
+                    remaining = len(chunk) + sum(len(c) for c in pending)
+                    self.stats['failed_ids'] += remaining
+                    logger.error(f"{consecutive_throttles} batch requests rate limited in a row, "
+                                 f"leaving {remaining} papers for a later retry")
+                    break
+                pending.appendleft(chunk)
+                continue
+            consecutive_throttles = 0
+            if fetched is not None:
+                results.update(fetched)
+                consecutive_failures = 0
+                continue
+            
+            consecutive_failures += 1
+            if consecutive_failures >= REFERENCE_MAX_CONSECUTIVE_FAILURES:
+                remaining = len(chunk) + sum(len(c) for c in pending)
+                self.stats['failed_ids'] += remaining
+                logger.error(f"{consecutive_failures} batch requests failed in a row, "
+                             f"leaving {remaining} papers for a later retry")
+                break
+            if len(chunk) > 1:
+                middle = len(chunk) // 2
+                pending.appendleft(chunk[middle:])
+                pending.appendleft(chunk[:middle])
+                self.stats['bisections'] += 1
+                logger.info(f"Splitting failed batch of {len(chunk)} papers into {middle} + {len(chunk) - middle}")
+            else:
+                self.stats['failed_ids'] += 1
+                logger.error(f"Reference request failed for {chunk[0]}")
+        
+        return {arxiv_id: results[arxiv_id] for arxiv_id in arxiv_ids if arxiv_id in results}
+    
+    def _fetch_batch(self, arxiv_ids: List[str]) -> Optional[Dict[str, Optional[List[Dict]]]]:
+        if self.engine is not None:
+            return self.engine.run(self.engine.get_papers_batch(arxiv_ids))
+        return self._request_batch(arxiv_ids)
+    
+    def batch_attempts(self, size: int) -> int:
+        """Attempts for one request: larger batches are split on failure instead of retried whole"""
+        return MAX_RETRIES if size == 1 else 1
+    
+    def record_batch_success(self, size: int, elapsed: float):
+        """Grow the batch size after a full batch answered quickly"""
+        if (elapsed < REFERENCE_FAST_BATCH_SECONDS and size >= self.current_batch_size
+                and self.current_batch_size < self.batch_size):
+            self.current_batch_size = min(self.batch_size, self.current_batch_size + REFERENCE_BATCH_GROWTH)
+            self.stats['batch_size_increases'] += 1
+            logger.info(f"Batch size increased to {self.current_batch_size}")
+    
+    def shrink_batch(self, size: int, reason: str):
+        """Halve the batch size after a request of `size` IDs timed out or was too large"""
+        new_size = max(REFERENCE_MIN_BATCH_SIZE, size // 2)
+        if new_size < self.current_batch_size:
+            self.current_batch_size = new_size
+            self.stats['batch_size_decreases'] += 1
+            logger.warning(f"Batch size reduced to {new_size} ({reason})")
+    
+    @staticmethod
+    def is_oversized(status: int, body: str) -> bool:
+        """True if Semantic Scholar refused a batch because its response would be too large"""
+        return status == 413 or (status == 400 and 'size' in body.lower())
+    
+    @timed('s2_batch_request')
+    def _request_batch(self, arxiv_ids: List[str]) -> Optional[Dict[str, Optional[List[Dict]]]]:
+        """
+        One /paper/batch request (failures are retried only for a single ID)
+        
+        Returns:
+            Reference lists by arXiv ID, THROTTLED if rate limited, or None if the
+            request failed
+        """
         self.stats['batch_requests'] += 1
         
         url = f"{self.api_base}/paper/batch"
@@ -44,59 +217,47 @@ class OptimizedReferenceScraper:
         
         paper_ids = [f"arXiv:{arxiv_id}" for arxiv_id in arxiv_ids]
         data = {"ids": paper_ids}
+        attempts = self.batch_attempts(len(arxiv_ids))
+        failures = 0
         
         for attempt in range(MAX_RETRIES):
             try:
+                self.limiter.acquire()
+                start_time = time.time()
                 response = self.session.post(url, params=params, json=data, timeout=60)
                 
                 if response.status_code == 200:
-                    results = response.json()
-                    
-                    papers_data = {}
-                    for i, paper_data in enumerate(results):
-                        arxiv_id = arxiv_ids[i]
-                        
-                        if paper_data is None:
-                            self.stats['papers_not_found'] += 1
-                            papers_data[arxiv_id] = None
-                            logger.warning(f"Paper {arxiv_id} not found in batch")
-                        else:
-                            self.stats['papers_found'] += 1
-                            references = paper_data.get("references", [])
-                            self.stats['total_references'] += len(references)
-                            papers_data[arxiv_id] = references
-                            logger.debug(f"Found {len(references)} references for {arxiv_id}")
-                    
-                    self.stats['papers_queried'] += len(arxiv_ids)
-                    logger.info(f"Batch request successful: {len(arxiv_ids)} papers, {sum(len(r) if r else 0 for r in papers_data.values())} total references")
-                    
-                    time.sleep(SEMANTIC_SCHOLAR_DELAY)
+                    self.limiter.on_success()
+                    papers_data = self.parse_batch_response(arxiv_ids, response.json())
+                    self.record_batch_success(len(arxiv_ids), time.time() - start_time)
                     return papers_data
                 
                 elif response.status_code == 429:
-                    retry_after = response.headers.get('Retry-After')
-                    if retry_after:
-                        wait_time = int(retry_after)
-                    else:
-                        wait_time = min(60 * (attempt + 1), 300)
-                    
-                    logger.warning(f"Batch rate limit (attempt {attempt + 1}/{MAX_RETRIES}), waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
+                    # The pause applies to the shared limiter; the next acquire() waits it out
+                    wait_time = self.limiter.on_throttle(parse_retry_after(response.headers.get('Retry-After')))
+                    logger.warning(f"Batch rate limit ({len(arxiv_ids)} papers), re-queued for {wait_time:.0f}s")
+                    return THROTTLED
                 
                 else:
-                    logger.warning(f"Batch attempt {attempt + 1}/{MAX_RETRIES}: HTTP {response.status_code}")
-                    if attempt < MAX_RETRIES - 1:
-                        time.sleep(RETRY_DELAY)
+                    logger.warning(f"Batch attempt {attempt + 1}/{MAX_RETRIES}: HTTP {response.status_code} ({len(arxiv_ids)} papers)")
+                    if self.is_oversized(response.status_code, response.text):
+                        self.shrink_batch(len(arxiv_ids), "response too large")
                 
+            except requests.exceptions.Timeout:
+                logger.warning(f"Batch attempt {attempt + 1}/{MAX_RETRIES}: timeout ({len(arxiv_ids)} papers)")
+                self.shrink_batch(len(arxiv_ids), "timeout")
+            
             except Exception as e:
                 logger.warning(f"Batch attempt {attempt + 1}/{MAX_RETRIES}: {e}")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
+            
+            failures += 1
+            if failures >= attempts:
+                break
+            timed_sleep(RETRY_DELAY, 'retry_backoff')
         
         self.stats['api_errors'] += 1
-        logger.error(f"Batch request failed after {MAX_RETRIES} attempts for {len(arxiv_ids)} papers")
-        return {arxiv_id: None for arxiv_id in arxiv_ids}
+        logger.warning(f"Batch request failed for {len(arxiv_ids)} papers")
+        return None
     
     def extract_arxiv_references(self, references: List[Dict]) -> Dict[str, Dict]:
         arxiv_references = {}
@@ -137,8 +298,7 @@ class OptimizedReferenceScraper:
             references = self.get_paper_references(arxiv_id)
             
             if references is None:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, indent=2, ensure_ascii=False)
+                atomic_write_json(output_path, {})
                 logger.warning(f"No references found for {arxiv_id}, saved empty file")
                 return False
             
@@ -153,8 +313,7 @@ class OptimizedReferenceScraper:
             elif arxiv_refs_count > 0:
                 logger.info(f"Extracted {arxiv_refs_count} references with arXiv IDs from {total_refs} total")
             
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(arxiv_references, f, indent=2, ensure_ascii=False)
+            atomic_write_json(output_path, arxiv_references)
             
             logger.info(f"Saved {len(arxiv_references)} arXiv references to {output_path}")
             return True
@@ -162,8 +321,7 @@ class OptimizedReferenceScraper:
         except Exception as e:
             logger.error(f"Failed to scrape references for {arxiv_id}: {e}")
             try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump({}, f, indent=2, ensure_ascii=False)
+                atomic_write_json(output_path, {})
             except Exception as write_error:
                 logger.error(f"Failed to create references.json: {write_error}")
             return False
@@ -172,7 +330,19 @@ class OptimizedReferenceScraper:
         batch_result = self.get_papers_batch([arxiv_id])
         return batch_result.get(arxiv_id)
     
-    def scrape_references_batch(self, arxiv_papers: Dict[str, str]) -> Dict[str, bool]:
+    @timed('references_batch')
+    def scrape_references_batch(self, arxiv_papers: Dict[str, str]) -> Dict[str, Optional[bool]]:
+        """
+        Write references.json for a set of papers
+        
+        Args:
+            arxiv_papers: arXiv ID -> references.json path
+        
+        Returns:
+            arXiv ID -> True if references were found, False if the paper is not in
+            Semantic Scholar (empty file written), None if the request failed (no
+            file written, the caller should retry later)
+        """
         if not arxiv_papers:
             return {}
         
@@ -189,17 +359,18 @@ class OptimizedReferenceScraper:
             
             for arxiv_id in batch_ids:
                 output_path = arxiv_papers[arxiv_id]
-                references = batch_results.get(arxiv_id)
+                if arxiv_id not in batch_results:
+                    results[arxiv_id] = None
+                    continue
+                references = batch_results[arxiv_id]
                 
                 try:
                     if references is None:
-                        with open(output_path, 'w', encoding='utf-8') as f:
-                            json.dump({}, f, indent=2, ensure_ascii=False)
+                        atomic_write_json(output_path, {})
                         results[arxiv_id] = False
                     else:
                         arxiv_references = self.extract_arxiv_references(references)
-                        with open(output_path, 'w', encoding='utf-8') as f:
-                            json.dump(arxiv_references, f, indent=2, ensure_ascii=False)
+                        atomic_write_json(output_path, arxiv_references)
                         results[arxiv_id] = True
                 except Exception as e:
                     logger.error(f"Failed to save references for {arxiv_id}: {e}")
@@ -208,4 +379,6 @@ class OptimizedReferenceScraper:
         return results
     
     def get_stats(self) -> Dict:
-        return self.stats.copy()
+        stats = self.stats.copy()
+        stats['current_batch_size'] = self.current_batch_size
+        return stats
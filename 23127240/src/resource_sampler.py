@@ -0,0 +1,257 @@
+"""
+Background sampler of process resources (RSS, CPU, disk I/O), tagged with the
+pipeline stages and papers running at each sample
+"""
+
+import os
+import csv
+import json
+import time
+import threading
+import tracemalloc
+import logging
+from typing import Dict, List, Optional
+
+import psutil
+
+from instrumentation import active_spans
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+FIELDNAMES = ['timestamp', 'elapsed_s', 'rss_mb', 'cpu_percent', 'read_mb', 'write_mb',
+              'num_threads', 'stages', 'papers']
+
+
+class ResourceSampler:
+    """
+    Thread sampling the current process every `interval` seconds.
+
+    RSS is the sum over the process and all its child processes (the spawned
+    extraction workers of stage_pipeline.ExtractionPool), so memory used by
+    extraction shows up in the peak. CPU and I/O are the current process only.
+
+    Each sample is appended to a CSV time series with the stages and arXiv IDs
+    active at that moment (see instrumentation.active_spans), so the peak RSS can
+    be traced back to the paper and stage that caused it. Unlike a sample taken
+    after each successful paper, this also sees peaks inside a stage and papers
+    that fail. With tracemalloc enabled, the top allocation sites are written as
+    JSON lines every `tracemalloc_interval` seconds, tagged the same way.
+    """
+
+    def __init__(self, samples_path: str, interval: float,
+                 tracemalloc_path: Optional[str] = None, tracemalloc_interval: float = 30.0,
+                 tracemalloc_top: int = 10, disk_ledger=None):
+        """
+        Args:
+            samples_path: CSV time series file (appended to, so resumed runs continue it)
+            interval: Seconds between samples
+            tracemalloc_path: JSON lines file of allocation snapshots (tracemalloc off if None)
+            tracemalloc_interval: Seconds between allocation snapshots
+            tracemalloc_top: Allocation sites kept per snapshot
+            disk_ledger: Optional DiskLedger of the directory holding the files;
+                appended bytes are reported to it
+        """
+        self.samples_path = samples_path
+        self.interval = interval
+        self.tracemalloc_path = tracemalloc_path
+        self.tracemalloc_interval = tracemalloc_interval
+        self.tracemalloc_top = tracemalloc_top
+        self.disk_ledger = disk_ledger
+        self.process = psutil.Process()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.start_io = self._io_counters()
+
+        self.stats = {
+            'samples': 0,
+            'snapshots': 0,
+            'peak_rss_mb': 0.0,
+            'peak_at': None,
+            'peak_stages': [],
+            'peak_papers': [],
+            'rss_total_mb': 0.0,
+            'cpu_total_percent': 0.0,
+            'read_mb': 0.0,
+            'write_mb': 0.0
+        }
+        self.stage_peaks: Dict[str, float] = {}
+        self.paper_peaks: Dict[str, float] = {}
+
+    def _io_counters(self):
+        # Not available on every platform (e.g. macOS) or in every container
+        try:
+            return self.process.io_counters()
+        except (AttributeError, NotImplementedError, psutil.Error):
+            return None
+
+    def _total_rss(self) -> int:
+        """RSS of the process plus its children, in bytes"""
+        rss = self.process.memory_info().rss
+        try:
+            children = self.process.children(recursive=True)
+        except psutil.Error:
+            return rss
+        for child in children:
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass  # exited since the listing
+        return rss
+
+    def sample(self) -> Dict:
+        """Take one sample, update the peaks and return the row"""
+        now = time.time()
+        rss_mb = self._total_rss() / MB
+        cpu_percent = self.process.cpu_percent(None)
+        io = self._io_counters()
+        read_mb = (io.read_bytes - self.start_io.read_bytes) / MB if io and self.start_io else 0.0
+        write_mb = (io.write_bytes - self.start_io.write_bytes) / MB if io and self.start_io else 0.0
+        spans = active_spans()
+        stages = sorted({stage for stage, _ in spans})
+        papers = sorted({label for _, label in spans if label})
+
+        with self.lock:
+            self.stats['samples'] += 1
+            self.stats['rss_total_mb'] += rss_mb
+            self.stats['cpu_total_percent'] += cpu_percent
+            self.stats['read_mb'] = read_mb
+            self.stats['write_mb'] = write_mb
+            if rss_mb > self.stats['peak_rss_mb']:
+                self.stats['peak_rss_mb'] = rss_mb
+                self.stats['peak_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+                self.stats['peak_stages'] = stages
+                self.stats['peak_papers'] = papers
+            for stage in stages:
+                self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0.0), rss_mb)
+            for paper in papers:
+                self.paper_peaks[paper] = max(self.paper_peaks.get(paper, 0.0), rss_mb)
+
+        return {
+            'timestamp': round(now, 3),
+            'elapsed_s': round(now - (self.started_at or now), 3),
+            'rss_mb': round(rss_mb, 2),
+            'cpu_percent': round(cpu_percent, 1),
+            'read_mb': round(read_mb, 2),
+            'write_mb': round(write_mb, 2),
+            'num_threads': self.process.num_threads(),
+            'stages': ' '.join(stages),
+            'papers': ' '.join(papers)
+        }
+
+    def snapshot_allocations(self) -> Dict:
+        """Top allocation sites by size, tagged with the running stages and papers"""
+        statistics = tracemalloc.take_snapshot().statistics('lineno')[:self.tracemalloc_top]
+        spans = active_spans()
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            self.stats['snapshots'] += 1
+        return {
+            'timestamp': round(time.time(), 3),
+            'traced_mb': round(current / MB, 2),
+            'traced_peak_mb': round(peak / MB, 2),
+            'stages': sorted({stage for stage, _ in spans}),
+            'papers': sorted({label for _, label in spans if label}),
+            'top': [{'site': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+                    for stat in statistics]
+        }
+
+    def _flush(self, f, offset: int) -> int:
+        """Flush an appended file and report the bytes written since offset to the disk ledger"""
+        f.flush()
+        end = f.tell()
+        if self.disk_ledger is not None:
+            self.disk_ledger.add(end - offset)
+        return end
+
+    def _run(self):
+        write_header = not os.path.exists(self.samples_path) or os.path.getsize(self.samples_path) == 0
+        snapshot_file = open(self.tracemalloc_path, 'a', encoding='utf-8') if self.tracemalloc_path else None
+        snapshot_end = snapshot_file.tell() if snapshot_file is not None else 0
+        next_snapshot = time.monotonic() + self.tracemalloc_interval
+        try:
+            with open(self.samples_path, 'a', newline='', encoding='utf-8') as f:
+                samples_end = f.tell()
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+                if write_header:
+                    writer.writeheader()
+                while True:
+                    try:
+                        writer.writerow(self.sample())
+                        samples_end = self._flush(f, samples_end)
+                        if snapshot_file is not None and time.monotonic() >= next_snapshot:
+                            snapshot_file.write(json.dumps(self.snapshot_allocations()) + '\n')
+                            snapshot_end = self._flush(snapshot_file, snapshot_end)
+                            next_snapshot = time.monotonic() + self.tracemalloc_interval
+                    except psutil.Error as e:
+                        logger.debug(f"Resource sample failed: {e}")
+                    # Sample once more after stop() so the end of the run is covered
+                    if self.stop_event.wait(self.interval):
+                        writer.writerow(self.sample())
+                        self._flush(f, samples_end)
+                        break
+        except OSError as e:
+            logger.warning(f"Resource sampler stopped, cannot write {self.samples_path}: {e}")
+        finally:
+            if snapshot_file is not None:
+                snapshot_file.close()
+
+    def start(self):
+        if self.tracemalloc_path and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.started_at = time.time()
+        self.process.cpu_percent(None)  # First call only sets the reference point
+        self.thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self.thread.start()
+        logger.info(f"Sampling resources every {self.interval}s to {self.samples_path}"
+                    f"{' (tracemalloc on)' if self.tracemalloc_path else ''}")
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        if self.tracemalloc_path and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def get_peak_rss_mb(self) -> float:
+        with self.lock:
+            return self.stats['peak_rss_mb']
+
+    def get_avg_rss_mb(self) -> float:
+        with self.lock:
+            return self.stats['rss_total_mb'] / self.stats['samples'] if self.stats['samples'] else 0.0
+
+    def top_papers(self, k: int = 10) -> List[Dict]:
+        """Papers running at the highest RSS samples"""
+        with self.lock:
+            ranked = sorted(self.paper_peaks.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [{'arxiv_id': arxiv_id, 'peak_rss_mb': round(rss, 2)} for arxiv_id, rss in ranked]
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+            stage_peaks = {stage: round(rss, 2) for stage, rss in sorted(self.stage_peaks.items())}
+        samples = stats.pop('samples')
+        rss_total = stats.pop('rss_total_mb')
+        cpu_total = stats.pop('cpu_total_percent')
+        return {
+            'interval_s': self.interval,
+            'samples': samples,
+            'snapshots': stats['snapshots'],
+            'samples_file': self.samples_path,
+            'peak_rss_mb': round(stats['peak_rss_mb'], 2),
+            'peak_at': stats['peak_at'],
+            'peak_stages': stats['peak_stages'],
+            'peak_papers': stats['peak_papers'],
+            'avg_rss_mb': round(rss_total / samples, 2) if samples else 0.0,
+            'avg_cpu_percent': round(cpu_total / samples, 1) if samples else 0.0,
+            'read_mb': round(stats['read_mb'], 2),
+            'write_mb': round(stats['write_mb'], 2),
+            'stage_peak_rss_mb': stage_peaks,
+            'top_papers_by_rss': self.top_papers()
+        }
@@ -1,153 +1,244 @@
 """
 Script to retry scraping references for papers with empty references.json files
+(paper folders and papers packed into shards)
+
+Usage: python retry_references.py [--output DATA_DIR] [--yes] [--no-cache]
 """
 
 import os
+import sys
 import json
+import tempfile
+import argparse
 import logging
-from pathlib import Path
+from typing import Dict, List, Optional
 
-from config import DATA_DIR
-from reference_scraper import ReferenceScraper
+from config import (
+    DATA_DIR, REFERENCE_BATCH_SIZE, SHARD_DIR_NAME,
+    S2_CACHE_PATH, S2_CACHE_TTL_DAYS, S2_CACHE_NEGATIVE_TTL_DAYS
+)
+from reference_scraper_optimized import OptimizedReferenceScraper
+from s2_cache import open_cache
+from shard_store import ShardStore
 from utils import setup_logging
 
-# Setup logging
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# references.json files up to this size are parsed to see whether they are empty;
+# any non-empty file is larger ("{}" is 2 bytes, one reference is well above 64)
+EMPTY_FILE_MAX_BYTES = 64
+
+
+def _needs_retry(ref_path: str, size: int) -> Optional[str]:
+    """Reason to retry a references.json of the given size, or None if it has references"""
+    try:
+        if size <= EMPTY_FILE_MAX_BYTES:
+            with open(ref_path, 'r', encoding='utf-8') as f:
+                return None if json.load(f) else "empty"
+        # Large files: only check that the file was written completely
+        with open(ref_path, 'rb') as f:
+            f.seek(-16, os.SEEK_END)
+            return None if f.read().rstrip().endswith(b'}') else "truncated"
+    except ValueError:
+        return "invalid JSON"
+    except OSError as e:
+        logger.error(f"Error reading {ref_path}: {e}")
+        return None
+
+
+def open_shard_store(data_dir: str) -> Optional[ShardStore]:
+    """ShardStore of the data directory, or None if no paper was packed"""
+    if os.path.isdir(os.path.join(data_dir, SHARD_DIR_NAME)):
+        return ShardStore(data_dir)
+    return None
+
+
+def _packed_needs_retry(store: ShardStore, folder: str) -> Optional[str]:
+    """Reason to retry the references.json of a packed paper, or None if it has references"""
+    name = f"{folder}/references.json"
+    record = store.index.get(name)
+    if record is None:
+        return "missing"
+    # Papers are packed once committed, after the atomic write: large files are complete
+    if record['size'] > EMPTY_FILE_MAX_BYTES:
+        return None
+    try:
+        return None if json.loads(store.read(name)) else "empty"
+    except ValueError:
+        return "invalid JSON"
+    except OSError as e:
+        logger.error(f"Error reading {name} from shards: {e}")
+        return None
+
 
 def find_empty_references(data_dir: str) -> list:
     """
-    Find all papers with empty references.json files
-    
+    Find all papers with missing, empty or broken references.json files,
+    in paper folders and in shards
+
     Args:
         data_dir: Data directory path
-    
+
     Returns:
-        List of arXiv IDs with empty references
+        List of paper folder names (e.g., "2208-12041")
     """
     empty_papers = []
-    data_path = Path(data_dir)
-    
-    if not data_path.exists():
+
+    if not os.path.isdir(data_dir):
         logger.error(f"Data directory not found: {data_dir}")
         return empty_papers
-    
-    # Iterate through all paper folders
-    for folder in data_path.iterdir():
-        if not folder.is_dir():
-            continue
-        
-        # Check if folder name matches pattern (e.g., "2208-12041")
-        folder_name = folder.name
-        if '-' not in folder_name:
-            continue
-        
-        # Check for references.json file
-        ref_file = folder / "references.json"
-        if not ref_file.exists():
-            logger.info(f"Found paper {folder_name} without references.json")
-            empty_papers.append(folder_name)
-            continue
-        
-        # Check if file is empty or has no references
-        try:
-            with open(ref_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not data or len(data) == 0:
-                    logger.info(f"Found paper {folder_name} with empty references.json")
-                    empty_papers.append(folder_name)
-        except json.JSONDecodeError:
-            logger.warning(f"Invalid JSON in {ref_file}, will retry")
-            empty_papers.append(folder_name)
-        except Exception as e:
-            logger.error(f"Error reading {ref_file}: {e}")
-    
-    return empty_papers
-
-
-def retry_references(arxiv_id_folder: str, data_dir: str):
+
+    folders = set()
+    # One scandir pass; stat results come with the directory entries
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            # Folder names look like "2208-12041"
+            if not entry.is_dir() or '-' not in entry.name or entry.name == SHARD_DIR_NAME:
+                continue
+            folders.add(entry.name)
+
+            ref_path = os.path.join(entry.path, "references.json")
+            try:
+                size = os.stat(ref_path).st_size
+            except FileNotFoundError:
+                logger.debug(f"Found paper {entry.name} without references.json")
+                empty_papers.append(entry.name)
+                continue
+
+            reason = _needs_retry(ref_path, size)
+            if reason is not None:
+                logger.debug(f"Found paper {entry.name} with {reason} references.json")
+                empty_papers.append(entry.name)
+
+    store = open_shard_store(data_dir)
+    if store is not None:
+        for arxiv_id in store.list_papers():
+            folder = arxiv_id.replace('.', '-')
+            if folder in folders:
+                continue  # folder not removed after packing: checked above
+            reason = _packed_needs_retry(store, folder)
+            if reason is not None:
+                logger.debug(f"Found packed paper {folder} with {reason} references.json")
+                empty_papers.append(folder)
+
+    return sorted(empty_papers)
+
+
+def retry_references(arxiv_id_folders: List[str], data_dir: str,
+                     ref_scraper: OptimizedReferenceScraper = None) -> Dict[str, Optional[bool]]:
     """
-    Retry scraping references for a paper
-    
+    Retry scraping references for papers through the batch API
+
+    Papers without a folder are looked up in the shards: their new
+    references.json is written to a temporary file, then into the shard.
+
     Args:
-        arxiv_id_folder: Folder name (e.g., "2208-12041")
+        arxiv_id_folders: Folder names (e.g., ["2208-12041"])
         data_dir: Data directory path
+        ref_scraper: Scraper to use (a new one without cache if None); should not
+            read its cache, or cached empty answers are returned again
+
+    Returns:
+        arXiv ID -> True (references found), False (paper not in Semantic Scholar)
+        or None (request failed, file left unchanged)
     """
-    # Convert folder name to arXiv ID format (e.g., "2208-12041" -> "2208.12041")
-    if '-' in arxiv_id_folder:
-        arxiv_id = arxiv_id_folder.replace('-', '.')
-    else:
-        arxiv_id = arxiv_id_folder
-    
-    logger.info(f"\n{'='*60}")
-    logger.info(f"Retrying references for {arxiv_id}")
-    logger.info(f"{'='*60}")
-    
-    # Path to references.json
-    ref_path = os.path.join(data_dir, arxiv_id_folder, "references.json")
-    
-    # Initialize reference scraper
-    ref_scraper = ReferenceScraper()
-    
-    # Scrape references
-    success = ref_scraper.scrape_references(arxiv_id, ref_path)
-    
-    if success:
-        # Check result
-        try:
-            with open(ref_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if data and len(data) > 0:
-                    logger.info(f"✓ Successfully scraped {len(data)} references for {arxiv_id}")
-                else:
-                    logger.warning(f"⚠ Scraped but no arXiv references found for {arxiv_id}")
-        except Exception as e:
-            logger.error(f"Error reading result for {arxiv_id}: {e}")
-    else:
-        logger.error(f"✗ Failed to scrape references for {arxiv_id}")
-
-
-def main():
-    """Main function"""
+    if ref_scraper is None:
+        ref_scraper = OptimizedReferenceScraper(batch_size=REFERENCE_BATCH_SIZE)
+    store = open_shard_store(data_dir)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        papers = {}
+        packed = {}  # arXiv ID -> shard member name
+        for folder in arxiv_id_folders:
+            # Folder name -> arXiv ID (e.g., "2208-12041" -> "2208.12041")
+            arxiv_id = folder.replace('-', '.')
+            if store is not None and not os.path.isdir(os.path.join(data_dir, folder)):
+                packed[arxiv_id] = f"{folder}/references.json"
+                papers[arxiv_id] = os.path.join(temp_dir, f"{folder}.json")
+            else:
+                papers[arxiv_id] = os.path.join(data_dir, folder, "references.json")
+
+        # scrape_references_batch writes each file atomically (temporary file + rename)
+        results = ref_scraper.scrape_references_batch(papers)
+
+        rewritten = 0
+        for arxiv_id, name in packed.items():
+            if results.get(arxiv_id) is None or not os.path.exists(papers[arxiv_id]):
+                continue
+            with open(papers[arxiv_id], 'rb') as f:
+                store.write(name, f.read())
+            rewritten += 1
+
+    if packed:
+        logger.info(f"Rewrote references.json of {rewritten} packed papers in their shards")
+    return results
+
+
+def confirm(num_papers: int) -> bool:
+    """Ask before sending requests; without a terminal (notebook, cron) use --yes"""
+    if not sys.stdin or not sys.stdin.isatty():
+        logger.error("No terminal to confirm on: run with --yes to retry without asking")
+        return False
+    print(f"\nFound {num_papers} papers with empty references.")
+    print("Do you want to retry scraping references for all of them? (y/n): ", end='')
+    try:
+        return input().strip().lower() == 'y'
+    except EOFError:
+        return False
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main function (argv lets a notebook call main(['--yes']))"""
+    parser = argparse.ArgumentParser(description='Retry references for papers with empty references.json')
+    parser.add_argument('--output', type=str, default=DATA_DIR, help='Scraper output directory')
+    parser.add_argument('--yes', '-y', action='store_true', help='Retry without asking for confirmation')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not store the new answers in the Semantic Scholar response cache')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+
     logger.info("="*60)
     logger.info("Retry References Scraper")
     logger.info("="*60)
-    
+
     # Find all papers with empty references
-    empty_papers = find_empty_references(DATA_DIR)
-    
+    empty_papers = find_empty_references(args.output)
+
     if not empty_papers:
         logger.info("No papers with empty references found!")
         return
-    
-    logger.info(f"\nFound {len(empty_papers)} papers with empty references:")
-    for paper in empty_papers:
-        logger.info(f"  - {paper}")
-    
-    # Ask for confirmation
-    print(f"\nFound {len(empty_papers)} papers with empty references.")
-    print("Do you want to retry scraping references for all of them? (y/n): ", end='')
-    response = input().strip().lower()
-    
-    if response != 'y':
+
+    logger.info(f"Found {len(empty_papers)} papers with empty references")
+
+    if not args.yes and not confirm(len(empty_papers)):
         logger.info("Cancelled by user")
         return
-    
-    # Retry references for each paper
+
+    # Cached answers are what left these files empty: every paper is requested
+    # again, and the fresh answers replace the cached ones
+    cache = None if args.no_cache else open_cache(S2_CACHE_PATH, S2_CACHE_TTL_DAYS, S2_CACHE_NEGATIVE_TTL_DAYS)
+    ref_scraper = OptimizedReferenceScraper(batch_size=REFERENCE_BATCH_SIZE, cache=cache, read_cache=False)
+
     logger.info(f"\nRetrying references for {len(empty_papers)} papers...")
-    for i, paper_folder in enumerate(empty_papers, 1):
-        logger.info(f"\n[{i}/{len(empty_papers)}] Processing {paper_folder}")
-        try:
-            retry_references(paper_folder, DATA_DIR)
-        except Exception as e:
-            logger.error(f"Error processing {paper_folder}: {e}")
-    
+    results = retry_references(empty_papers, args.output, ref_scraper)
+
+    found = sum(1 for ok in results.values() if ok)
+    not_found = sum(1 for ok in results.values() if ok is False)
+    failed = [arxiv_id for arxiv_id, ok in results.items() if ok is None]
+    stats = ref_scraper.get_stats()
+
     logger.info("\n" + "="*60)
     logger.info("Retry completed!")
+    logger.info(f"✓ Papers with references: {found}")
+    logger.info(f"⚠ Papers not in Semantic Scholar: {not_found}")
+    if failed:
+        logger.error(f"✗ Requests failed for {len(failed)} papers (run again later): {', '.join(failed[:10])}"
+                     f"{' ...' if len(failed) > 10 else ''}")
+    logger.info(f"Batch requests: {stats['batch_requests']}, "
+                f"cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses")
     logger.info("="*60)
 
 
 if __name__ == "__main__":
     main()
-
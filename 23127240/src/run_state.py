@@ -0,0 +1,314 @@
+"""
+Persistent per-paper run state (SQLite) used to resume a run without
+scanning the output directory
+"""
+
+import os
+import csv
+import json
+import time
+import logging
+from contextlib import nullcontext
+from typing import Dict, Iterable, List, Optional, Set
+
+from config import SHARD_DIR_NAME
+from shard_store import ShardStore
+from utils import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+
+# Paper lifecycle, in order
+STATUS_ATTEMPTED = "attempted"      # folder created, scraping started
+STATUS_METADATA = "metadata"        # arXiv metadata resolved
+STATUS_SOURCES = "sources"          # sources extracted and metadata.json written
+STATUS_REFERENCES = "references"    # queued for the batched reference phase
+STATUS_COMMITTED = "committed"      # references.json written, paper finished
+STATUS_FAILED = "failed"            # see reason column
+
+# Papers with sources on disk whose references still have to be resolved
+PENDING_REFERENCE_STATUSES = (STATUS_SOURCES, STATUS_REFERENCES)
+
+# paper_details.csv columns that are not strings
+DETAIL_INT_FIELDS = ('paper_id', 'size_before', 'size_after', 'size_before_figures',
+                     'size_after_figures', 'num_refs', 'current_output_size')
+DETAIL_FLOAT_FIELDS = ('runtime_s', 'max_rss', 'avg_rss')
+
+
+class RunState:
+    """
+    Records the lifecycle of every paper and the paper_details rows in one
+    SQLite file, so a restart is a few indexed queries instead of a crawl
+    over thousands of folders and a full CSV parse
+    """
+
+    def __init__(self, db_path: str, disk_ledger=None):
+        """
+        Open (or create) the state store
+
+        Args:
+            db_path: Path of the SQLite file
+            disk_ledger: Optional DiskLedger of the directory holding the file;
+                growth of the database and its WAL is reported to it
+        """
+        self.db_path = db_path
+        self.files = (db_path, f"{db_path}-wal", f"{db_path}-shm")
+        self.disk_ledger = disk_ledger
+        with self._tracking():
+            # One connection shared by all worker threads, serialized by self.lock
+            self.conn, self.lock = open_sqlite(db_path)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS papers (
+                    arxiv_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    reason TEXT,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS papers_status ON papers(status);
+                CREATE TABLE IF NOT EXISTS paper_details (
+                    arxiv_id TEXT PRIMARY KEY,
+                    row TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+        self.stats = {
+            'status_updates': 0,
+            'detail_updates': 0,
+            'rebuilt_from_tree': False
+        }
+
+    def _tracking(self):
+        """Report the size change of the database files to the disk ledger, if any"""
+        return self.disk_ledger.tracking(*self.files) if self.disk_ledger is not None else nullcontext()
+
+    def close(self):
+        # Closing the last connection checkpoints and removes the WAL
+        with self.lock, self._tracking():
+            self.conn.close()
+
+    def mark(self, arxiv_id: str, status: str, reason: Optional[str] = None):
+        """
+        Record the current lifecycle status of a paper
+
+        Args:
+            arxiv_id: arXiv ID
+            status: One of the STATUS_* constants
+            reason: Why the paper failed (STATUS_FAILED only)
+        """
+        with self.lock, self._tracking():
+            self.conn.execute(
+                "INSERT INTO papers (arxiv_id, status, reason, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(arxiv_id) DO UPDATE SET status=excluded.status, "
+                "reason=excluded.reason, updated_at=excluded.updated_at",
+                (arxiv_id, status, reason, time.time())
+            )
+            self.stats['status_updates'] += 1
+
+    def mark_many(self, arxiv_ids: Iterable[str], status: str):
+        """Record the same status for several papers in one transaction"""
+        now = time.time()
+        rows = [(arxiv_id, status, None, now) for arxiv_id in arxiv_ids]
+        with self.lock, self._tracking():
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT INTO papers (arxiv_id, status, reason, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(arxiv_id) DO UPDATE SET status=excluded.status, "
+                    "reason=excluded.reason, updated_at=excluded.updated_at",
+                    rows
+                )
+            self.stats['status_updates'] += len(rows)
+
+    def get_status(self, arxiv_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM papers WHERE arxiv_id = ?", (arxiv_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_ids(self, statuses: Optional[Iterable[str]] = None) -> Set[str]:
+        """
+        Get IDs of papers in the given statuses
+
+        Args:
+            statuses: Statuses to select, None for every recorded paper
+
+        Returns:
+            Set of arXiv IDs
+        """
+        with self.lock:
+            if statuses is None:
+                rows = self.conn.execute("SELECT arxiv_id FROM papers").fetchall()
+            else:
+                statuses = list(statuses)
+                placeholders = ', '.join('?' * len(statuses))
+                rows = self.conn.execute(
+                    f"SELECT arxiv_id FROM papers WHERE status IN ({placeholders})", statuses
+                ).fetchall()
+        return {row[0] for row in rows}
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM papers GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def count_failure_reasons(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT reason, COUNT(*) FROM papers WHERE status = ? GROUP BY reason",
+                (STATUS_FAILED,)
+            ).fetchall()
+        return {reason or 'unknown': count for reason, count in rows}
+
+    def save_paper_detail(self, row: Dict):
+        """Insert or replace one paper_details row"""
+        with self.lock, self._tracking():
+            self.conn.execute(
+                "INSERT INTO paper_details (arxiv_id, row) VALUES (?, ?) "
+                "ON CONFLICT(arxiv_id) DO UPDATE SET row=excluded.row",
+                (row['arxiv_id'], json.dumps(row, ensure_ascii=False))
+            )
+            self.stats['detail_updates'] += 1
+
+    def load_paper_details(self) -> List[Dict]:
+        """Get all paper_details rows in insertion order"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT row FROM paper_details ORDER BY rowid"
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def is_initialized(self) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'initialized'"
+            ).fetchone()
+        return row is not None
+
+    def _set_initialized(self):
+        with self.lock, self._tracking():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('initialized', ?)",
+                (time.strftime('%Y-%m-%d %H:%M:%S'),)
+            )
+
+    def rebuild_from_tree(self, output_dir: str, details_csv: Optional[str] = None):
+        """
+        Populate the store from an existing output directory. Only needed once,
+        for output written before the store existed.
+
+        Args:
+            output_dir: Directory containing <yymm-id> paper folders (and the
+                shards of packed papers)
+            details_csv: paper_details.csv to import, if any
+        """
+        start = time.time()
+        statuses = {}
+        now = time.time()
+
+        if os.path.exists(output_dir):
+            with os.scandir(output_dir) as entries:
+                for entry in entries:
+                    # Paper folders look like YYMM-NNNNN
+                    if not entry.is_dir() or '-' not in entry.name:
+                        continue
+                    arxiv_id = entry.name.replace('-', '.')
+                    has_metadata = os.path.exists(os.path.join(entry.path, "metadata.json"))
+                    has_references = os.path.exists(os.path.join(entry.path, "references.json"))
+                    if has_metadata and has_references:
+                        status = STATUS_COMMITTED
+                    elif has_metadata:
+                        status = STATUS_SOURCES
+                    else:
+                        status = STATUS_ATTEMPTED
+                    statuses[arxiv_id] = status
+
+        # Papers are packed only once committed; a packed paper whose folder was
+        # not removed yet is committed as well
+        if os.path.isdir(os.path.join(output_dir, SHARD_DIR_NAME)):
+            for arxiv_id in ShardStore(output_dir).list_papers():
+                statuses[arxiv_id] = STATUS_COMMITTED
+        rows = [(arxiv_id, status, None, now) for arxiv_id, status in statuses.items()]
+
+        details = self._read_details_csv(details_csv)
+
+        with self.lock, self._tracking():
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO papers (arxiv_id, status, reason, updated_at) "
+                    "VALUES (?, ?, ?, ?)", rows
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO paper_details (arxiv_id, row) VALUES (?, ?)", details
+                )
+            self.stats['rebuilt_from_tree'] = True
+        self._set_initialized()
+
+        logger.info(f"Run state rebuilt from output tree: {len(rows)} papers, "
+                    f"{len(details)} detail rows in {time.time() - start:.2f}s")
+
+    @staticmethod
+    def _read_details_csv(details_csv: Optional[str]) -> List[tuple]:
+        """(arxiv_id, JSON row) pairs of a paper_details.csv, empty if missing or unreadable"""
+        details = []
+        if not details_csv or not os.path.exists(details_csv):
+            return details
+        try:
+            with open(details_csv, 'r', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    for field in DETAIL_INT_FIELDS:
+                        row[field] = int(row[field])
+                    for field in DETAIL_FLOAT_FIELDS:
+                        row[field] = float(row[field])
+                    details.append((row['arxiv_id'], json.dumps(row, ensure_ascii=False)))
+        except Exception as e:
+            logger.warning(f"Failed to import paper details from CSV: {e}")
+            return []
+        return details
+
+    def merge_details_csv(self, details_csv: Optional[str]) -> int:
+        """
+        Import paper_details.csv rows the store does not have yet (rows appended
+        by backfill_paper_details.py); rows already in the store are kept
+
+        Returns:
+            Number of rows added
+        """
+        details = self._read_details_csv(details_csv)
+        if not details:
+            return 0
+        with self.lock, self._tracking():
+            with self.conn:
+                self.conn.execute("BEGIN")
+                before = self.conn.total_changes
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO paper_details (arxiv_id, row) VALUES (?, ?)", details
+                )
+                added = self.conn.total_changes - before
+        if added:
+            logger.info(f"Imported {added} new paper details rows from {details_csv}")
+        return added
+
+    def ensure_initialized(self, output_dir: str, details_csv: Optional[str] = None):
+        """
+        Rebuild from the tree the first time the store is opened; afterwards only
+        merge paper_details.csv rows added outside the pipeline (the CSV is
+        rewritten from the store, so they would be lost otherwise)
+        """
+        if not self.is_initialized():
+            self.rebuild_from_tree(output_dir, details_csv)
+        else:
+            self.merge_details_csv(details_csv)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+        stats['status_counts'] = self.count_by_status()
+        stats['failure_reasons'] = self.count_failure_reasons()
+        return stats
@@ -0,0 +1,158 @@
+"""
+Persistent cache of Semantic Scholar reference responses
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+from typing import Dict, List, Optional
+
+from utils import ensure_dir, open_sqlite
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+class S2ResponseCache:
+    """
+    SQLite cache of reference lists returned by Semantic Scholar.
+
+    Entries are keyed by "arXiv:<id>|<fields>", so changing SEMANTIC_SCHOLAR_FIELDS
+    never serves responses of the old field set. Papers Semantic Scholar does not
+    know (404, or null in a batch response) are cached as negative entries with a
+    shorter lifetime, since they may be indexed later. Failed requests (rate
+    limits, timeouts) are never cached. Bodies are stored as zlib-compressed JSON.
+    """
+
+    def __init__(self, db_path: str, ttl_days: float, negative_ttl_days: float):
+        """
+        Open (or create) the cache
+
+        Args:
+            db_path: SQLite file (keep it outside the output directory)
+            ttl_days: Lifetime of cached reference lists
+            negative_ttl_days: Lifetime of cached "not found" answers
+        """
+        self.db_path = db_path
+        self.ttl = ttl_days * DAY_SECONDS
+        self.negative_ttl = negative_ttl_days * DAY_SECONDS
+        directory = os.path.dirname(db_path)
+        if directory:
+            ensure_dir(directory)
+
+        self.conn, self.lock = open_sqlite(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB,                  -- NULL: paper not in Semantic Scholar
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'stores': 0
+        }
+
+    @staticmethod
+    def key(arxiv_id: str, fields: str) -> str:
+        return f"arXiv:{arxiv_id}|{fields}"
+
+    def get_many(self, arxiv_ids: List[str], fields: str) -> Dict[str, Optional[List[Dict]]]:
+        """
+        Look up fresh entries
+
+        Args:
+            arxiv_ids: arXiv IDs
+            fields: Requested Semantic Scholar fields
+
+        Returns:
+            Dictionary with the cached IDs only, mapping to the reference list
+            or None for papers cached as not found
+        """
+        keys = {self.key(arxiv_id, fields): arxiv_id for arxiv_id in arxiv_ids}
+        rows = []
+        with self.lock:
+            key_list = list(keys)
+            # Stay below SQLite's host parameter limit
+            for i in range(0, len(key_list), 500):
+                chunk = key_list[i:i + 500]
+                rows.extend(self.conn.execute(
+                    f"SELECT key, body, fetched_at FROM responses WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+
+        now = time.time()
+        results = {}
+        expired = 0
+        for key, body, fetched_at in rows:
+            ttl = self.ttl if body is not None else self.negative_ttl
+            if now - fetched_at > ttl:
+                expired += 1
+                continue
+            try:
+                results[keys[key]] = json.loads(zlib.decompress(body)) if body is not None else None
+            except (zlib.error, ValueError) as e:
+                logger.warning(f"Ignoring corrupt S2 cache entry {key}: {e}")
+
+        with self.lock:
+            self.stats['hits'] += sum(1 for refs in results.values() if refs is not None)
+            self.stats['negative_hits'] += sum(1 for refs in results.values() if refs is None)
+            self.stats['misses'] += len(arxiv_ids) - len(results)
+            self.stats['expired'] += expired
+        return results
+
+    def put_many(self, results: Dict[str, Optional[List[Dict]]], fields: str):
+        """
+        Store answers of successful requests
+
+        Args:
+            results: arXiv ID -> reference list, or None when the paper was not found
+            fields: Requested Semantic Scholar fields
+        """
+        now = time.time()
+        rows = [(self.key(arxiv_id, fields),
+                 zlib.compress(json.dumps(refs).encode('utf-8')) if refs is not None else None,
+                 now)
+                for arxiv_id, refs in results.items()]
+        if not rows:
+            return
+        try:
+            with self.lock:
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO responses (key, body, fetched_at) VALUES (?, ?, ?)", rows
+                    )
+                self.stats['stores'] += len(rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write S2 cache: {e}")
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+            stats['entries'] = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['negative_hits']) / lookups, 3) if lookups else None
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_cache(db_path: Optional[str], ttl_days: float, negative_ttl_days: float) -> Optional[S2ResponseCache]:
+    """S2ResponseCache at db_path, or None when the cache is disabled (no path) or cannot be opened"""
+    if not db_path:
+        return None
+    try:
+        return S2ResponseCache(db_path, ttl_days, negative_ttl_days)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Semantic Scholar cache disabled, could not open {db_path}: {e}")
+        return None
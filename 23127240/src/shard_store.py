@@ -0,0 +1,305 @@
+"""
+Packed output format: per-month compressed zip shards with an offset index
+
+Usage:
+    python shard_store.py pack <output_dir>     # move paper folders into shards
+    python shard_store.py unpack <output_dir>   # restore the folder tree
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import struct
+import zipfile
+import warnings
+import threading
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from config import SHARD_DIR_NAME
+from utils import ensure_dir, get_releasable_size, format_folder_name
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index.jsonl"
+
+# Fixed part of a zip local file header
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+
+
+class ShardStore:
+    """
+    Stores finished papers in compressed, append-only zip shards, one per
+    month (shards/2311.zip), instead of thousands of small files.
+
+    Members keep their tree paths (2311-14685/metadata.json,
+    2311-14685/tex/2311-14685v1/paper.tex, ...). index.jsonl records the shard,
+    local header offset and sizes of every member, so a single file is read
+    with one seek without parsing the zip central directory.
+    """
+
+    def __init__(self, output_dir: str):
+        """
+        Open the shard directory of an output directory
+
+        Args:
+            output_dir: Output directory (shards go to <output_dir>/shards)
+        """
+        self.output_dir = output_dir
+        self.shard_dir = os.path.join(output_dir, SHARD_DIR_NAME)
+        self.index_path = os.path.join(self.shard_dir, INDEX_NAME)
+        ensure_dir(self.shard_dir)
+
+        self.lock = threading.Lock()
+        self.index = {}  # member name -> index record
+        self.stats = {
+            'papers_packed': 0,
+            'files_packed': 0,
+            'bytes_in': 0,
+            'bytes_out': 0
+        }
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                self.index[record['name']] = record
+
+    @staticmethod
+    def shard_name(arxiv_id: str) -> str:
+        """Shard file for a paper (e.g. "2311.14685" -> "2311.zip")"""
+        return f"{arxiv_id.split('.')[0]}.zip"
+
+    def pack_papers(self, arxiv_ids: Iterable[str]) -> int:
+        """
+        Move finished paper folders into their month shards
+
+        Args:
+            arxiv_ids: Papers whose folders are complete
+
+        Returns:
+            Change of the output size in bytes (negative when space was saved)
+        """
+        by_shard = {}
+        for arxiv_id in arxiv_ids:
+            paper_dir = os.path.join(self.output_dir, format_folder_name(arxiv_id))
+            if os.path.isdir(paper_dir):
+                by_shard.setdefault(self.shard_name(arxiv_id), []).append(paper_dir)
+
+        delta = 0
+        with self.lock:
+            for shard, paper_dirs in by_shard.items():
+                delta += self._pack_into(shard, paper_dirs)
+        return delta
+
+    def _pack_into(self, shard: str, paper_dirs: List[str]) -> int:
+        """Append paper folders to one shard and remove them (caller holds self.lock)"""
+        shard_path = os.path.join(self.shard_dir, shard)
+        shard_before = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+        index_before = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        # Bytes freed by removing the folders (files hardlinked from unpacked papers stay)
+        tree_bytes = get_releasable_size(*paper_dirs)
+        records = []
+
+        with zipfile.ZipFile(shard_path, 'a', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+            for paper_dir in paper_dirs:
+                for dirpath, _, filenames in os.walk(paper_dir):
+                    for filename in sorted(filenames):
+                        path = os.path.join(dirpath, filename)
+                        name = os.path.relpath(path, self.output_dir).replace(os.sep, '/')
+                        if name in self.index:
+                            continue  # already packed by an interrupted earlier call
+                        zf.write(path, name)
+                        info = zf.getinfo(name)
+                        records.append(self._index_record(shard, info))
+                        self.stats['files_packed'] += 1
+                        self.stats['bytes_in'] += info.file_size
+                        self.stats['bytes_out'] += info.compress_size
+
+        # Index first, then delete: a crash in between leaves duplicates, never losses
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+                self.index[record['name']] = record
+
+        for paper_dir in paper_dirs:
+            shutil.rmtree(paper_dir, ignore_errors=True)
+        self.stats['papers_packed'] += len(paper_dirs)
+
+        logger.info(f"Packed {len(paper_dirs)} papers ({len(records)} files) into {shard}")
+        shard_after = os.path.getsize(shard_path)
+        index_after = os.path.getsize(self.index_path)
+        return (shard_after - shard_before) + (index_after - index_before) - tree_bytes
+
+    @staticmethod
+    def _index_record(shard: str, info: zipfile.ZipInfo) -> Dict:
+        return {
+            'name': info.filename,
+            'shard': shard,
+            'offset': info.header_offset,
+            'compressed_size': info.compress_size,
+            'size': info.file_size,
+            'method': info.compress_type,
+            'crc': info.CRC
+        }
+
+    def write(self, name: str, data: bytes):
+        """
+        Replace the content of a packed member (e.g. a retried references.json)
+
+        Shards are append-only: the new copy is appended to the member's shard
+        and the index record pointing to it is appended after the old one, which
+        it overrides when the index is loaded. The old copy stays in the shard.
+
+        Args:
+            name: Member name (e.g. "2311-14685/references.json")
+            data: New file content
+        """
+        arxiv_id = name.split('/', 1)[0].replace('-', '.')
+        shard = self.shard_name(arxiv_id)
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with self.lock:
+            with zipfile.ZipFile(os.path.join(self.shard_dir, shard), 'a',
+                                 compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', UserWarning)  # "Duplicate name": intended
+                    zf.writestr(info, data)
+                record = self._index_record(shard, zf.getinfo(name))
+            # getinfo returns the entry just written: the latest one with that name
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+            self.index[name] = record
+
+    def read(self, name: str) -> Optional[bytes]:
+        """
+        Read one member by its tree path with a single seek into its shard
+
+        Args:
+            name: Member name (e.g. "2311-14685/metadata.json")
+
+        Returns:
+            File content, or None if the member is not packed
+        """
+        record = self.index.get(name)
+        if record is None:
+            return None
+
+        with open(os.path.join(self.shard_dir, record['shard']), 'rb') as f:
+            header = self._local_header(f, name, record)
+            name_length, extra_length = header[9], header[10]
+            f.seek(name_length + extra_length, os.SEEK_CUR)
+            data = f.read(record['compressed_size'])
+
+        if record['method'] == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        if zlib.crc32(data) != record['crc']:
+            raise ValueError(f"CRC mismatch for {name} in {record['shard']}")
+        return data
+
+    @staticmethod
+    def _local_header(f, name: str, record: Dict) -> tuple:
+        f.seek(record['offset'])
+        header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise ValueError(f"Bad local header for {name} in {record['shard']}")
+        return header
+
+    def mtime(self, name: str) -> Optional[float]:
+        """
+        Modification time the file had when it was packed (2-second resolution)
+
+        Args:
+            name: Member name (e.g. "2311-14685/metadata.json")
+
+        Returns:
+            Local time in seconds since the epoch, or None if the member is not packed
+        """
+        record = self.index.get(name)
+        if record is None:
+            return None
+
+        with open(os.path.join(self.shard_dir, record['shard']), 'rb') as f:
+            header = self._local_header(f, name, record)
+        dos_time, dos_date = header[4], header[5]
+        return time.mktime(((dos_date >> 9) + 1980, (dos_date >> 5) & 0xF, dos_date & 0x1F,
+                            dos_time >> 11, (dos_time >> 5) & 0x3F, (dos_time & 0x1F) * 2, 0, 0, -1))
+
+    def paper_sizes(self) -> Dict[str, int]:
+        """Uncompressed size of each packed paper's files (its folder size), by arXiv ID"""
+        sizes = {}
+        for name, record in self.index.items():
+            arxiv_id = name.split('/', 1)[0].replace('-', '.')
+            sizes[arxiv_id] = sizes.get(arxiv_id, 0) + record['size']
+        return sizes
+
+    def read_json(self, name: str) -> Optional[Dict]:
+        data = self.read(name)
+        return json.loads(data) if data is not None else None
+
+    def list_papers(self) -> List[str]:
+        """arXiv IDs of all packed papers"""
+        folders = {name.split('/', 1)[0] for name in self.index}
+        return sorted(folder.replace('-', '.') for folder in folders)
+
+    def unpack(self, remove_shards: bool = False) -> int:
+        """
+        Restore the folder tree from the shards
+
+        Args:
+            remove_shards: Delete shards and index once everything is restored
+
+        Returns:
+            Number of files written
+        """
+        written = 0
+        for name in sorted(self.index):
+            path = os.path.join(self.output_dir, *name.split('/'))
+            ensure_dir(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(self.read(name))
+            written += 1
+
+        if remove_shards:
+            shutil.rmtree(self.shard_dir)
+            self.index = {}
+        logger.info(f"Unpacked {written} files into {self.output_dir}")
+        return written
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+        stats['files_indexed'] = len(self.index)
+        stats['compression_ratio'] = round(stats['bytes_in'] / stats['bytes_out'], 3) if stats['bytes_out'] else None
+        return stats
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) != 3 or sys.argv[1] not in ('pack', 'unpack'):
+        print(__doc__)
+        sys.exit(1)
+
+    command, output_dir = sys.argv[1], sys.argv[2]
+    store = ShardStore(output_dir)
+    if command == 'pack':
+        arxiv_ids = [entry.name.replace('-', '.') for entry in os.scandir(output_dir)
+                     if entry.is_dir() and entry.name != SHARD_DIR_NAME and '-' in entry.name]
+        delta = store.pack_papers(arxiv_ids)
+        print(f"Packed {len(arxiv_ids)} papers, output size changed by {delta / (1024 * 1024):.2f} MB")
+    else:
+        store.unpack(remove_shards=True)
+
+
+if __name__ == "__main__":
+    main()
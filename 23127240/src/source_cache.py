@@ -0,0 +1,216 @@
+"""
+Content-addressed local cache of downloaded source tarballs
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import threading
+import logging
+from typing import Dict, Optional
+
+from utils import ensure_dir, open_sqlite
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_file(path: str) -> str:
+    """Hex SHA-256 of a file, read in 1 MB chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """Hardlink src to dst, copying when both are not on the same filesystem"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class SourceCache:
+    """
+    Keeps downloaded source archives outside the output directory so reruns,
+    new output directories and changed cleaning rules do not download them again.
+
+    Blobs are stored once per content hash under blobs/<2 hex>/<sha256>; an SQLite
+    index maps versioned arXiv IDs (e.g. "2311.14685v2") to blobs. Versions known
+    to have no source are recorded too, so they are not requested again either.
+    The least recently used entries are evicted once the size cap is exceeded.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Open (or create) the cache
+
+        Args:
+            cache_dir: Cache directory (keep it outside the output directory)
+            max_bytes: Size cap for stored blobs
+        """
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.max_bytes = max_bytes
+        ensure_dir(self.blob_dir)
+
+        self.conn, self.lock = open_sqlite(os.path.join(cache_dir, "index.db"))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                versioned_id TEXT PRIMARY KEY,
+                sha256 TEXT,                -- NULL: version has no source
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+            CREATE INDEX IF NOT EXISTS entries_sha256 ON entries(sha256);
+        """)
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'missing_hits': 0,
+            'stores': 0,
+            'evictions': 0,
+            'bytes_served': 0,
+            'corrupt_entries': 0
+        }
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def _stored_bytes(self) -> int:
+        """Total size of distinct blobs (caller holds self.lock)"""
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM "
+            "(SELECT size FROM entries WHERE sha256 IS NOT NULL GROUP BY sha256)"
+        ).fetchone()
+        return row[0]
+
+    def fetch(self, versioned_id: str, dest_path: str) -> Optional[int]:
+        """
+        Place the cached archive of a version at dest_path
+
+        Args:
+            versioned_id: Versioned arXiv ID (e.g. "2311.14685v1")
+            dest_path: Where the caller expects the downloaded archive
+
+        Returns:
+            Archive size in bytes, or None on a miss
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT sha256, size FROM entries WHERE versioned_id = ? AND sha256 IS NOT NULL",
+                (versioned_id,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            sha256, size = row
+            blob_path = self._blob_path(sha256)
+            try:
+                if os.path.getsize(blob_path) != size:
+                    raise OSError("size mismatch")
+                link_or_copy(blob_path, dest_path)
+            except OSError as e:
+                # Blob removed or damaged outside the cache: forget it and download again
+                logger.warning(f"Dropping cache entry {versioned_id}: {e}")
+                self.conn.execute("DELETE FROM entries WHERE versioned_id = ?", (versioned_id,))
+                self.stats['corrupt_entries'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self.conn.execute("UPDATE entries SET last_used = ? WHERE versioned_id = ?",
+                              (time.time(), versioned_id))
+            self.stats['hits'] += 1
+            self.stats['bytes_served'] += size
+
+        logger.info(f"Source cache hit for {versioned_id} ({size / 1024:.1f} KB)")
+        return size
+
+    def is_missing(self, versioned_id: str) -> bool:
+        """True if the version is recorded as having no source"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM entries WHERE versioned_id = ? AND sha256 IS NULL", (versioned_id,)
+            ).fetchone()
+            if row is not None:
+                self.stats['missing_hits'] += 1
+        return row is not None
+
+    def store(self, versioned_id: str, path: str):
+        """
+        Add a freshly downloaded archive to the cache
+
+        Args:
+            versioned_id: Versioned arXiv ID
+            path: Downloaded archive (left in place)
+        """
+        try:
+            sha256 = sha256_file(path)
+            size = os.path.getsize(path)
+            blob_path = self._blob_path(sha256)
+            ensure_dir(os.path.dirname(blob_path))
+            if not os.path.exists(blob_path):
+                tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+                link_or_copy(path, tmp_path)
+                os.replace(tmp_path, blob_path)
+        except OSError as e:
+            logger.warning(f"Could not cache source of {versioned_id}: {e}")
+            return
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (versioned_id, sha256, size, last_used) VALUES (?, ?, ?, ?)",
+                (versioned_id, sha256, size, time.time())
+            )
+            self.stats['stores'] += 1
+            self._evict()
+
+    def store_missing(self, versioned_id: str):
+        """Record that a version has no source (PDF-only)"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (versioned_id, sha256, size, last_used) VALUES (?, NULL, 0, ?)",
+                (versioned_id, time.time())
+            )
+
+    def _evict(self):
+        """Drop least recently used entries until the cap is met (caller holds self.lock)"""
+        total = self._stored_bytes()
+        while total > self.max_bytes:
+            row = self.conn.execute(
+                "SELECT versioned_id, sha256, size FROM entries "
+                "WHERE sha256 IS NOT NULL ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            versioned_id, sha256, size = row
+            self.conn.execute("DELETE FROM entries WHERE versioned_id = ?", (versioned_id,))
+            self.stats['evictions'] += 1
+
+            # Blobs can be shared by several versions with identical archives
+            still_used = self.conn.execute(
+                "SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (sha256,)
+            ).fetchone()
+            if still_used is None:
+                try:
+                    os.remove(self._blob_path(sha256))
+                except OSError:
+                    pass
+                total -= size
+            logger.debug(f"Evicted {versioned_id} from source cache")
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+            stats['stored_bytes'] = self._stored_bytes()
+            stats['entries'] = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        stats['max_bytes'] = self.max_bytes
+        return stats
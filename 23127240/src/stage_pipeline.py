@@ -0,0 +1,263 @@
+"""
+Producer / consumer stages of the scraper: TeX extraction in a process pool and
+a single commit thread, fed through bounded queues
+"""
+
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, Dict, List, Optional
+
+from utils import extract_main_files
+from instrumentation import timer, record_sleep, percentiles
+
+logger = logging.getLogger(__name__)
+
+
+class DepthGauge:
+    """Current, maximum and time-averaged depth of a queue"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.max_depth = 0
+        self.area = 0.0   # depth integrated over time
+        self.started = self.last_change = time.perf_counter()
+
+    def change(self, delta: int):
+        with self.lock:
+            now = time.perf_counter()
+            self.area += self.depth * (now - self.last_change)
+            self.last_change = now
+            self.depth += delta
+            self.max_depth = max(self.max_depth, self.depth)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            now = time.perf_counter()
+            area = self.area + self.depth * (now - self.last_change)
+            elapsed = now - self.started
+            return {
+                'depth': self.depth,
+                'max_depth': self.max_depth,
+                'avg_depth': round(area / elapsed, 2) if elapsed > 0 else 0.0
+            }
+
+
+def _init_worker(level: int):
+    # Spawned workers start without the parent's logging setup
+    logging.basicConfig(level=level, format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+
+
+def _extract_in_worker(tar_path: str, version_dir: str,
+                       extra_environments: Optional[List[str]]):
+    """
+    Runs in a worker process: extract_main_files, the seconds it took and the
+    worker's span samples ('extract', 'figure_removal'), which the parent merges
+    into its own timer
+    """
+    timer.drain()   # leftovers of a task that raised
+    start = time.perf_counter()
+    result = extract_main_files(tar_path, version_dir, extra_environments)
+    return result, time.perf_counter() - start, timer.drain()
+
+
+class ExtractionPool:
+    """
+    extract_main_files (archive scan and figure-removal regexes) in worker processes.
+
+    Worker processes are not held by the GIL, so the regex passes over a large
+    paper overlap with downloads running in the paper threads. Archives enter a
+    bounded queue: submit() blocks the downloading thread while max_queued
+    archives are waiting or being extracted, so downloads cannot run
+    arbitrarily far ahead of extraction and the temp folders stay small. Time
+    spent blocked is reported as sleep ('extract_queue_full') to the stage timer.
+    """
+
+    def __init__(self, processes: int, max_queued: int):
+        """
+        Args:
+            processes: Worker processes
+            max_queued: Archives waiting for or in extraction before submit() blocks
+        """
+        self.processes = max(1, processes)
+        self.max_queued = max(self.processes, max_queued)
+        # spawn: forking a process that already runs threads (engine loop,
+        # sampler, paper workers) can deadlock the child
+        self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(logging.getLogger().getEffectiveLevel(),))
+        self.slots = threading.BoundedSemaphore(self.max_queued)
+        self.queue = DepthGauge()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.task_times: List[float] = []
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'busy_s': 0.0,
+            'blocked': 0,
+            'blocked_s': 0.0
+        }
+
+    def submit(self, tar_path: str, version_dir: str,
+               extra_environments: Optional[List[str]] = None) -> Future:
+        """
+        Queue one archive for extraction, blocking while the queue is full
+
+        Returns:
+            Future of the extract_main_files result (OversizedSourceError and
+            other worker exceptions are raised by result())
+        """
+        if not self.slots.acquire(blocking=False):
+            start = time.perf_counter()
+            self.slots.acquire()
+            blocked = time.perf_counter() - start
+            record_sleep('extract_queue_full', blocked)
+            with self.lock:
+                self.stats['blocked'] += 1
+                self.stats['blocked_s'] += blocked
+
+        self.queue.change(1)
+        with self.lock:
+            self.stats['submitted'] += 1
+        try:
+            task = self.executor.submit(_extract_in_worker, tar_path, version_dir, extra_environments)
+        except Exception:
+            self.queue.change(-1)
+            self.slots.release()
+            raise
+
+        result = Future()
+        task.add_done_callback(lambda task: self._finished(task, result))
+        return result
+
+    def _finished(self, task: Future, result: Future):
+        self.queue.change(-1)
+        self.slots.release()
+        try:
+            extract_stats, seconds, (samples, sleeps) = task.result()
+        except BaseException as e:
+            with self.lock:
+                self.stats['failed'] += 1
+            result.set_exception(e)
+            return
+        with self.lock:
+            self.stats['completed'] += 1
+            self.stats['busy_s'] += seconds
+            self.task_times.append(seconds)
+        timer.merge(samples, sleeps)
+        result.set_result(extract_stats)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+            task_times = list(self.task_times)
+        elapsed = time.perf_counter() - self.started
+        return {
+            'processes': self.processes,
+            'max_queued': self.max_queued,
+            **stats,
+            'busy_s': round(stats['busy_s'], 3),
+            'blocked_s': round(stats['blocked_s'], 3),
+            # Share of the worker processes' time spent extracting
+            'utilization': round(stats['busy_s'] / (elapsed * self.processes), 3) if elapsed > 0 else 0.0,
+            'queue': self.queue.get_stats(),
+            'task_s': percentiles(task_times)
+        }
+
+
+class CommitWriter:
+    """
+    Thread committing finished papers one at a time, in arrival order.
+
+    put() blocks while max_queued papers are waiting, which holds the paper
+    threads (and so the downloads) back when commits fall behind.
+    """
+
+    def __init__(self, commit: Callable, max_queued: int, name: str = "commit-writer"):
+        """
+        Args:
+            commit: Called with the arguments of each put() on the writer thread
+            max_queued: Papers waiting to be committed before put() blocks
+            name: Thread name
+        """
+        self.commit = commit
+        self.max_queued = max(1, max_queued)
+        self.queue = queue.Queue(maxsize=self.max_queued)
+        self.depth = DepthGauge()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.lock = threading.Lock()
+        self.started = None
+        self.stats = {
+            'committed': 0,
+            'errors': 0,
+            'busy_s': 0.0,
+            'blocked': 0,
+            'blocked_s': 0.0
+        }
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def put(self, *args):
+        """Hand one paper to the writer, blocking while the queue is full"""
+        try:
+            self.queue.put_nowait(args)
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put(args)
+            blocked = time.perf_counter() - start
+            record_sleep('commit_queue_full', blocked)
+            with self.lock:
+                self.stats['blocked'] += 1
+                self.stats['blocked_s'] += blocked
+        self.depth.change(1)
+
+    def _run(self):
+        while True:
+            args = self.queue.get()
+            if args is None:
+                break
+            self.depth.change(-1)
+            start = time.perf_counter()
+            outcome = 'committed'
+            try:
+                self.commit(*args)
+            except Exception as e:
+                logger.error(f"Commit failed: {e}")
+                outcome = 'errors'
+            with self.lock:
+                self.stats[outcome] += 1
+                self.stats['busy_s'] += time.perf_counter() - start
+
+    def close(self):
+        """Commit everything still queued and stop the thread"""
+        if self.started is None or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = self.stats.copy()
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        return {
+            'max_queued': self.max_queued,
+            **stats,
+            'busy_s': round(stats['busy_s'], 3),
+            'blocked_s': round(stats['blocked_s'], 3),
+            # Share of the writer thread's time spent committing (waiting for
+            # extraction included)
+            'utilization': round(stats['busy_s'] / elapsed, 3) if elapsed > 0 else 0.0,
+            'queue': self.depth.get_stats()
+        }
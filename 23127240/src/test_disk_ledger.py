@@ -0,0 +1,82 @@
+"""
+Offline tests of disk_ledger.py: bookkeeping files written into the output
+directory are reported to the ledger, so it agrees with a full walk
+
+Usage: python -m pytest test_disk_ledger.py
+"""
+
+import os
+import shutil
+
+from dedup import DedupIndex
+from disk_ledger import DiskLedger
+from resource_sampler import ResourceSampler
+from run_state import RunState, STATUS_COMMITTED
+from utils import get_directory_size, get_releasable_size
+
+
+def assert_matches_walk(ledger: DiskLedger, output_dir: str):
+    assert ledger.get_stats()['current_bytes'] == get_directory_size(output_dir)
+
+
+def test_run_state_database_and_wal(tmp_path):
+    output_dir = str(tmp_path)
+    ledger = DiskLedger(output_dir)
+    run_state = RunState(os.path.join(output_dir, "run_state.db"), disk_ledger=ledger)
+    assert_matches_walk(ledger, output_dir)
+
+    run_state.mark_many([f"2311.{index:05d}" for index in range(500)], STATUS_COMMITTED)
+    for index in range(50):
+        run_state.save_paper_detail({'arxiv_id': f"2311.{index:05d}", 'title': 'x' * 200})
+    assert_matches_walk(ledger, output_dir)
+
+    run_state.close()
+    assert_matches_walk(ledger, output_dir)
+
+
+def test_dedup_manifest(tmp_path):
+    output_dir = str(tmp_path)
+    for name in ('a.tex', 'b.tex'):
+        (tmp_path / name).write_text('same content')
+    ledger = DiskLedger(output_dir)
+    dedup = DedupIndex(output_dir, disk_ledger=ledger)
+
+    for name in ('a.tex', 'b.tex'):
+        ledger.add(-dedup.deduplicate(os.path.join(output_dir, name)))
+    assert dedup.get_stats()['files_deduplicated'] == 1
+    assert_matches_walk(ledger, output_dir)
+
+
+def test_resource_samples_and_tracemalloc_snapshots(tmp_path):
+    output_dir = str(tmp_path)
+    ledger = DiskLedger(output_dir)
+    sampler = ResourceSampler(os.path.join(output_dir, "resource_samples.csv"), 0.01,
+                              tracemalloc_path=os.path.join(output_dir, "tracemalloc_snapshots.jsonl"),
+                              tracemalloc_interval=0.0, disk_ledger=ledger)
+    sampler.start()
+    while sampler.get_stats()['snapshots'] < 3:
+        sampler.stop_event.wait(0.01)
+    sampler.stop()
+    assert_matches_walk(ledger, output_dir)
+
+
+def test_removing_a_folder_releases_only_unshared_files(tmp_path):
+    """A paper.tex hardlinked from another paper is still stored after its folder is deleted"""
+    output_dir = str(tmp_path)
+    for paper in ('a', 'b', 'c'):
+        os.makedirs(os.path.join(output_dir, paper))
+    (tmp_path / 'a' / 'paper.tex').write_text('x' * 1000)
+    os.link(tmp_path / 'a' / 'paper.tex', tmp_path / 'b' / 'paper.tex')
+    (tmp_path / 'b' / 'references.bib').write_text('y' * 300)
+    (tmp_path / 'c' / 'paper.tex').write_text('z' * 200)
+    os.link(tmp_path / 'c' / 'paper.tex', tmp_path / 'c' / 'copy.tex')
+    ledger = DiskLedger(output_dir)
+
+    assert get_releasable_size(os.path.join(output_dir, 'b')) == 300
+    assert get_releasable_size(os.path.join(output_dir, 'c')) == 200
+    assert get_releasable_size(os.path.join(output_dir, 'a'), os.path.join(output_dir, 'b')) == 1300
+    for paper in ('b', 'c'):
+        paper_dir = os.path.join(output_dir, paper)
+        ledger.add(-get_releasable_size(paper_dir))
+        shutil.rmtree(paper_dir)
+        assert_matches_walk(ledger, output_dir)
@@ -0,0 +1,72 @@
+"""
+Offline tests of export_corpus.py (incremental corpus export)
+
+Usage: python -m pytest test_export_corpus.py
+"""
+
+import os
+import json
+import time
+
+from export_corpus import CorpusExporter, iter_jsonl, pq
+from shard_store import ShardStore
+
+
+def write_paper(data_dir: str, arxiv_id: str, references: dict):
+    paper_dir = os.path.join(data_dir, arxiv_id.replace('.', '-'))
+    os.makedirs(paper_dir, exist_ok=True)
+    with open(os.path.join(paper_dir, "metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump({'title': f"Paper {arxiv_id}"}, f)
+    path = os.path.join(paper_dir, "references.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(references, f)
+    return path
+
+
+def references(*keys: str) -> dict:
+    return {key: {'title': f"Cited {key}"} for key in keys}
+
+
+def table_rows(export_dir: str, table: str, key: str):
+    jsonl = sorted((row[key], row.get('target_id')) for row in iter_jsonl(os.path.join(export_dir, f"{table}.jsonl.gz")))
+    if pq is not None:  # parquet parts hold the same rows
+        parquet = pq.read_table(os.path.join(export_dir, table)).to_pylist()
+        assert sorted((row[key], row.get('target_id')) for row in parquet) == jsonl
+    return jsonl
+
+
+def test_changed_references_are_exported_again(tmp_path):
+    data_dir, export_dir = str(tmp_path / "data"), str(tmp_path / "export")
+    write_paper(data_dir, '2311.00001', references('2001-00001'))
+    changed_path = write_paper(data_dir, '2311.00002', {})
+    assert CorpusExporter(data_dir, export_dir).export() == {'new_papers': 2, 'updated_papers': 0, 'new_edges': 1}
+    assert CorpusExporter(data_dir, export_dir).export()['new_papers'] == 0
+
+    # Retried references: new content and a later modification time
+    write_paper(data_dir, '2311.00002', references('2001-00002', '2001-00003'))
+    os.utime(changed_path, (time.time() + 10, time.time() + 10))
+    result = CorpusExporter(data_dir, export_dir).export()
+
+    assert result == {'new_papers': 0, 'updated_papers': 1, 'new_edges': 2}
+    assert table_rows(export_dir, 'metadata', 'arxiv_id') == [('2311.00001', None), ('2311.00002', None)]
+    assert table_rows(export_dir, 'references', 'source_id') == [
+        ('2311.00001', '2001.00001'), ('2311.00002', '2001.00002'), ('2311.00002', '2001.00003')]
+    with open(os.path.join(export_dir, "export_state.json"), encoding='utf-8') as f:
+        state = json.load(f)
+    assert (state['papers'], state['edges']) == (2, 3)
+
+
+def test_packing_keeps_the_version_and_shard_rewrites_change_it(tmp_path):
+    data_dir, export_dir = str(tmp_path / "data"), str(tmp_path / "export")
+    path = write_paper(data_dir, '2311.00001', {})
+    mtime = int(time.time()) // 2 * 2 - 10  # whole even seconds, as zip entries store them
+    os.utime(path, (mtime, mtime))
+    CorpusExporter(data_dir, export_dir).export()
+
+    store = ShardStore(data_dir)
+    store.pack_papers(['2311.00001'])
+    assert CorpusExporter(data_dir, export_dir).export()['updated_papers'] == 0
+
+    store.write("2311-00001/references.json", json.dumps(references('2001-00001')).encode('utf-8'))
+    assert CorpusExporter(data_dir, export_dir).export() == {'new_papers': 0, 'updated_papers': 1, 'new_edges': 1}
+    assert table_rows(export_dir, 'references', 'source_id') == [('2311.00001', '2001.00001')]
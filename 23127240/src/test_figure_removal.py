@@ -0,0 +1,64 @@
+"""
+Offline tests of the single-pass figure removal (utils.remove_figures_from_tex)
+
+Usage: python -m pytest test_figure_removal.py
+"""
+
+import re
+import random
+
+from utils import remove_figures_from_tex
+
+
+def remove_figures_regex(tex_content: str) -> str:
+    """remove_figures_from_tex as it was before the single-pass rewrite"""
+    tex_content = re.sub(r'\\includegraphics(\[.*?\])?\{.*?\}', r'% Figure removed', tex_content)
+    tex_content = re.sub(r'\\begin\{figure\}.*?\\end\{figure\}', r'% Figure environment removed',
+                         tex_content, flags=re.DOTALL)
+    return re.sub(r'\\begin\{figure\*\}.*?\\end\{figure\*\}', r'% Figure environment removed',
+                  tex_content, flags=re.DOTALL)
+
+
+TEX_PIECES = [
+    'Some text. ', '\n', '\\section{Intro}\n', '$x^2$ ', '\\cite{ref} ', '{\\bf bold} ',
+    '\\includegraphics{plot.pdf}', '\\includegraphics[width=0.5\\linewidth]{fig/a.png}',
+    '\\begin{table}\\centering a & b\\end{table}\n'
+]
+
+
+def random_document(rng: random.Random) -> str:
+    """Well-formed TeX body: text, \\includegraphics and non-nested figure / figure* environments"""
+    parts = []
+    for _ in range(rng.randint(0, 12)):
+        if rng.random() < 0.25:
+            env = rng.choice(['figure', 'figure*'])
+            body = ''.join(rng.choice(TEX_PIECES) for _ in range(rng.randint(0, 4)))
+            parts.append(f"\\begin{{{env}}}[t]\n{body}\\caption{{A}}\n\\end{{{env}}}\n")
+        else:
+            parts.append(rng.choice(TEX_PIECES))
+    return ''.join(parts)
+
+
+def test_matches_regex_on_well_formed_tex():
+    """Same output as the three regex passes it replaces"""
+    rng = random.Random(0)
+    for _ in range(2000):
+        tex = random_document(rng)
+        assert remove_figures_from_tex(tex) == remove_figures_regex(tex), tex
+
+
+def test_extra_environments_and_comments():
+    """Extra environments are removed; commented-out figures are left alone"""
+    tex = ("a\\begin{wrapfigure}{r}{3cm}x\\end{wrapfigure}b\n"
+           "% \\begin{figure} not a real figure\n"
+           "c\\begin{figure}y\\end{figure}d")
+    assert remove_figures_from_tex(tex, ['wrapfigure']) == (
+        "a% Figure environment removedb\n"
+        "% \\begin{figure} not a real figure\n"
+        "c% Figure environment removedd")
+
+
+def test_unterminated_environment_is_kept():
+    """A \\begin{figure} without \\end is left as it is"""
+    tex = "text \\begin{figure} never closed \\includegraphics{a.png}"
+    assert remove_figures_from_tex(tex) == "text \\begin{figure} never closed % Figure removed"
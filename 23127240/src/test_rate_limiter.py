@@ -0,0 +1,113 @@
+"""
+Offline tests of rate_limiter.py (Retry-After parsing, AIMD token bucket)
+
+Usage: python -m pytest test_rate_limiter.py
+"""
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import reference_scraper
+import reference_scraper_optimized
+from rate_limiter import AdaptiveTokenBucket, parse_retry_after
+from reference_scraper import ReferenceScraper
+from reference_scraper_optimized import OptimizedReferenceScraper
+
+
+def test_parse_retry_after_seconds():
+    """Retry-After as delay-seconds"""
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after(" 1.5 ") == 1.5
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+
+
+def test_parse_retry_after_http_date():
+    """Retry-After as an HTTP-date, relative to now"""
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    seconds = parse_retry_after(format_datetime(retry_at, usegmt=True))
+    # The header has 1-second resolution
+    assert 28.0 <= seconds <= 30.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_adaptive_bucket_aimd():
+    """Successes add to the rate, a 429 halves it once per burst and pauses the bucket"""
+    bucket = AdaptiveTokenBucket(rate=1.0, min_rate=0.1, max_rate=2.0, increase=0.5, decrease=0.5)
+    bucket.on_success()
+    assert bucket.rate == 1.5
+    bucket.on_success()
+    bucket.on_success()
+    assert bucket.rate == 2.0
+
+    assert bucket.on_throttle(retry_after=5.0) > 4.0
+    assert bucket.rate == 1.0
+    # Same burst: the bucket is already paused, the rate is not lowered again
+    bucket.on_throttle(retry_after=1.0)
+    assert bucket.rate == 1.0
+    assert bucket.get_stats()['rate_decreases'] == 1
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None):
+        self.status_code = status_code
+        self.body = body
+        self.text = ''
+        self.headers = {}
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Answers GET and POST with the queued responses, in order"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def get(self, url, params=None, timeout=None):
+        return self.responses.pop(0)
+
+    def post(self, url, params=None, json=None, timeout=None):
+        return self.responses.pop(0)
+
+
+def fast_bucket() -> AdaptiveTokenBucket:
+    return AdaptiveTokenBucket(rate=1000.0, min_rate=1.0, max_rate=2000.0,
+                               increase=1.0, decrease=0.5, capacity=1000.0)
+
+
+@pytest.fixture
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(reference_scraper, 'RETRY_DELAY', 0.0)
+    monkeypatch.setattr(reference_scraper_optimized, 'RETRY_DELAY', 0.0)
+
+
+def test_server_errors_do_not_raise_the_rate(no_retry_delay):
+    """Only 200 and 404 answers count as successes for the AIMD rate"""
+    scraper = ReferenceScraper()
+    scraper.limiter = fast_bucket()
+    scraper.session = FakeSession([FakeResponse(503), FakeResponse(500), FakeResponse(200, {'references': []})])
+    assert scraper.get_paper_references('2311.00001') == []
+    assert scraper.limiter.get_stats()['successes'] == 1
+
+    scraper.session = FakeSession([FakeResponse(502), FakeResponse(404)])
+    assert scraper.get_paper_references('2311.00002') is None
+    assert scraper.limiter.get_stats()['successes'] == 2
+
+
+def test_failed_batches_do_not_raise_the_rate(no_retry_delay):
+    """Same rule for /paper/batch: a 500 leaves the rate alone, a 200 raises it"""
+    scraper = OptimizedReferenceScraper(batch_size=10)
+    scraper.limiter = fast_bucket()
+    scraper.session = FakeSession([FakeResponse(500)] * 3)
+    assert scraper.get_papers_batch(['2311.00001']) == {}
+    assert scraper.limiter.rate == 1000.0
+
+    scraper.session = FakeSession([FakeResponse(200, [{'references': []}])])
+    assert scraper.get_papers_batch(['2311.00001']) == {'2311.00001': []}
+    assert scraper.limiter.rate == 1001.0
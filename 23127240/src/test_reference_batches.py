@@ -0,0 +1,122 @@
+"""
+Offline tests of the batched Semantic Scholar lookups
+(OptimizedReferenceScraper.get_papers_batch) against an in-memory /paper/batch
+
+Usage: python -m pytest test_reference_batches.py
+"""
+
+import json
+
+import pytest
+
+import reference_scraper_optimized
+from rate_limiter import AdaptiveTokenBucket
+from reference_scraper_optimized import OptimizedReferenceScraper
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.text = json.dumps(body)
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeBatchSession:
+    """
+    /paper/batch stand-in: HTTP 400 above max_ids IDs, HTTP 500 for batches
+    containing a poisoned ID, HTTP 429 for the first `throttles` requests
+    """
+
+    def __init__(self, max_ids: int = 500, poisoned=(), throttles: int = 0):
+        self.max_ids = max_ids
+        self.poisoned = set(poisoned)
+        self.throttles = throttles
+        self.batch_sizes = []
+
+    @staticmethod
+    def paper(arxiv_id: str):
+        # Every seventh paper is unknown to Semantic Scholar
+        if int(arxiv_id.split('.')[1]) % 7 == 0:
+            return None
+        return {'paperId': arxiv_id, 'references': [{'externalIds': {'ArXiv': '2001.00001'}}]}
+
+    def post(self, url, params=None, json=None, timeout=None):
+        arxiv_ids = [paper_id.split(':', 1)[1] for paper_id in json['ids']]
+        self.batch_sizes.append(len(arxiv_ids))
+        if self.throttles > 0:
+            self.throttles -= 1
+            return FakeResponse(429, {'message': 'Too Many Requests'}, {'Retry-After': '0'})
+        if len(arxiv_ids) > self.max_ids:
+            return FakeResponse(400, {'error': f"Batch size {len(arxiv_ids)} exceeds {self.max_ids} ids"})
+        if self.poisoned & set(arxiv_ids):
+            return FakeResponse(500, {'error': 'Internal error'})
+        return FakeResponse(200, [self.paper(arxiv_id) for arxiv_id in arxiv_ids])
+
+
+def make_scraper(session: FakeBatchSession, batch_size: int) -> OptimizedReferenceScraper:
+    scraper = OptimizedReferenceScraper(batch_size=batch_size)
+    scraper.session = session
+    # Own fast limiter: the shared Semantic Scholar one paces at about 1 request/s
+    scraper.limiter = AdaptiveTokenBucket(rate=1000.0, min_rate=100.0, max_rate=1000.0,
+                                          increase=0.0, decrease=0.5, capacity=1000.0)
+    return scraper
+
+
+def arxiv_ids(count: int):
+    return [f"2311.{i:05d}" for i in range(1, count + 1)]
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(reference_scraper_optimized, 'RETRY_DELAY', 0.0)
+
+
+def test_rejected_batch_is_bisected():
+    """A batch refused as too large is split (and the batch size shrunk) until every ID is answered"""
+    session = FakeBatchSession(max_ids=500)
+    scraper = make_scraper(session, batch_size=600)
+    ids = arxiv_ids(600)
+
+    results = scraper.get_papers_batch(ids)
+
+    for arxiv_id in ids:
+        paper = session.paper(arxiv_id)
+        assert results[arxiv_id] == (paper['references'] if paper is not None else None)
+    assert session.batch_sizes[0] == 600
+    assert max(session.batch_sizes[1:]) <= 500
+    stats = scraper.get_stats()
+    assert stats['bisections'] >= 1
+    assert stats['batch_size_decreases'] >= 1
+    assert stats['failed_ids'] == 0
+
+
+def test_failing_id_is_isolated():
+    """Bisection narrows a failing batch down to the one bad ID; the others are answered"""
+    session = FakeBatchSession(poisoned={"2311.00013"})
+    scraper = make_scraper(session, batch_size=40)
+    ids = arxiv_ids(40)
+
+    results = scraper.get_papers_batch(ids)
+
+    assert set(results) == set(ids) - {"2311.00013"}
+    assert scraper.get_stats()['failed_ids'] == 1
+
+
+def test_throttled_batch_is_requeued_whole():
+    """A 429 sends the same batch again: no split, no failure"""
+    session = FakeBatchSession(throttles=2)
+    scraper = make_scraper(session, batch_size=40)
+    ids = arxiv_ids(40)
+
+    results = scraper.get_papers_batch(ids)
+
+    assert set(results) == set(ids)
+    assert session.batch_sizes == [40, 40, 40]
+    stats = scraper.get_stats()
+    assert stats['throttled_batches'] == 2
+    assert stats['bisections'] == 0
+    assert stats['failed_ids'] == 0
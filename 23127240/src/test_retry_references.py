@@ -0,0 +1,54 @@
+"""
+Offline tests of retry_references.py on folders and shards
+
+Usage: python -m pytest test_retry_references.py
+"""
+
+import os
+import json
+
+from retry_references import find_empty_references, retry_references
+from shard_store import ShardStore
+
+REFERENCES = {'2001.00001': {'title': 'Cited paper'}}
+
+
+class FakeScraper:
+    """Writes the same references for every paper, like scrape_references_batch"""
+
+    def __init__(self):
+        self.requested = []
+
+    def scrape_references_batch(self, papers):
+        self.requested.extend(papers)
+        for path in papers.values():
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(REFERENCES, f)
+        return dict.fromkeys(papers, True)
+
+
+def write_paper(data_dir, folder: str, references):
+    os.makedirs(os.path.join(data_dir, folder))
+    with open(os.path.join(data_dir, folder, "references.json"), 'w', encoding='utf-8') as f:
+        json.dump(references, f)
+
+
+def test_packed_papers_are_found_and_rewritten_in_their_shard(tmp_path):
+    data_dir = str(tmp_path)
+    write_paper(data_dir, "2311-00001", {})
+    write_paper(data_dir, "2311-00002", REFERENCES)
+    ShardStore(data_dir).pack_papers(['2311.00001', '2311.00002'])
+    write_paper(data_dir, "2311-00003", {})
+
+    empty = find_empty_references(data_dir)
+    assert empty == ["2311-00001", "2311-00003"]
+
+    scraper = FakeScraper()
+    results = retry_references(empty, data_dir, scraper)
+
+    assert results == {'2311.00001': True, '2311.00003': True}
+    assert not os.path.exists(os.path.join(data_dir, "2311-00001"))
+    assert ShardStore(data_dir).read_json("2311-00001/references.json") == REFERENCES
+    with open(os.path.join(data_dir, "2311-00003", "references.json"), encoding='utf-8') as f:
+        assert json.load(f) == REFERENCES
+    assert find_empty_references(data_dir) == []
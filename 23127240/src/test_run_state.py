@@ -0,0 +1,69 @@
+"""
+Offline tests of run_state.py (SQLite run state store)
+
+Usage: python -m pytest test_run_state.py
+"""
+
+import os
+import csv
+import json
+import tempfile
+
+from run_state import RunState, STATUS_COMMITTED
+from shard_store import ShardStore
+from backfill_paper_details import FIELDNAMES
+
+
+def detail_row(index: int, **fields) -> dict:
+    row = dict.fromkeys(FIELDNAMES, 0)
+    row.update(paper_id=index, arxiv_id=f"2311.{index:05d}", title='Title', authors='A. Author',
+               processed_at='2026-01-01 00:00:00')
+    row.update(fields)
+    return row
+
+
+def append_csv(path: str, rows):
+    write_header = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_backfilled_csv_rows_are_merged_on_every_start():
+    """Rows appended to paper_details.csv after the first run reach the store; store rows win"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        csv_path = os.path.join(output_dir, "paper_details.csv")
+        append_csv(csv_path, [detail_row(1)])
+
+        run_state = RunState(os.path.join(output_dir, "run_state.db"))
+        run_state.ensure_initialized(output_dir, csv_path)
+        run_state.save_paper_detail(detail_row(2, runtime_s=5.0))
+
+        # backfill_paper_details.py appends a new paper and a copy of a known one
+        append_csv(csv_path, [detail_row(3), detail_row(2, runtime_s=0.0)])
+        run_state.ensure_initialized(output_dir, csv_path)
+
+        rows = run_state.load_paper_details()
+        assert [row['arxiv_id'] for row in rows] == ['2311.00001', '2311.00002', '2311.00003']
+        assert rows[1]['runtime_s'] == 5.0
+        assert run_state.merge_details_csv(csv_path) == 0
+        run_state.close()
+
+
+def test_rebuild_from_tree_counts_packed_papers():
+    """Papers only present in shards are committed after a rebuild"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name in ("2311-00001", "2311-00002"):
+            paper_dir = os.path.join(output_dir, name)
+            os.makedirs(paper_dir)
+            for filename in ("metadata.json", "references.json"):
+                with open(os.path.join(paper_dir, filename), 'w', encoding='utf-8') as f:
+                    json.dump({}, f)
+        ShardStore(output_dir).pack_papers(["2311.00001"])
+
+        run_state = RunState(os.path.join(output_dir, "run_state.db"))
+        run_state.rebuild_from_tree(output_dir)
+        assert run_state.get_ids([STATUS_COMMITTED]) == {"2311.00001", "2311.00002"}
+        run_state.close()
@@ -0,0 +1,135 @@
+"""
+Offline tests of s2_cache.py (Semantic Scholar response cache)
+
+Usage: python -m pytest test_s2_cache.py
+"""
+
+import os
+import tempfile
+
+from config import SEMANTIC_SCHOLAR_FIELDS
+from s2_cache import S2ResponseCache, DAY_SECONDS
+from reference_scraper_optimized import OptimizedReferenceScraper
+
+FIELDS = "references.externalIds,references.title"
+REFERENCES = [{'externalIds': {'ArXiv': '2001.00001'}, 'title': 'Cited paper'}]
+
+
+def open_test_cache(directory: str) -> S2ResponseCache:
+    return S2ResponseCache(os.path.join(directory, "s2.db"), ttl_days=30, negative_ttl_days=7)
+
+
+def age_entry(cache: S2ResponseCache, arxiv_id: str, days: float):
+    """Pretend the entry was fetched `days` days earlier"""
+    cache.conn.execute("UPDATE responses SET fetched_at = fetched_at - ? WHERE key = ?",
+                       (days * DAY_SECONDS, cache.key(arxiv_id, FIELDS)))
+
+
+def test_round_trip_and_counters():
+    """Reference lists and not-found answers come back; hits, negative hits and misses are counted"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = open_test_cache(directory)
+        cache.put_many({'2311.00001': REFERENCES, '2311.00002': None}, FIELDS)
+
+        cached = cache.get_many(['2311.00001', '2311.00002', '2311.00003'], FIELDS)
+
+        assert cached == {'2311.00001': REFERENCES, '2311.00002': None}
+        stats = cache.get_stats()
+        assert (stats['hits'], stats['negative_hits'], stats['misses']) == (1, 1, 1)
+        assert stats['stores'] == 2
+        assert stats['entries'] == 2
+        # Another field set is another key
+        assert cache.get_many(['2311.00001'], "references.title") == {}
+        cache.close()
+
+
+def test_entries_expire_after_their_ttl():
+    """Reference lists live ttl_days, not-found answers only negative_ttl_days"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = open_test_cache(directory)
+        cache.put_many({'2311.00001': REFERENCES, '2311.00002': None,
+                        '2311.00003': REFERENCES}, FIELDS)
+        age_entry(cache, '2311.00001', 10)   # within the 30-day TTL
+        age_entry(cache, '2311.00002', 10)   # past the 7-day negative TTL
+        age_entry(cache, '2311.00003', 31)   # past the 30-day TTL
+
+        cached = cache.get_many(['2311.00001', '2311.00002', '2311.00003'], FIELDS)
+
+        assert cached == {'2311.00001': REFERENCES}
+        stats = cache.get_stats()
+        assert stats['expired'] == 2
+        assert stats['misses'] == 2
+
+        # A fresh answer replaces the expired entry
+        cache.put_many({'2311.00003': []}, FIELDS)
+        assert cache.get_many(['2311.00003'], FIELDS) == {'2311.00003': []}
+        cache.close()
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeBatchSession:
+    """/paper/batch stand-in recording the requested IDs; 2311.00002 is unknown"""
+
+    def __init__(self):
+        self.requested = []
+
+    def post(self, url, params=None, json=None, timeout=None):
+        arxiv_ids = [paper_id.split(':', 1)[1] for paper_id in json['ids']]
+        self.requested.append(arxiv_ids)
+        return FakeResponse([None if arxiv_id == '2311.00002' else {'references': REFERENCES}
+                             for arxiv_id in arxiv_ids])
+
+
+def test_scraper_serves_cached_answers():
+    """Cached IDs (found or not) are not requested again and count as cache hits"""
+    ids = ['2311.00001', '2311.00002']
+    with tempfile.TemporaryDirectory() as directory:
+        cache = open_test_cache(directory)
+        session = FakeBatchSession()
+
+        scraper = OptimizedReferenceScraper(batch_size=10, cache=cache)
+        scraper.session = session
+        first = scraper.get_papers_batch(ids)
+        assert session.requested == [ids]
+        assert scraper.get_stats()['cache_misses'] == 2
+
+        scraper.session = FakeBatchSession()
+        second = scraper.get_papers_batch(ids + ['2311.00003'])
+        assert scraper.session.requested == [['2311.00003']]
+        assert first == {'2311.00001': REFERENCES, '2311.00002': None}
+        assert {arxiv_id: second[arxiv_id] for arxiv_id in ids} == first
+        stats = scraper.get_stats()
+        assert stats['cache_hits'] == 2
+        assert stats['cache_misses'] == 3
+        cache.close()
+
+
+def test_read_cache_false_requests_everything_and_refreshes():
+    """retry_references mode: cached answers are ignored, fresh ones overwrite them"""
+    ids = ['2311.00001', '2311.00002']
+    with tempfile.TemporaryDirectory() as directory:
+        cache = open_test_cache(directory)
+        # Stale answers: both papers cached as not found
+        cache.put_many({arxiv_id: None for arxiv_id in ids}, SEMANTIC_SCHOLAR_FIELDS)
+
+        scraper = OptimizedReferenceScraper(batch_size=10, cache=cache, read_cache=False)
+        scraper.session = FakeBatchSession()
+        results = scraper.get_papers_batch(ids)
+
+        assert scraper.session.requested == [ids]
+        assert results == {'2311.00001': REFERENCES, '2311.00002': None}
+        stats = scraper.get_stats()
+        assert stats['cache_hits'] == 0
+        assert stats['batch_requests'] == 1
+        assert cache.get_many(ids, SEMANTIC_SCHOLAR_FIELDS) == results
+        cache.close()
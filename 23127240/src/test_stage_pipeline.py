@@ -0,0 +1,51 @@
+"""
+Offline tests of the extraction process pool (stage_pipeline.ExtractionPool)
+
+Usage: python -m pytest test_stage_pipeline.py
+"""
+
+import io
+import os
+import tarfile
+
+from instrumentation import get_stage_stats
+from stage_pipeline import ExtractionPool
+
+PAPER_TEX = b"""\\documentclass{article}
+\\begin{document}
+Text.
+\\begin{figure}\\includegraphics{plot.pdf}\\end{figure}
+\\end{document}
+"""
+
+
+def write_archive(path: str):
+    with tarfile.open(path, 'w:gz') as tar:
+        member = tarfile.TarInfo('main.tex')
+        member.size = len(PAPER_TEX)
+        tar.addfile(member, io.BytesIO(PAPER_TEX))
+
+
+def stage_count(stage: str) -> int:
+    return get_stage_stats()['stages'].get(stage, {}).get('count', 0)
+
+
+def test_worker_spans_reach_the_parent_timer(tmp_path):
+    """'extract' and 'figure_removal' run in the worker but show up in the parent's stage stats"""
+    tar_path = str(tmp_path / 'source.tar.gz')
+    version_dir = str(tmp_path / 'v1')
+    os.makedirs(version_dir)
+    write_archive(tar_path)
+    extract_before, figures_before = stage_count('extract'), stage_count('figure_removal')
+
+    pool = ExtractionPool(processes=1, max_queued=1)
+    try:
+        stats = pool.submit(tar_path, version_dir).result(timeout=60)
+    finally:
+        pool.close()
+
+    assert stats['kept_tex'] == 1
+    with open(os.path.join(version_dir, 'paper.tex')) as f:
+        assert 'plot.pdf' not in f.read()
+    assert stage_count('extract') == extract_before + 1
+    assert stage_count('figure_removal') == figures_before + 1
@@ -4,16 +4,67 @@ Utility functions for arXiv scraper
 
 import os
 import re
+import json
 import tarfile
 import gzip
 import shutil
+import sqlite3
 import logging
+import threading
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+from config import MAX_COMPRESSION_RATIO, MAX_EXTRACTED_SIZE, MAX_MEMBER_SIZE
+from instrumentation import timed
 
 logger = logging.getLogger(__name__)
 
 
+class OversizedSourceError(Exception):
+    """A source is larger than the configured limits (download size or decompressed size)"""
+
+
+def decompression_budget(compressed_size: int) -> int:
+    """
+    Bytes an archive may expand to before it is treated as a decompression bomb
+    
+    Args:
+        compressed_size: Size of the downloaded archive in bytes
+    
+    Returns:
+        MAX_COMPRESSION_RATIO times the archive size, at least MAX_MEMBER_SIZE
+        (a small source of repetitive text compresses very well) and at most
+        MAX_EXTRACTED_SIZE
+    """
+    return min(MAX_EXTRACTED_SIZE, max(MAX_MEMBER_SIZE, compressed_size * MAX_COMPRESSION_RATIO))
+
+
+def _bounded_members(tar: tarfile.TarFile, tar_path: str, stats: Optional[Dict[str, int]] = None):
+    """
+    Iterate over archive members, enforcing the decompression budget
+    
+    The size of each member is known from its header before its data is
+    decompressed, so the archive is rejected before a bomb is expanded.
+    Members larger than MAX_MEMBER_SIZE are skipped (never read into memory).
+    
+    Raises:
+        OversizedSourceError: If the members add up to more than the budget
+    """
+    budget = decompression_budget(os.path.getsize(tar_path))
+    expanded = 0
+    for member in tar:
+        expanded += member.size
+        if expanded > budget:
+            raise OversizedSourceError(f"{tar_path} expands to more than {budget} bytes")
+        if member.isfile() and member.size > MAX_MEMBER_SIZE:
+            logger.warning(f"Skipping {member.name} in {tar_path}: {member.size} bytes "
+                           f"(limit {MAX_MEMBER_SIZE})")
+            if stats is not None:
+                stats['oversized_skipped'] += 1
+            continue
+        yield member
+
+
 def setup_logging(log_dir: str = "./logs"):
     """Setup logging configuration"""
     os.makedirs(log_dir, exist_ok=True)
@@ -56,6 +107,20 @@ def format_folder_name(arxiv_id: str) -> str:
     return arxiv_id.replace(".", "-")
 
 
+def reference_key_to_arxiv_id(key: str) -> str:
+    """
+    Convert a references.json key back to an arXiv ID
+    
+    Args:
+        key: Key written by extract_arxiv_references (e.g., "2101-00001" or "hep-th/9901001")
+    
+    Returns:
+        arXiv ID (e.g., "2101.00001"); old-style IDs are returned unchanged
+    """
+    return key.replace('-', '.') if re.match(r'^\d{4}-\d{4,5}$', key) else key
+
+
+@timed('extract')
 def extract_tar_gz(tar_path: str, extract_dir: str) -> bool:
     """
     Extract .tar.gz file or handle gzip-compressed LaTeX source
@@ -66,6 +131,9 @@ def extract_tar_gz(tar_path: str, extract_dir: str) -> bool:
     
     Returns:
         True if successful, False otherwise
+    
+    Raises:
+        OversizedSourceError: If the source expands past decompression_budget()
     """
     if not os.path.exists(tar_path):
         logger.error(f"Failed to extract {tar_path}: file does not exist")
@@ -74,14 +142,19 @@ def extract_tar_gz(tar_path: str, extract_dir: str) -> bool:
     # Try to extract as tar.gz first
     try:
         with tarfile.open(tar_path, 'r:*') as tar:
-            tar.extractall(path=extract_dir)
+            members = list(_bounded_members(tar, tar_path))
+            tar.extractall(path=extract_dir, members=members)
         logger.info(f"Extracted {tar_path} to {extract_dir}")
         return True
+    except OversizedSourceError:
+        raise
     except (tarfile.TarError, tarfile.ReadError):
         # If tar extraction fails, try as gzip-compressed LaTeX source
         try:
             with gzip.open(tar_path, 'rb') as gz_file:
-                content = gz_file.read()
+                content = gz_file.read(MAX_MEMBER_SIZE + 1)
+            if len(content) > MAX_MEMBER_SIZE:
+                raise OversizedSourceError(f"{tar_path} expands to more than {MAX_MEMBER_SIZE} bytes")
             
             # Check if it's LaTeX source (starts with \documentclass or similar)
             if content.startswith(b'\\') or b'\\documentclass' in content[:1000]:
@@ -99,9 +172,13 @@ def extract_tar_gz(tar_path: str, extract_dir: str) -> bool:
             else:
                 logger.error(f"Failed to extract {tar_path}: not a valid tar archive or LaTeX source")
                 return False
+        except OversizedSourceError:
+            raise
         except (gzip.BadGzipFile, OSError) as gz_error:
             # File is not gzipped, try reading as plain text/LaTeX
             try:
+                if os.path.getsize(tar_path) > MAX_MEMBER_SIZE:
+                    raise OversizedSourceError(f"{tar_path} is larger than {MAX_MEMBER_SIZE} bytes")
                 with open(tar_path, 'rb') as f:
                     content = f.read()
                 
@@ -121,6 +198,8 @@ def extract_tar_gz(tar_path: str, extract_dir: str) -> bool:
                 else:
                     logger.error(f"Failed to extract {tar_path}: not a valid archive or LaTeX source (got: {content[:20]})")
                     return False
+            except OversizedSourceError:
+                raise
             except Exception as e:
                 logger.error(f"Failed to extract {tar_path}: {e}")
                 return False
@@ -132,42 +211,305 @@ def extract_tar_gz(tar_path: str, extract_dir: str) -> bool:
         return False
 
 
-def remove_figures_from_tex(tex_content: str) -> str:
+def _looks_like_latex(content: bytes) -> bool:
+    """Heuristic used for sources that are not tar archives"""
+    return content.startswith(b'\\') or b'\\documentclass' in content[:1000] or b'%' in content[:100]
+
+
+def _read_single_file_source(tar_path: str) -> Optional[bytes]:
     """
-    Remove figure environments and includegraphics commands from TeX content
+    Read a source that is a single (optionally gzip-compressed) LaTeX file
     
     Args:
-        tex_content: Original TeX file content
+        tar_path: Path to downloaded source
     
     Returns:
-        TeX content with figures removed
+        File content, or None if it does not look like LaTeX
+    
+    Raises:
+        OversizedSourceError: If the (decompressed) file is larger than MAX_MEMBER_SIZE
     """
-    # Remove \includegraphics commands
-    tex_content = re.sub(
-        r'\\includegraphics(\[.*?\])?\{.*?\}',
-        r'% Figure removed',
-        tex_content
-    )
+    # Read one byte past the limit instead of the whole stream, so a gzip bomb
+    # is detected without being expanded in memory
+    try:
+        with gzip.open(tar_path, 'rb') as gz_file:
+            content = gz_file.read(MAX_MEMBER_SIZE + 1)
+    except (gzip.BadGzipFile, OSError):
+        # File is not gzipped, try reading as plain text/LaTeX
+        with open(tar_path, 'rb') as f:
+            content = f.read(MAX_MEMBER_SIZE + 1)
+    
+    if len(content) > MAX_MEMBER_SIZE:
+        raise OversizedSourceError(f"{tar_path} expands to more than {MAX_MEMBER_SIZE} bytes")
+    if _looks_like_latex(content):
+        return content
+    logger.error(f"Failed to extract {tar_path}: not a valid archive or LaTeX source (got: {content[:20]})")
+    return None
+
+
+def _unlink_existing(path: str):
+    """Remove a file before rewriting it, so a hardlinked copy elsewhere is not changed"""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@timed('extract')
+def extract_main_files(tar_path: str, version_dir: str,
+                       extra_environments: Optional[List[str]] = None) -> Optional[Dict[str, int]]:
+    """
+    Single-pass replacement for extract_tar_gz + process_tex_files + clean_version_folder
     
-    # Remove figure environments
-    tex_content = re.sub(
-        r'\\begin\{figure\}.*?\\end\{figure\}',
-        r'% Figure environment removed',
-        tex_content,
-        flags=re.DOTALL
-    )
+    Scans the archive members as a stream and keeps in memory only the main
+    .tex file (first one containing \\documentclass) and the first .bib file.
+    Figures are removed from the main .tex and only paper.tex and references.bib
+    are written, so images and other members never touch the disk.
+    Members above MAX_MEMBER_SIZE are skipped and the archive is rejected once
+    it expands past decompression_budget() (see _bounded_members).
     
-    # Remove figure* environments
-    tex_content = re.sub(
-        r'\\begin\{figure\*\}.*?\\end\{figure\*\}',
-        r'% Figure environment removed',
-        tex_content,
-        flags=re.DOTALL
-    )
+    Args:
+        tar_path: Path to downloaded source (.tar.gz, gzip LaTeX or plain LaTeX)
+        version_dir: Version directory to write paper.tex / references.bib into
+        extra_environments: Extra environments for remove_figures_from_tex
+    
+    Returns:
+        Dictionary with statistics, or None if the source could not be read
+        or has no main .tex file
+    
+    Raises:
+        OversizedSourceError: If the source expands past the size limits
+    """
+    if not os.path.exists(tar_path):
+        logger.error(f"Failed to extract {tar_path}: file does not exist")
+        return None
+    
+    stats = {
+        'kept_tex': 0,
+        'kept_bib': 0,
+        'skipped': 0,
+        'oversized_skipped': 0,
+        'bytes_written': 0
+    }
+    tex_content = None
+    bib_content = None
+    
+    try:
+        with tarfile.open(tar_path, 'r|*') as tar:
+            for member in _bounded_members(tar, tar_path, stats):
+                name = member.name.lower()
+                if not member.isfile():
+                    continue
+                
+                if name.endswith('.tex') and tex_content is None:
+                    content = tar.extractfile(member).read()
+                    # Anywhere in the file: some sources open with a long license header
+                    if b'\\documentclass' in content:
+                        tex_content = content
+                        continue
+                elif name.endswith('.bib') and bib_content is None:
+                    bib_content = tar.extractfile(member).read()
+                    continue
+                
+                stats['skipped'] += 1
+    except tarfile.ReadError:
+        # Not a tar archive: gzip-compressed or plain LaTeX source
+        content = _read_single_file_source(tar_path)
+        if content is None:
+            return None
+        # Same rule as find_main_tex_file: the main file must declare \\documentclass
+        if b'\\documentclass' in content:
+            tex_content = content
+    except OversizedSourceError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to extract {tar_path}: {e}")
+        return None
+    
+    if not tex_content:
+        # A version without paper.tex is not a usable download
+        logger.error(f"Failed to extract {tar_path}: no .tex file declares \\documentclass")
+        return None
+    
+    ensure_dir(version_dir)
+    
+    cleaned = remove_figures_from_tex(tex_content.decode('utf-8', errors='ignore'), extra_environments)
+    paper_tex_path = os.path.join(version_dir, 'paper.tex')
+    _unlink_existing(paper_tex_path)
+    with open(paper_tex_path, 'w', encoding='utf-8') as f:
+        f.write(cleaned)
+    stats['kept_tex'] = 1
+    stats['bytes_written'] += os.path.getsize(paper_tex_path)
     
-    return tex_content
+    if bib_content:
+        ref_bib_path = os.path.join(version_dir, 'references.bib')
+        _unlink_existing(ref_bib_path)
+        with open(ref_bib_path, 'w', encoding='utf-8') as f:
+            f.write(bib_content.decode('utf-8', errors='ignore'))
+        stats['kept_bib'] = 1
+        stats['bytes_written'] += os.path.getsize(ref_bib_path)
+    
+    logger.info(f"Extracted {tar_path} to {version_dir}: kept {stats['kept_tex']} .tex, "
+                f"{stats['kept_bib']} .bib, skipped {stats['skipped']} other files")
+    return stats
+
+
+# Environments always removed by remove_figures_from_tex
+FIGURE_ENVIRONMENTS = ('figure', 'figure*')
+
+FIGURE_REPLACEMENT = '% Figure environment removed'
+INCLUDEGRAPHICS_REPLACEMENT = '% Figure removed'
+
+BEGIN_TAG = '\\begin{'
+INCLUDEGRAPHICS_TAG = '\\includegraphics'
+
+
+def _is_escaped(tex_content: str, position: int) -> bool:
+    """True if the character at position is preceded by an odd number of backslashes"""
+    backslashes = 0
+    while position > 0 and tex_content[position - 1] == '\\':
+        backslashes += 1
+        position -= 1
+    return backslashes % 2 == 1
+
+
+def _match_includegraphics_args(tex_content: str, start: int, line: Dict) -> int:
+    """
+    Match the arguments of \\includegraphics with the same rules as the old
+    regex (\\[.*?\\])?\\{.*?\\} (both parts on the current line), using
+    plain string searches
+    
+    The end of the line and the searches for "]{" and "}" are remembered in
+    `line` and reused by the next \\includegraphics on the same line, so a
+    line with many of them is still scanned a constant number of times.
+    
+    Args:
+        tex_content: TeX content
+        start: Position right after "\\includegraphics"
+        line: Search cache, one dict per remove_figures_from_tex call
+    
+    Returns:
+        End position of the command, or -1 if it does not match
+    """
+    eol = line.get('eol', -1)
+    if eol < start:
+        # First \\includegraphics on this line
+        line.clear()
+        eol = tex_content.find('\n', start)
+        line['eol'] = eol = len(tex_content) if eol == -1 else eol
+    
+    def search(pattern: str, begin: int) -> int:
+        # A result found from an earlier begin is still the first match from
+        # this one if it lies at or after it (-1: nothing up to eol)
+        cached = line.get(pattern)
+        if cached is not None and cached[0] <= begin and (cached[1] == -1 or cached[1] >= begin):
+            return cached[1]
+        found = tex_content.find(pattern, begin, eol)
+        line[pattern] = (begin, found)
+        return found
+    
+    if tex_content.startswith('[', start):
+        # Lazy [..] followed by { -> first "]{" on the line
+        bracket_end = search(']{', start)
+        if bracket_end == -1:
+            return -1
+        brace_start = bracket_end + 1
+    elif tex_content.startswith('{', start):
+        brace_start = start
+    else:
+        return -1
+    
+    brace_end = search('}', brace_start + 1)
+    if brace_end == -1:
+        return -1
+    return brace_end + 1
+
+
+@timed('figure_removal')
+def remove_figures_from_tex(tex_content: str, extra_environments: Optional[List[str]] = None) -> str:
+    """
+    Remove figure environments and includegraphics commands from TeX content
+    
+    Single left-to-right pass driven by str.find: each kind of token
+    (\\begin{, \\includegraphics, %) is searched for from a position that
+    only moves forward, so the document is scanned a constant number of
+    times. An environment is cut at its first matching \\end{...}; one
+    without any \\end is left untouched and never searched for again.
+    Commented-out text (after an unescaped %) is skipped.
+    
+    Args:
+        tex_content: Original TeX file content
+        extra_environments: Additional environments to remove
+            (e.g., ['wrapfigure', 'subfigure', 'tikzpicture'])
+    
+    Returns:
+        TeX content with figures removed
+    """
+    environments = set(FIGURE_ENVIRONMENTS) | set(extra_environments or ())
+    max_name = max(len(env) for env in environments)
+    find = tex_content.find
+    length = len(tex_content)
+    
+    pieces = []
+    copied_to = 0       # tex_content[:copied_to] is already in pieces
+    position = 0
+    unterminated = set()
+    line = {}           # searches of _match_includegraphics_args on the current line
+    next_begin = find(BEGIN_TAG)
+    next_graphics = find(INCLUDEGRAPHICS_TAG)
+    next_comment = find('%')
+    
+    while True:
+        # Refresh the tokens that fell behind the current position
+        if -1 < next_begin < position:
+            next_begin = find(BEGIN_TAG, position)
+        if -1 < next_graphics < position:
+            next_graphics = find(INCLUDEGRAPHICS_TAG, position)
+        if -1 < next_comment < position:
+            next_comment = find('%', position)
+        
+        candidates = [p for p in (next_begin, next_graphics, next_comment) if p != -1]
+        if not candidates:
+            break
+        token = min(candidates)
+        
+        if token == next_comment:
+            position = token + 1
+            if not _is_escaped(tex_content, token):
+                # Comment: skip to the next line
+                eol = find('\n', token)
+                position = length if eol == -1 else eol + 1
+        
+        elif token == next_begin:
+            name_start = token + len(BEGIN_TAG)
+            name_end = find('}', name_start, name_start + max_name + 1)
+            env = tex_content[name_start:name_end] if name_end != -1 else None
+            position = name_start
+            if env not in environments or env in unterminated:
+                continue
+            end_tag = '\\end{' + env + '}'
+            end = find(end_tag, name_end)
+            if end == -1:
+                # No closing tag anywhere after this point: keep it as is
+                unterminated.add(env)
+                continue
+            pieces.append(tex_content[copied_to:token])
+            pieces.append(FIGURE_REPLACEMENT)
+            copied_to = position = end + len(end_tag)
+        
+        else:
+            args_start = token + len(INCLUDEGRAPHICS_TAG)
+            end = _match_includegraphics_args(tex_content, args_start, line)
+            position = args_start
+            if end == -1:
+                continue
+            pieces.append(tex_content[copied_to:token])
+            pieces.append(INCLUDEGRAPHICS_REPLACEMENT)
+            copied_to = position = end
+    
+    pieces.append(tex_content[copied_to:])
+    return ''.join(pieces)
 
 
+@timed('remove_images')
 def remove_image_files(directory: str) -> int:
     """
     Remove common image file types from directory
@@ -210,9 +552,9 @@ def find_main_tex_file(tex_dir: str) -> Optional[str]:
             if file.endswith('.tex'):
                 file_path = os.path.join(root, file)
                 try:
+                    # Whole file: \\documentclass may follow a long comment header
                     with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read(2000)  # Read first 2000 chars
-                        if '\\documentclass' in content:
+                        if any('\\documentclass' in line for line in f):
                             return file_path
                 except Exception as e:
                     logger.debug(f"Error reading {file_path}: {e}")
@@ -236,6 +578,16 @@ def find_bib_file(tex_dir: str) -> Optional[str]:
     return None
 
 
+def _within_member_size(path: str) -> bool:
+    """Whether a file is small enough (MAX_MEMBER_SIZE) to be read into memory"""
+    size = os.path.getsize(path)
+    if size > MAX_MEMBER_SIZE:
+        logger.warning(f"Not keeping {path}: {size} bytes (limit {MAX_MEMBER_SIZE})")
+        return False
+    return True
+
+
+@timed('clean')
 def clean_version_folder(version_dir: str) -> Dict[str, int]:
     """
     Clean version folder to keep ONLY:
@@ -263,12 +615,13 @@ def clean_version_folder(version_dir: str) -> Dict[str, int]:
     tex_content = None
     bib_content = None
     
-    if main_tex and os.path.exists(main_tex):
+    # Files above MAX_MEMBER_SIZE are not loaded (and so are removed below)
+    if main_tex and os.path.exists(main_tex) and _within_member_size(main_tex):
         with open(main_tex, 'r', encoding='utf-8', errors='ignore') as f:
             tex_content = f.read()
         stats['kept_tex'] = 1
     
-    if main_bib and os.path.exists(main_bib):
+    if main_bib and os.path.exists(main_bib) and _within_member_size(main_bib):
         with open(main_bib, 'r', encoding='utf-8', errors='ignore') as f:
             bib_content = f.read()
         stats['kept_bib'] = 1
@@ -302,6 +655,7 @@ def clean_version_folder(version_dir: str) -> Dict[str, int]:
     return stats
 
 
+@timed('process_tex')
 def process_tex_files(tex_dir: str) -> Dict[str, int]:
     """
     Process all .tex files in directory to remove figures
@@ -345,10 +699,36 @@ def process_tex_files(tex_dir: str) -> Dict[str, int]:
     return stats
 
 
+def _file_stats(directory: str):
+    """stat results of all files below a directory (symlinked directories are not followed)"""
+    pending = [directory]
+    # Iterative scandir walk: directory entries carry their type, and their stat
+    # result is cached (free on Windows), unlike os.walk + os.stat per file
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                pending.append(entry.path)
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        # File removed by another worker while walking (e.g. temp tarball)
+                        continue
+                    yield st
+        except OSError:
+            # Directory removed while walking
+            continue
+
+
 def get_directory_size(directory: str) -> int:
     """
     Calculate total size of directory in bytes
     
+    Hardlinked files (see dedup.py) are counted once, as du does.
+    
     Args:
         directory: Directory path
     
@@ -356,14 +736,42 @@ def get_directory_size(directory: str) -> int:
         Total size in bytes
     """
     total_size = 0
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for filename in filenames:
-            filepath = os.path.join(dirpath, filename)
-            if os.path.exists(filepath):
-                total_size += os.path.getsize(filepath)
+    seen_inodes = set()
+    for st in _file_stats(directory):
+        if st.st_nlink > 1:
+            key = (st.st_dev, st.st_ino)
+            if key in seen_inodes:
+                continue
+            seen_inodes.add(key)
+        total_size += st.st_size
     return total_size
 
 
+def get_releasable_size(*directories: str) -> int:
+    """
+    Bytes freed by deleting directories
+    
+    A hardlinked file (see dedup.py) only frees its data once every link to it
+    is deleted; a paper.tex still linked from another paper frees nothing.
+    This is what get_directory_size of the enclosing tree drops by.
+    
+    Args:
+        directories: Directory paths
+    
+    Returns:
+        Size in bytes
+    """
+    total_size = 0
+    links = {}  # (st_dev, st_ino) -> [links seen, st_nlink, size]
+    for directory in directories:
+        for st in _file_stats(directory):
+            if st.st_nlink == 1:
+                total_size += st.st_size
+            else:
+                links.setdefault((st.st_dev, st.st_ino), [0, st.st_nlink, st.st_size])[0] += 1
+    return total_size + sum(size for seen, nlink, size in links.values() if seen >= nlink)
+
+
 def clean_temp_files(temp_dir: str):
     """
     Remove temporary files and directories
@@ -388,3 +796,38 @@ def ensure_dir(directory: str):
     """
     os.makedirs(directory, exist_ok=True)
 
+
+def atomic_write_json(path: str, data, indent: int = 2):
+    """
+    Write JSON through a temporary file and os.replace, so readers (and a crash
+    mid-write) never see a truncated file
+
+    Args:
+        path: Destination file
+        data: JSON-serializable data
+        indent: JSON indentation
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def open_sqlite(db_path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    """
+    Open a SQLite file for one connection shared by all threads
+    
+    The connection is in autocommit mode (batches use an explicit BEGIN) with a
+    WAL journal and synchronous=NORMAL: readers do not block the writer, and a
+    crash can lose the last commits but never corrupts the file.
+    
+    Args:
+        db_path: SQLite file
+    
+    Returns:
+        Tuple of (connection, lock every use of the connection must hold)
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn, threading.Lock()